@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+A stand-in for `bjobs` that makes up realistic jobs, for benchmarking gjobs without
+a cluster. It understands the options gjobs uses: -a, -u, -o "field:width ...",
+-json and job specs such as 1234 or 1234[5].
+
+Configured with environment variables:
+    FAKE_BJOBS_JOBS     how many jobs there are (default 1000)
+    FAKE_BJOBS_LATENCY  seconds to wait before printing anything (default 0)
+    FAKE_BJOBS_SEED     the same seed always gives the same jobs (default 0)
+    FAKE_BJOBS_STAMP    if set, the time when we finished printing is written there
+"""
+
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gjobs.bjobs_fields import bjobs_fields  # noqa: E402
+
+FIRST_JOB_ID = 200_000_000
+STATES = ["DONE"] * 50 + ["EXIT"] * 10 + ["RUN"] * 25 + ["PEND"] * 13 + ["USUSP"] * 2
+QUEUES = ["normal.4h", "normal.24h", "normal.120h", "gpu.4h", "bigmem.24h"]
+HOSTS = [f"eu-g{i % 9}-{i:03d}-{i % 4}" for i in range(40)]
+# Some job names are whole scripts (`bsub < script.sh`).
+LONG_NAME = (
+    '#!/bin/bash; #bsub -n 4 -W 24:00 -R "rusage[ngpus_excl_p=1]"; '
+    "module load gcc/8.2.0 python_gpu/3.8.5; source venv/bin/activate; "
+    + "python train.py --config=configs/experiment.gin --seed=1 \\; " * 8
+)
+CHUNK_SIZE = 256
+
+
+def format_timestamp(t, estimate=False):
+    s = datetime.datetime.fromtimestamp(t).strftime("%b %e %H:%M")
+    return s + " L" if estimate else s
+
+
+def format_seconds(seconds):
+    return f"{seconds} second(s)"
+
+
+def make_jobs(n_jobs, seed=0, now=None):
+    """
+    Yields the records of `n_jobs` jobs, the newest first, with all fields.
+    About one in ten jobs is a job array.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        # Stays the same between polls, so that the jobs don't change.
+        now = datetime.datetime.combine(
+            datetime.date.today(), datetime.time()
+        ).timestamp()
+    jobid = FIRST_JOB_ID + n_jobs
+    n = 0
+
+    while n < n_jobs:
+        jobid -= rng.randint(1, 20)
+        submit_time = now - (FIRST_JOB_ID + n_jobs - jobid) * 60 - rng.randint(0, 60)
+        name = LONG_NAME if rng.random() < 0.05 else f"experiment_{jobid % 997}"
+        array_size = rng.randint(2, 100) if rng.random() < 0.1 else 0
+        if array_size:
+            name = f"{name}[1-{array_size}]"
+
+        for jobindex in range(1, array_size + 1) if array_size else [0]:
+            if n == n_jobs:
+                return
+            yield make_record(rng, jobid, jobindex, name, submit_time, now)
+            n += 1
+
+
+def make_record(rng, jobid, jobindex, name, submit_time, now):
+    stat = rng.choice(STATES)
+    pend_time = rng.randint(0, 3600)
+    start_time = submit_time + pend_time
+    run_time = 0 if stat == "PEND" else rng.randint(1, 24 * 3600)
+    host = rng.choice(HOSTS)
+
+    record = {field["name"].upper(): "" for field in bjobs_fields}
+    record.update(
+        {
+            "JOBID": str(jobid),
+            "JOBINDEX": str(jobindex),
+            "STAT": stat,
+            "USER": "gjobsbench",
+            "QUEUE": rng.choice(QUEUES),
+            "JOB_NAME": name,
+            "COMMAND": name,
+            "PROJ_NAME": "default",
+            "FROM_HOST": "eu-login-21",
+            "SUBMIT_TIME": format_timestamp(submit_time),
+            "PEND_TIME": str(pend_time),
+            "RUN_TIME": format_seconds(run_time),
+            "CPU_USED": f"{run_time * 0.9:.1f} second(s)",
+            "RUNTIMELIMIT": rng.choice(["240.0", "1440.0", "7200.0"]),
+            "MEMLIMIT": rng.choice(["1 G", "4 G", "64 G"]),
+            "SUB_CWD": "$HOME",
+            "EXEC_CWD": f"/cluster/scratch/gjobsbench/{jobid % 13}",
+            "OUTPUT_FILE": f"lsf.o{jobid}",
+        }
+    )
+
+    if stat != "PEND":
+        record.update(
+            {
+                "EXEC_HOST": host,
+                "FIRST_HOST": host,
+                "START_TIME": format_timestamp(start_time),
+                "MAX_MEM": f"{rng.randint(1, 64000)} Mbytes",
+                "AVG_MEM": f"{rng.randint(1, 32000)} Mbytes",
+                "MEM": f"{rng.randint(1, 32000)} Mbytes",
+            }
+        )
+    if stat in ["DONE", "EXIT"]:
+        record["FINISH_TIME"] = format_timestamp(start_time + run_time)
+        record["EXIT_CODE"] = "" if stat == "DONE" else str(rng.randint(1, 255))
+    else:
+        record["ESTIMATED_START_TIME"] = format_timestamp(now + 600, estimate=True)
+        record["TIME_LEFT"] = f"{rng.randint(0, 23)}:{rng.randint(0, 59):02d} L"
+
+    # Older LSF versions (and some job types) leave fields out entirely.
+    if rng.random() < 0.05:
+        for field in rng.sample(
+            sorted(record.keys() - {"JOBID", "JOBINDEX", "STAT"}), 10
+        ):
+            del record[field]
+
+    return record
+
+
+def parse_args(args):
+    include_finished = False
+    fields = None
+    job_specs = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-a":
+            include_finished = True
+        elif args[i] in ["-o", "-u"]:
+            if args[i] == "-o":
+                fields = [f.split(":")[0].upper() for f in args[i + 1].split()]
+            i += 1
+        elif not args[i].startswith("-"):
+            job_specs.append(args[i])
+        i += 1
+    return include_finished, fields, job_specs
+
+
+def select_jobs(records, include_finished, job_specs):
+    if job_specs:
+        wanted = {spec: None for spec in job_specs}
+        for record in records:
+            for spec in [record["JOBID"], f"{record['JOBID']}[{record['JOBINDEX']}]"]:
+                if spec in wanted and wanted[spec] is None:
+                    wanted[spec] = record
+        for spec, record in wanted.items():
+            yield record or {"JOBID": spec, "ERROR": f"Job <{spec}> is not found"}
+        return
+
+    for record in records:
+        if include_finished or record["STAT"] not in ["DONE", "EXIT"]:
+            yield record
+
+
+def main():
+    include_finished, fields, job_specs = parse_args(sys.argv[1:])
+    n_jobs = int(os.environ.get("FAKE_BJOBS_JOBS", 1000))
+    seed = int(os.environ.get("FAKE_BJOBS_SEED", 0))
+    time.sleep(float(os.environ.get("FAKE_BJOBS_LATENCY", 0)))
+
+    records = select_jobs(make_jobs(n_jobs, seed), include_finished, job_specs)
+    if fields is not None:
+        records = (
+            (
+                record
+                if "ERROR" in record
+                else {f: record[f] for f in fields if f in record}
+            )
+            for record in records
+        )
+    write_json(list(records), sys.stdout)
+
+    stamp_file = os.environ.get("FAKE_BJOBS_STAMP")
+    if stamp_file:
+        with open(stamp_file, "w") as f:
+            f.write(repr(time.time()))
+
+
+def write_json(records, out):
+    """Like bjobs -json, but written in chunks, as bjobs streams it too."""
+    out.write(f'{{"COMMAND":"bjobs","JOBS":{len(records)},"RECORDS":[')
+    for i in range(0, len(records), CHUNK_SIZE):
+        if i > 0:
+            out.write(",")
+        out.write(",".join(json.dumps(r) for r in records[i : i + CHUNK_SIZE]))
+        out.flush()
+    out.write("]}\n")
+    out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for gjobs, using the fake bjobs in fake_bjobs.py. Prints the results
+as JSON, so that they can be compared between versions:
+
+    python benchmarks/run.py --sizes 10,1000,10000 > results.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rich.console  # noqa: E402
+
+import fake_bjobs  # noqa: E402
+from gjobs import gjobs  # noqa: E402
+from gjobs.job import job_from_record  # noqa: E402
+from gjobs.job_index import SortedJobIndex  # noqa: E402
+from gjobs.job_list import JobList  # noqa: E402
+from gjobs.output_follower import FileWatcher, OutputFollower  # noqa: E402
+from gjobs.output_viewer import OutputViewer  # noqa: E402
+from gjobs.parsing_bjobs import dict_keys_to_lowercase, iter_records  # noqa: E402
+from gjobs.parsing_bjobs import project_fields  # noqa: E402
+from gjobs.redraw import TABLE, RedrawScheduler  # noqa: E402
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+# The fields gjobs asks bjobs for.
+FIELDS = project_fields(gjobs.JOB_TABLE_FIELDS, OutputViewer.REQUIRED_FIELDS)
+TERMINAL_SIZE = (160, 50)
+
+
+def summarize(seconds):
+    """Statistics of a list of durations, in milliseconds."""
+    seconds = sorted(seconds)
+    return {
+        "n": len(seconds),
+        "median_ms": statistics.median(seconds) * 1000,
+        "p95_ms": seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)] * 1000,
+        "max_ms": seconds[-1] * 1000,
+    }
+
+
+def fake_bjobs_output(n_jobs):
+    """What `bjobs -a -o <FIELDS> -json` prints with `n_jobs` jobs."""
+    records = list(fake_bjobs.make_jobs(n_jobs))
+    records = [
+        {f.upper(): r[f.upper()] for f in FIELDS if f.upper() in r} for r in records
+    ]
+    out = io.StringIO()
+    fake_bjobs.write_json(records, out)
+    return out.getvalue().encode()
+
+
+def ingest(output):
+    index = SortedJobIndex()
+    for record in iter_records(io.BytesIO(output)):
+        index.set(job_from_record(dict_keys_to_lowercase(record)))
+    return index
+
+
+def bench_parse(n_jobs):
+    """Parsing the bjobs output into the sorted job index."""
+    output = fake_bjobs_output(n_jobs)
+
+    start = time.perf_counter()
+    records = [dict_keys_to_lowercase(r) for r in iter_records(io.BytesIO(output))]
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = SortedJobIndex()
+    for record in records:
+        index.set(job_from_record(record))
+    index.jobs()
+    ingest_time = time.perf_counter() - start
+    del records, index
+
+    tracemalloc.start()
+    index = ingest(output)
+    index.jobs()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "output_bytes": len(output),
+        "parse_s": parse_time,
+        "ingest_s": ingest_time,
+        "peak_memory_bytes": peak,
+    }
+
+
+class FakeBjobs:
+    """Puts the fake bjobs first in PATH, configured through the environment."""
+
+    def __init__(self, n_jobs, latency=0.0):
+        self.dir = tempfile.TemporaryDirectory(prefix="gjobs-bench-")
+        self.stamp_file = os.path.join(self.dir.name, "stamp")
+        path = os.path.join(self.dir.name, "bjobs")
+        with open(path, "w") as f:
+            fake = os.path.join(BENCHMARKS_DIR, "fake_bjobs.py")
+            f.write(f'#!/bin/sh\nexec {sys.executable} {fake} "$@"\n')
+        os.chmod(path, 0o755)
+
+        self.env = {
+            "PATH": f"{self.dir.name}{os.pathsep}{os.environ.get('PATH', '')}",
+            "FAKE_BJOBS_JOBS": str(n_jobs),
+            "FAKE_BJOBS_LATENCY": str(latency),
+            "FAKE_BJOBS_STAMP": self.stamp_file,
+            # Keep the history and the cache of unsupported fields out of the way.
+            "XDG_CACHE_HOME": os.path.join(self.dir.name, "cache"),
+            "XDG_CONFIG_HOME": os.path.join(self.dir.name, "config"),
+        }
+
+    def __enter__(self):
+        self.old_env = {key: os.environ.get(key) for key in self.env}
+        os.environ.update(self.env)
+        return self
+
+    def __exit__(self, *_):
+        for key, value in self.old_env.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+        self.dir.cleanup()
+
+    def last_output_time(self):
+        try:
+            with open(self.stamp_file) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return None
+
+
+def make_job_list(poll_interval):
+    return JobList(
+        poll_interval=datetime.timedelta(seconds=poll_interval),
+        fields=FIELDS,
+        keep_history=False,
+        use_daemon=False,
+    )
+
+
+def make_console():
+    width, height = TERMINAL_SIZE
+    return rich.console.Console(
+        file=io.StringIO(), width=width, height=height, force_terminal=True
+    )
+
+
+def render(console, layout):
+    console.file.seek(0)
+    console.file.truncate()
+    console.print(layout)
+
+
+def bench_frames(n_jobs, n_frames=50):
+    """Drawing the screen, from scratch and when only the cursor moves."""
+    with FakeBjobs(n_jobs):
+        job_list = make_job_list(poll_interval=3600)
+        job_list.poller.ready.wait()
+        cursor = gjobs.JobTableCursor()
+        output_viewer = OutputViewer()
+        console = make_console()
+
+        full = []
+        for _ in range(n_frames):
+            start = time.perf_counter()
+            render(console, gjobs.update(job_list, cursor, output_viewer))
+            full.append(time.perf_counter() - start)
+            cursor.move_index(+1)
+
+        screen = gjobs.Screen(console)
+        screen.update(job_list, cursor, output_viewer)
+        incremental = []
+        for _ in range(n_frames):
+            cursor.move_index(+1)
+            start = time.perf_counter()
+            screen.update(job_list, cursor, output_viewer, dirty={TABLE})
+            render(console, screen.layout)
+            incremental.append(time.perf_counter() - start)
+
+        job_list.close()
+        output_viewer.watcher.close()
+
+    return {"full_frame": summarize(full), "cursor_move": summarize(incremental)}
+
+
+def bench_tail(n_lines=200_000, n_appends=100):
+    """
+    Showing the end of a big output file the first time, and how long it takes for
+    a line appended to it to show up.
+    """
+    with tempfile.TemporaryDirectory(prefix="gjobs-bench-") as tmp:
+        path = os.path.join(tmp, "lsf.o1234")
+        with open(path, "w") as f:
+            for i in range(n_lines):
+                # Progress bars make for very long lines.
+                f.write("=" * 2000 + "\n" if i % 100 == 0 else f"line {i}\n")
+
+        watcher = FileWatcher()
+        follower = OutputFollower(path, gjobs.N_PREVIEW_LINES, watcher)
+        start = time.perf_counter()
+        follower.poll()
+        follower.get_text(gjobs.N_PREVIEW_LINES)
+        first_time = time.perf_counter() - start
+
+        def append():
+            with open(path, "a") as f:
+                for _ in range(n_appends):
+                    time.sleep(0.01)
+                    f.write(f"appended {time.perf_counter()!r}\n")
+                    f.flush()
+
+        # Without inotify, a poll a second later sees up to a second's worth of
+        # lines, and all of them need to be counted.
+        follower.resize(gjobs.N_PREVIEW_LINES + n_appends)
+        follower.poll()
+
+        writer = threading.Thread(target=append)
+        writer.start()
+        latencies = []
+        deadline = time.time() + 10 + n_appends * (0.01 + gjobs.OUTPUT_CHECK_INTERVAL)
+        while len(latencies) < n_appends and time.time() < deadline:
+            fds = [watcher.fileno()] if watcher.fileno() is not None else []
+            # Without inotify, we'd check once a second like gjobs does.
+            select.select(fds, [], [], gjobs.OUTPUT_CHECK_INTERVAL)
+            watcher.read_changes()
+            if follower.poll():
+                now = time.perf_counter()
+                for line in follower.get_text(follower.max_lines).splitlines():
+                    if line.startswith("appended "):
+                        written = float(line.split()[1])
+                        if not latencies or written > latencies[-1][0]:
+                            latencies.append((written, now - written))
+
+        writer.join()
+        inotify = watcher.fileno() is not None
+        watcher.close()
+
+    return {
+        "first_preview_s": first_time,
+        "inotify": inotify,
+        "append_to_preview": (
+            summarize([latency for _, latency in latencies]) if latencies else None
+        ),
+        "appends_missed": n_appends - len(latencies),
+    }
+
+
+def bench_poll_to_screen(n_jobs, latency, n_polls=5):
+    """From bjobs printing its output to the new jobs being on the screen."""
+    with FakeBjobs(n_jobs, latency) as fake:
+        job_list = make_job_list(poll_interval=0.2)
+        scheduler = RedrawScheduler()
+        job_list.add_listener(scheduler.wake)
+        console = make_console()
+        screen = gjobs.Screen(console)
+        cursor = gjobs.JobTableCursor()
+        output_viewer = OutputViewer()
+
+        latencies = []
+        last_output = None
+        deadline = time.time() + 60 + n_polls * (latency + 1)
+        while len(latencies) < n_polls and time.time() < deadline:
+            scheduler.wait([], timeout=1)
+            dirty = scheduler.take_dirty()
+            if screen.update(job_list, cursor, output_viewer, dirty=dirty):
+                render(console, screen.layout)
+            now = time.time()
+
+            output_time = fake.last_output_time()
+            snapshot = job_list.get_snapshot()
+            if (
+                output_time is not None
+                and output_time != last_output
+                and snapshot.time is not None
+                and snapshot.time.timestamp() >= output_time
+            ):
+                latencies.append(now - output_time)
+                last_output = output_time
+
+        job_list.close()
+        scheduler.close()
+        output_viewer.watcher.close()
+
+    return summarize(latencies) if latencies else None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BENCHMARKS_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="10,1000,10000,100000",
+        help="Comma-separated numbers of jobs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="How long the fake bjobs takes to answer, in seconds "
+        "(default: %(default)s)",
+    )
+    parser.add_argument("--output", help="Write the results here instead of stdout")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "terminal_size": TERMINAL_SIZE,
+            "bjobs_latency_s": args.latency,
+        },
+        "parse": {},
+        "frames": {},
+        "poll_to_screen": {},
+    }
+
+    for size in sizes:
+        print(f"{size} jobs...", file=sys.stderr)
+        results["parse"][size] = bench_parse(size)
+        results["frames"][size] = bench_frames(size)
+        results["poll_to_screen"][size] = bench_poll_to_screen(size, args.latency)
+
+    print("Output files...", file=sys.stderr)
+    results["tail"] = bench_tail()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import functools
+import json
+import os
+import re
+import subprocess
+import threading
+
+from .util import LOG, cache_dir, environment, write_atomically
+
+
+@functools.lru_cache()
+def cluster_key(env=()):
+    """
+    Identify the cluster and the LSF version using `lsid`, so that we know when
+    the set of fields supported by `bjobs` might have changed.
+    `env` selects the cluster, see `sources.Source`.
+    """
+    try:
+        res = subprocess.run(
+            ["lsid"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=30,
+            env=environment(env),
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        LOG.append(f"Could not run lsid: {e}")
+        return "unknown"
+
+    output = res.stdout.decode("utf-8", errors="replace")
+    lines = output.strip().splitlines()
+    # e.g. "IBM Spectrum LSF Standard 10.1.0.9, Jun 24 2020"
+    version = lines[0].split(",")[0] if lines else "unknown version"
+
+    match = re.search(r"My cluster name is (\S+)", output)
+    cluster = match.groups()[0] if match else "unknown cluster"
+
+    return f"{cluster} ({version})"
+
+
+class UnsupportedFieldCache:
+    """
+    Remembers which bjobs fields a cluster doesn't support, across gjobs sessions.
+    Otherwise, we'd have to find them by trial and error every time gjobs starts.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fields = None  # key -> set of field names, loaded lazily
+
+    def _get_path(self):
+        return self.path or os.path.join(cache_dir(), "unsupported_fields.json")
+
+    def _read(self):
+        try:
+            with open(self._get_path()) as f:
+                data = json.load(f)
+            return {key: set(fields) for key, fields in data.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            LOG.append(f"Ignoring unreadable unsupported field cache: {e}")
+            return {}
+
+    def get(self, key):
+        with self._lock:
+            if self._fields is None:
+                self._fields = self._read()
+            return set(self._fields.get(key, set()))
+
+    def add(self, key, field):
+        with self._lock:
+            if self._fields is None:
+                self._fields = self._read()
+
+            # Merge with what other sessions might have found in the meantime.
+            for other_key, fields in self._read().items():
+                self._fields.setdefault(other_key, set()).update(fields)
+            self._fields.setdefault(key, set()).add(field)
+
+            data = {k: sorted(fields) for k, fields in self._fields.items()}
+            try:
+                write_atomically(self._get_path(), json.dumps(data, indent=2))
+            except OSError as e:
+                LOG.append(f"Could not save unsupported field cache: {e}")
@@ -0,0 +1,351 @@
+import datetime
+import json
+import os
+import signal
+import socket
+import struct
+import threading
+from typing import Optional
+
+from .job import Job
+from .job_index import SortedJobIndex, diff_jobs
+from .poller import BjobsPoller, JobSnapshot
+from .sources import source_from_config, source_to_config
+from .util import LOG
+
+# A client that doesn't read what we send for this long is disconnected, so that it
+# doesn't hold up the others.
+SEND_TIMEOUT_SECONDS = 10
+# How long a client waits before trying to reconnect after losing the daemon. If
+# that fails, it polls bjobs itself.
+RECONNECT_INTERVAL_SECONDS = 5
+
+
+def socket_path():
+    """One daemon per user."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "gjobs.sock")
+    return f"/tmp/gjobs-{os.getuid()}.sock"
+
+
+def encode(message) -> bytes:
+    """Messages are sent as newline-delimited JSON."""
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def snapshot_message(snapshot: JobSnapshot):
+    return {
+        "type": "snapshot",
+        "jobs": [job.to_dict() for job in snapshot.jobs],
+        "poll_times": snapshot.poll_times,
+        **snapshot_metadata(snapshot),
+    }
+
+
+def diff_message(old: JobSnapshot, new: JobSnapshot):
+    changed, removed = diff_jobs(old.jobs, new.jobs)
+    return {
+        "type": "diff",
+        "changed": [job.to_dict() for job in changed],
+        "removed": removed,
+        "poll_times": new.poll_times,
+        **snapshot_metadata(new),
+    }
+
+
+def snapshot_metadata(snapshot: JobSnapshot):
+    return {
+        "time": snapshot.time.timestamp() if snapshot.time else None,
+        "error": snapshot.error,
+    }
+
+
+class PollingDaemon:
+    """
+    Polls bjobs on behalf of all gjobs instances of a user, so that having several
+    of them open doesn't multiply the load on the scheduler. Clients connect to a
+    Unix socket and get the current snapshot, and then the changes to it after
+    every poll.
+    """
+
+    def __init__(self, poller: BjobsPoller, fields, path=None):
+        self.poller = poller
+        self.fields = fields
+        self.path = path or socket_path()
+        self.clients = []
+        # Makes sure that every client sees each change exactly once.
+        self._lock = threading.Lock()
+        self._snapshot = JobSnapshot()
+        self.poller.listeners.append(self._broadcast)
+
+    def _hello(self):
+        return {
+            "type": "hello",
+            "sources": [source_to_config(source) for source in self.poller.sources],
+            "fields": self.fields,
+            "poll_interval": self.poller.poll_interval.total_seconds(),
+        }
+
+    def _with_poll_interval(self, message):
+        """The poller adapts its interval, so tell the clients when to expect more."""
+        return {**message, "poll_interval": self.poller.poll_interval.total_seconds()}
+
+    def _send(self, client, data):
+        try:
+            client.sendall(data)
+            return True
+        except OSError as e:
+            LOG.append(f"Disconnecting client: {e}")
+            client.close()
+            return False
+
+    def _broadcast(self):
+        with self._lock:
+            snapshot = self.poller.snapshot
+            if snapshot is self._snapshot:
+                return
+            data = encode(
+                self._with_poll_interval(diff_message(self._snapshot, snapshot))
+            )
+            self._snapshot = snapshot
+            self.clients = [c for c in self.clients if self._send(c, data)]
+
+    def _add_client(self, client):
+        client.settimeout(SEND_TIMEOUT_SECONDS)
+        with self._lock:
+            data = encode(self._hello()) + encode(
+                self._with_poll_interval(snapshot_message(self._snapshot))
+            )
+            if self._send(client, data):
+                self.clients.append(client)
+
+    def _bind(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.path):
+            probe = connect(self.path)
+            if probe is not None:
+                probe.close()
+                raise RuntimeError(
+                    f"A gjobs daemon is already listening on {self.path}"
+                )
+            # Left over from a daemon that didn't exit cleanly.
+            os.unlink(self.path)
+
+        old_umask = os.umask(0o077)  # only for us
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        return server
+
+    def serve_forever(self):
+        server = self._bind()
+        # Exit cleanly, removing the socket, when we're killed.
+        signal.signal(signal.SIGTERM, lambda *_: server.close())
+        self.poller.start()
+
+        try:
+            while True:
+                try:
+                    client, _ = server.accept()
+                except OSError:
+                    break  # closed by the signal handler
+                self._add_client(client)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.poller.stop()
+            server.close()
+            os.unlink(self.path)
+            for client in self.clients:
+                client.close()
+
+
+def peer_uid(sock, path) -> int:
+    """The user running the other end of `sock`, or owning the socket at `path`."""
+    if hasattr(socket, "SO_PEERCRED"):
+        # struct ucred {pid_t pid; uid_t uid; gid_t gid;}
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        return struct.unpack("3i", creds)[1]
+    return os.stat(path).st_uid
+
+
+def connect(path=None) -> Optional[socket.socket]:
+    path = path or socket_path()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        # Anyone can create the socket in /tmp before we do, so only trust our own.
+        if peer_uid(client, path) != os.getuid():
+            LOG.append(f"Not using {path}: it belongs to another user")
+            client.close()
+            return None
+        return client
+    except OSError:
+        client.close()
+        return None
+
+
+class DaemonClient:
+    """
+    Gets the jobs from a `PollingDaemon` instead of running bjobs. Can be used
+    instead of a `BjobsPoller`: `snapshot` is kept up to date and `listeners` are
+    called whenever it changes. If the daemon goes away and doesn't come back, we
+    poll bjobs ourselves, using the `BjobsPoller` that `fallback()` returns.
+    """
+
+    def __init__(self, sock, reader, hello, path=None, fallback=None):
+        self.path = path or socket_path()
+        self.fallback = fallback
+        # The poller we fell back to, once we have.
+        self.poller = None
+        self.sources = [source_from_config(source) for source in hello["sources"]]
+        self.poll_interval = datetime.timedelta(seconds=hello["poll_interval"])
+        self.snapshot = JobSnapshot()
+        self.listeners = []
+        # Set once we have the jobs.
+        self.ready = threading.Event()
+        self.index = SortedJobIndex()
+
+        self._socket = sock
+        self._reader = reader
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="gjobs-daemon-client", daemon=True
+        )
+
+    @classmethod
+    def connect(
+        cls, sources, fields, path=None, fallback=None
+    ) -> Optional["DaemonClient"]:
+        """
+        Connect to the daemon, if one is running and polls what we need: the same
+        `sources` and at least our `fields`. Otherwise, return None.
+        """
+        sock = connect(path)
+        if sock is None:
+            return None
+
+        reader = sock.makefile("rb")
+        try:
+            hello = json.loads(reader.readline())
+            daemon_sources = [source_from_config(source) for source in hello["sources"]]
+            daemon_fields = hello["fields"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            LOG.append(f"Not using the gjobs daemon: {e!r}")
+            sock.close()
+            return None
+
+        if daemon_sources != list(sources) or (
+            daemon_fields is not None
+            and (fields is None or not set(fields) <= set(daemon_fields))
+        ):
+            LOG.append("Not using the gjobs daemon: it polls different jobs")
+            sock.close()
+            return None
+
+        return cls(sock, reader, hello, path, fallback)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.poller is not None:
+            self.poller.stop()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)  # wakes up the reader thread
+        except (OSError, AttributeError):
+            pass
+
+    def _publish(self, snapshot):
+        self.snapshot = snapshot
+        for listener in self.listeners:
+            listener()
+
+    def _apply(self, message):
+        if message["type"] == "hello":
+            return
+        elif message["type"] == "snapshot":
+            index = SortedJobIndex()
+            for job in message["jobs"]:
+                index.set(Job.from_dict(job))
+            # Versions must never repeat, even if we reconnect.
+            index.version += self.index.version + 1
+            self.index = index
+        elif message["type"] == "diff":
+            for job in message["changed"]:
+                self.index.set(Job.from_dict(job))
+            for job_key, source in message["removed"]:
+                self.index.remove(tuple(job_key), source)
+        else:
+            LOG.append(f"Unknown message from the gjobs daemon: {message['type']}")
+            return
+
+        if "poll_interval" in message:
+            self.poll_interval = datetime.timedelta(seconds=message["poll_interval"])
+        time = message["time"]
+        self._publish(
+            JobSnapshot(
+                self.index.jobs(),
+                datetime.datetime.fromtimestamp(time) if time is not None else None,
+                message["error"],
+                self.index.version,
+                poll_times=message.get("poll_times"),
+            )
+        )
+        if self.snapshot.time is not None or self.snapshot.error is not None:
+            self.ready.set()
+
+    def _receive(self):
+        for line in self._reader:
+            self._apply(json.loads(line))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._receive()
+            except (OSError, ValueError) as e:
+                LOG.append(f"Lost the connection to the gjobs daemon: {e}")
+            self._reader.close()
+            self._socket.close()
+            self._socket = None
+
+            if self._stop.is_set():
+                break
+            # The daemon was stopped; keep showing the data we have until it's back,
+            # or until we have polled bjobs ourselves.
+            self._publish(
+                self.snapshot._replace(error="lost the connection to the gjobs daemon")
+            )
+            if self._stop.wait(RECONNECT_INTERVAL_SECONDS):
+                break
+            self._socket = connect(self.path)
+            if self._socket is not None:
+                self._reader = self._socket.makefile("rb")
+            elif self.fallback is not None:
+                LOG.append("The gjobs daemon is gone, polling bjobs instead")
+                self._start_fallback()
+                break
+
+    def _start_fallback(self):
+        poller = self.fallback()
+        # Versions must never repeat, as when we reconnect.
+        poller.index.version = self.index.version + 1
+        poller.listeners.append(lambda: self._forward(poller))
+        self.poller = poller
+        poller.start()
+        if self._stop.is_set():
+            poller.stop()
+
+    def _forward(self, poller):
+        snapshot = poller.snapshot
+        # Until every source has been polled, keep the daemon's data.
+        if snapshot.time is None and snapshot.error is None:
+            return
+        self.poll_interval = poller.poll_interval
+        self._publish(snapshot)
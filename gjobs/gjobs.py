@@ -1,27 +1,149 @@
 import re
-from typing import Optional
+from typing import Optional, Tuple
+import argparse
+import contextlib
 import datetime as dt
 import functools
+import math
+import os
+import sys
+import termios
+import time
+import tty
 
-import humanize
 import rich
 from rich.live import Live
 from rich.table import Table
 from rich.layout import Layout
 from rich.highlighter import ReprHighlighter
-from blessed import Terminal
 
-from gjobs.job_list import JobList
+from gjobs.job_list import JobList, BJOBS_TIMEOUT_SECONDS
+from .job import Job
 from .util import LOG
-from .output_viewer import OutputViewer, N_PREVIEW_LINES
-from .parsing_bjobs import parse_run_time
+from .metrics import METRICS
+from .output_viewer import OutputViewer, N_PREVIEW_LINES, MAX_FOLLOWERS, job_label
+from .redraw import RedrawScheduler, ALL_REGIONS, TABLE, PREVIEW, STATUS
+from .parsing_bjobs import project_fields
+from .spool_index import DEFAULT_LSBATCH_DIR
+from .sources import load_sources
+from .daemon import PollingDaemon
+from .history import open_histories
+from .poller import BjobsPoller
+from .bjobs_fields import bjobs_fields
+from . import headless, poll_schedule
+from .job_arrays import ArrayGrouping, JobArray, is_array_element
+from .job_index import find_job, job_sort_key
+from .job_filter import JobFilter
+from .log_search import LogSearch
+from .pager import Pager
+from .resource_history import ResourceHistory, merge_values, MAX_SAMPLES
 
-term = Terminal()
 DEBUG = False
 
+# How often to check whether the output of a running job has grown, in seconds.
+# Inotify tells us about local writes right away, but on network filesystems,
+# the job writes from another machine, so we also need to check by ourselves.
+OUTPUT_CHECK_INTERVAL = 1
 
-def humanize_timedelta(seconds):
-    return humanize.naturaldelta(dt.timedelta(seconds=int(seconds)))
+# Only used to measure how text gets wrapped.
+MEASURE_CONSOLE = rich.console.Console()
+
+# The job fields that `generate_job_table()` and `format_job_status()` look at.
+JOB_TABLE_FIELDS = [
+    "jobid",
+    "submit_time",
+    "start_time",
+    "stat",
+    "pend_time",
+    "run_time",
+    "job_name",
+]
+# The states in which the time shown for a job keeps growing between polls.
+TICKING_STATES = ["RUN", "PEND"]
+SPARKLINE_BARS = "▁▂▃▄▅▆▇█"
+# How many bars of memory usage the job table shows.
+TABLE_SPARKLINE_WIDTH = 8
+# Memory usage is shown in red from this fraction of the job's memory limit on.
+MEMORY_WARNING_FRACTION = 0.9
+# How many jobs the tiled view shows the output of. Each one needs a follower.
+MAX_TILES = MAX_FOLLOWERS
+# Tiles are put side by side if they can be at least this wide.
+MIN_TILE_WIDTH = 40
+
+
+@functools.lru_cache(maxsize=4096)
+def humanize_timedelta(seconds: int):
+    """Pass whole seconds, so that the table redrawn every second hits the cache."""
+    # Imported here to start up faster.
+    import humanize
+
+    return humanize.naturaldelta(dt.timedelta(seconds=seconds))
+
+
+def format_duration_short(seconds):
+    """e.g. "5m"; for where `humanize_timedelta()` takes too much space."""
+    seconds = int(seconds)
+    for unit, size in [("d", 24 * 3600), ("h", 3600), ("m", 60)]:
+        if seconds >= size:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+def format_bytes_short(n):
+    """e.g. "2.6G", like `format_duration_short()`."""
+    for unit in "BKMGT":
+        if n < 1024 or unit == "T":
+            break
+        n /= 1024
+    return f"{n:.1f}{unit}" if n < 10 and unit != "B" else f"{n:.0f}{unit}"
+
+
+def sparkline(values, width, top=None):
+    """
+    `values` as a line of bars from 0 to `top`, by default the largest value. If
+    there are more than `width`, neighbouring values are merged by taking the
+    largest. Missing values (NaN) are left blank.
+    """
+    if len(values) > width:
+        per_bar = len(values) / width
+        values = [
+            functools.reduce(
+                merge_values, values[int(i * per_bar) : int((i + 1) * per_bar)]
+            )
+            for i in range(width)
+        ]
+    if not top:
+        top = max((value for value in values if not math.isnan(value)), default=0)
+
+    bars = []
+    for value in values:
+        if math.isnan(value):
+            bars.append(" ")
+        else:
+            level = int(value / top * len(SPARKLINE_BARS)) if top > 0 else 0
+            bars.append(SPARKLINE_BARS[max(min(level, len(SPARKLINE_BARS) - 1), 0)])
+    return "".join(bars)
+
+
+def memory_top(job, series):
+    """What to scale memory sparklines to: the memory limit, unless it's exceeded."""
+    memlimit = job.get("memlimit") or 0
+    peak = series.last("max_mem") or 0
+    return max(memlimit, peak, *(v for v in series.values("mem") if not math.isnan(v)))
+
+
+def format_memory_cell(job, series):
+    """The job's recent memory usage, in red when it's close to the limit."""
+    mem = series.last("mem")
+    if mem is None:
+        return ""
+    memlimit = job.get("memlimit")
+    color = "cyan"
+    if memlimit and mem >= MEMORY_WARNING_FRACTION * memlimit:
+        color = "red"
+    values = series.values("mem")[-TABLE_SPARKLINE_WIDTH:]
+    bars = sparkline(values, TABLE_SPARKLINE_WIDTH, top=memory_top(job, series))
+    return f"[{color}]{bars}[/] {format_bytes_short(mem)}"
 
 
 def add_ellipsis_if_long(s, limit=30):
@@ -31,21 +153,65 @@ def add_ellipsis_if_long(s, limit=30):
         return s[:limit] + "..."
 
 
-def format_job_status(job):
-    """Display the job status in a nice way."""
-    if job["stat"] == "PEND":
-        return f"⏳[yellow]{humanize_timedelta(job['pend_time'])}"
-    elif job["stat"] == "RUN":
-        run_time_seconds = parse_run_time(job["run_time"])
+def format_timestamp(timestamp):
+    """Like bjobs does it, e.g. "Mar 10 09:33"."""
+    if timestamp is None:
+        return ""
+    return dt.datetime.fromtimestamp(timestamp).strftime("%b %d %H:%M")
+
+
+def current_duration(job, now, poll_times=None):
+    """
+    How long a running or pending job has been so at `now`, in seconds, or None.
+    bjobs' `run_time` and `pend_time` are as of the poll, so we extrapolate them
+    from the poll time of the job's source in `poll_times` (see `JobSnapshot`)
+    instead of polling more often to keep them up to date.
+    """
+    if job.stat == "RUN":
+        reported, since = job.run_time, job.get("start_time")
+    elif job.stat == "PEND":
+        reported, since = job.pend_time, job.get("submit_time")
+    else:
+        return None
+
+    if reported is None:
+        return max(now - since, 0) if since is not None else None
+    polled_at = poll_times.get(job.get("source") or "") if poll_times else None
+    return reported + max(now - polled_at, 0) if polled_at is not None else reported
+
+
+STATUS_COLORS = {"RUN": "green", "PEND": "yellow", "EXIT": "red", "DONE": "white"}
 
-        if run_time_seconds is not None:
-            return f"[green]{humanize_timedelta(run_time_seconds)}"
+
+def format_job_status(job, now=None, poll_times=None):
+    """Display the job status in a nice way."""
+    duration = current_duration(job, now or time.time(), poll_times)
+    if job.stat == "PEND" and duration is not None:
+        return f"⏳[yellow]{humanize_timedelta(int(duration))}"
+    elif job.stat == "RUN":
+        if duration is not None:
+            return f"[green]{humanize_timedelta(int(duration))}"
         else:
-            LOG.append(f"Could not parse run_time '{job['run_time']}'")
+            LOG.append(f"Job {job.jobid} has no run_time")
             return "[green]RUN"
 
-    d = {"RUN": "[green]RUN", "EXIT": "[red]EXIT", "DONE": "[white]DONE"}
-    return d.get(job["stat"], job["stat"])
+    color = STATUS_COLORS.get(job.stat)
+    return f"[{color}]{job.stat}" if color else job.stat
+
+
+def format_array_status(array):
+    """
+    How many elements of `array` are in each state, and their minimum, median and
+    maximum run time.
+    """
+    counts = [
+        f"[{STATUS_COLORS.get(stat, 'default')}]{n} {stat}[/]"
+        for stat, n in sorted(array.counts.items(), key=lambda item: -item[1])
+    ]
+    run_times = array.run_time_stats()
+    if run_times is not None:
+        counts.append("[dim]" + "/".join(map(format_duration_short, run_times)))
+    return " ".join(counts)
 
 
 class JobTableCursor:
@@ -54,6 +220,8 @@ class JobTableCursor:
         self.n_jobs = 0
         # The index of the first job that is shown.
         self.scroll = 0
+        # How many jobs are shown at once.
+        self.page_size = 1
 
     def update(self, jobs):
         self.n_jobs = len(jobs)
@@ -70,55 +238,138 @@ class JobTableCursor:
         self.index += difference
         self.get_index()  # to clamp
 
-    def get_job(self, jobs) -> Optional[dict]:
+    def get_job(self, jobs) -> Optional[Job]:
         if self.index < len(jobs):
             return jobs[self.index]
         else:
             return None
 
+    def move_to(self, index):
+        self.index = index
+        self.get_index()  # to clamp
+
+    def visible_jobs(self, jobs):
+        """The jobs that were on the screen the last time the table was drawn."""
+        return jobs[self.scroll : self.scroll + self.page_size]
+
     def update_scroll(self, n_visible, jobs):
-        while self.scroll > self.index:
-            self.scroll -= 1
+        """Keep the cursor visible. Constant time, however far we've jumped."""
+        self.page_size = n_visible
+        index = self.get_index()
 
-        while self.index > self.scroll + n_visible - 1:
-            self.scroll += 1
+        self.scroll = min(self.scroll, index)
+        self.scroll = max(self.scroll, index - n_visible + 1)
 
         # Don't scroll down too low unnecessarily
-        while self.scroll + n_visible - 1 >= len(jobs):
-            self.scroll -= 1
-
+        self.scroll = min(self.scroll, len(jobs) - n_visible)
         self.scroll = max(self.scroll, 0)
 
 
-def generate_job_table(jobs, cursor, region) -> Table:
-    """Make a new table."""
+# Formatted table cells of the jobs we've shown recently, except for the status,
+# which changes with time. Jobs are replaced by new objects when they change, so
+# they can be used as keys.
+JOB_ROW_CACHE = {}
+JOB_ROW_CACHE_SIZE = 1000
+
+
+def format_job_row(job, now=None, poll_times=None):
+    cells = JOB_ROW_CACHE.get(job)
+    if cells is None:
+        if len(JOB_ROW_CACHE) >= JOB_ROW_CACHE_SIZE:
+            JOB_ROW_CACHE.clear()
+
+        cells = (
+            f"  {job.jobid}[{job.jobindex}]" if is_array_element(job) else job.jobid,
+            job.get("source") or "",
+            format_timestamp(job.submit_time),
+            add_ellipsis_if_long(job.job_name or ""),
+        )
+        JOB_ROW_CACHE[job] = cells
+
+    jobid, source, submitted, name = cells
+    return jobid, source, submitted, format_job_status(job, now, poll_times), name
+
+
+def format_array_row(array, expanded):
+    return (
+        f"{'▾' if expanded else '▸'} {array.jobid}",
+        array.source,
+        format_timestamp(array.submit_time),
+        format_array_status(array),
+        add_ellipsis_if_long(f"{array.job_name} ({len(array)} jobs)"),
+    )
+
+
+def selected_job(row) -> Optional[Job]:
+    """The job whose output and details to show when `row` is selected."""
+    return row.representative() if isinstance(row, JobArray) else row
+
+
+@METRICS.timed("table build")
+def generate_job_table(
+    jobs,
+    cursor,
+    region,
+    show_source=False,
+    now=None,
+    arrays=None,
+    stale=False,
+    resources=None,
+    marked=frozenset(),
+    poll_times=None,
+) -> Table:
+    """
+    Make a new table. Only the visible jobs are rendered, so this takes the same time
+    no matter how many jobs there are.
+    If `show_source` is set, there is a column for the cluster/user a job is from.
+    Run and pending times are shown as of `now`, extrapolated from `poll_times` (see
+    `current_duration()`). `jobs` can contain `JobArray`s, which are shown as
+    expanded if `arrays` (an `ArrayGrouping`) says so.
+    The jobs are dimmed if they're `stale`. If `resources` (a `ResourceHistory`) is
+    given, there is a column with the recent memory usage of the jobs. The jobs whose
+    `job_sort_key()` is in `marked` have a mark.
+    """
 
     table = Table(width=region.width)
     table.add_column("ID")
+    if show_source:
+        table.add_column("Source")
     table.add_column("Submitted")
-    table.add_column("Status")
-    table.add_column("Name")
+    # Array rows can have long statuses; rows must stay one line high.
+    table.add_column("Status", no_wrap=True, overflow="ellipsis", max_width=36)
+    # Takes whatever width the other columns leave, so that rows stay one line high.
+    table.add_column("Name", no_wrap=True, overflow="ellipsis", ratio=1)
+    if resources is not None:
+        table.add_column("Memory", no_wrap=True)
 
     n_jobs_visible = region.height - 4
     if n_jobs_visible <= 0 or not jobs:
         return table
 
     cursor.update_scroll(n_jobs_visible, jobs)
+    selected = cursor.get_index()
+    row_style = rich.style.Style(dim=stale)
+    selected_style = row_style + rich.style.Style(bgcolor="rgb(60,60,60)")
 
     for i in range(cursor.scroll, min(cursor.scroll + n_jobs_visible, len(jobs))):
-        job = jobs[i]
-        style = (
-            rich.style.Style(bgcolor="rgb(60,60,60)")
-            if i == cursor.get_index()
-            else None
-        )
-
+        row = jobs[i]
+        if isinstance(row, JobArray):
+            cells = format_array_row(
+                row, arrays is not None and arrays.is_expanded(row)
+            )
+        else:
+            cells = format_job_row(row, now, poll_times)
+        if resources is not None:
+            series = None if isinstance(row, JobArray) else resources.get(row)
+            cells += (format_memory_cell(row, series) if series else "",)
+        jobid, source, *cells = cells
+        if marked and not isinstance(row, JobArray) and job_sort_key(row) in marked:
+            jobid = f"[magenta]●[/] {jobid}"
         table.add_row(
-            job["jobid"],
-            job["submit_time"],
-            format_job_status(job),
-            add_ellipsis_if_long(job["job_name"]),
-            style=style,
+            jobid,
+            *([source] if show_source else []),
+            *cells,
+            style=selected_style if i == selected else row_style,
         )
 
     return table
@@ -127,31 +378,35 @@ def generate_job_table(jobs, cursor, region) -> Table:
 echo = functools.partial(print, end="", flush=True)
 
 
+@functools.lru_cache(maxsize=4096)
+def wrapped_height(line, width):
+    """How many lines `line` takes up when it's wrapped at `width` cells."""
+    return max(len(rich.text.Text(line).wrap(MEASURE_CONSOLE, width)), 1)
+
+
+@METRICS.timed("preview render")
 def render_output_preview(output_preview, filename, region):
     """
     We get the exact number of preview lines we want, but some of them might be too long
     and get wrapped. In this case, the extra lines overflow at the bottom, but we want
     overflow at the top (and there seems to be no way to fix this natively in Rich).
-    To fix this, we cut lines from the top until all lines fit.
+    To fix this, we keep the longest suffix of the lines that fits. The height of each
+    line is only measured once, so long lines (progress bars...) don't make this slow.
     """
-    console = rich.console.Console()
-
     lines = output_preview.split("\n")
+    # Subtract 4 from the width because of the panel's frame + padding
+    width = max(region.width - 4, 1)
+    available_height = region.height - 2
 
-    while True:
-        if len(lines) == 1:
-            # Do not remove the last line even if the line overflows.
-            break
-
-        # Subtract 4 from the width because of the panel's frame + padding
-        rendered_lines = console.render_lines(
-            "\n".join(lines), console.options.update_width(region.width - 4)
-        )
-
-        if len(rendered_lines) <= region.height - 2:
+    # Do not remove the last line even if the line overflows.
+    first_line = len(lines) - 1
+    used_height = wrapped_height(lines[first_line], width)
+    while first_line > 0:
+        used_height += wrapped_height(lines[first_line - 1], width)
+        if used_height > available_height:
             break
-        else:
-            del lines[0]
+        first_line -= 1
+    lines = lines[first_line:]
 
     panel = rich.panel.Panel(
         rich.align.Align(ReprHighlighter()("\n".join(lines))),
@@ -161,78 +416,1005 @@ def render_output_preview(output_preview, filename, region):
     return panel
 
 
-def update(job_list, cursor, output_viewer):
-    # LOG.append( dt.datetime.now())
-    jobs = job_list.get_jobs()
-    cursor.update(jobs)
+def render_resource_usage(job, series, width):
+    """Sparklines of the memory, CPU and threads of a job, as sampled at each poll."""
+    table = Table.grid(padding=(0, 2))
+    table.add_column(style="bold")
+    table.add_column(no_wrap=True, style="cyan")
+    table.add_column()
 
-    job_table_layout = rich.layout.Layout(size=10)
-    output_preview_layout = rich.layout.Layout()
-    content_layout = Layout()
-    content_layout.split_column(job_table_layout, output_preview_layout)
+    memlimit = job.get("memlimit")
+    top = memory_top(job, series)
+    for field in ["mem", "max_mem", "avg_mem", "swap"]:
+        last = series.last(field)
+        if last is not None:
+            value = format_bytes_short(last)
+            if memlimit and field == "mem":
+                value += f" of {format_bytes_short(memlimit)} limit"
+            table.add_row(field, sparkline(series.values(field), width, top), value)
 
-    if DEBUG:
-        log_panel = rich.layout.Layout(
-            rich.panel.Panel("\n".join([str(x) for x in LOG[-5:]]), title="Debug log"),
-            size=5 + 2,
+    cores = series.cpu_cores()
+    if any(not math.isnan(value) for value in cores):
+        table.add_row("cpu", sparkline(cores, width), f"{cores[-1]:.1f} cores")
+    nthreads = series.last("nthreads")
+    if nthreads is not None:
+        table.add_row(
+            "nthreads", sparkline(series.values("nthreads"), width), f"{nthreads:.0f}"
         )
-        layout = Layout()
-        layout.split_column(content_layout, log_panel)
+
+    run_times = series.values("run_time")
+    if len(run_times) > 1 and not math.isnan(run_times[0]):
+        span = humanize_timedelta(int(run_times[-1] - run_times[0]))
+        table.add_row("", rich.text.Text(f"over the last {span}", style="dim"), "")
+    return table
+
+
+def render_job_details(job, details, series=None, width=MAX_SAMPLES):
+    """
+    Show all the fields of a job that bjobs gave us a value for, and its resource
+    usage over time if there is a `series` (see `ResourceHistory`).
+    """
+    if details is None:
+        return rich.panel.Panel(
+            f"Loading details of job {job.jobid}...", title="Details"
+        )
+
+    table = Table.grid(padding=(0, 2))
+    table.add_column(style="bold")
+    table.add_column()
+
+    for key, value in details.items():
+        if value not in ["", "-", []]:
+            table.add_row(key, rich.text.Text(str(value)))
+
+    if series is not None and series.length:
+        table = rich.console.Group(
+            render_resource_usage(job, series, width), rich.text.Text(), table
+        )
+    return rich.panel.Panel(table, title=f"Details of job {job.jobid}")
+
+
+def render_metrics(metrics):
+    """Show the timings and counters from `Metrics.to_dict()`."""
+    timings = Table(box=None, padding=(0, 2))
+    timings.add_column("Timing")
+    for column in ["count", "mean", "p50", "p95", "max", "last"]:
+        timings.add_column(column, justify="right")
+
+    for name, histogram in metrics["timings"].items():
+        timings.add_row(
+            name,
+            str(histogram["count"]),
+            *[
+                f"{histogram[key]:.1f} ms"
+                for key in ["mean_ms", "p50_ms", "p95_ms", "max_ms", "last_ms"]
+            ],
+        )
+
+    counters = Table(box=None, padding=(0, 2))
+    counters.add_column("Counter")
+    counters.add_column("count", justify="right")
+    for name, count in metrics["counters"].items():
+        counters.add_row(name, str(count))
+
+    grid = Table.grid(padding=(0, 4))
+    grid.add_row(timings, counters)
+    return rich.panel.Panel(grid, title="Performance (P to close)")
+
+
+@METRICS.timed("search render")
+def render_search_results(log_search, region):
+    """One line per file with hits: its job, where the first hit is, and the line."""
+    results = list(log_search.results)
+    available_height = region.height - 2
+    if len(results) > available_height:
+        shown = results[: available_height - 1]
     else:
-        layout = content_layout
+        shown = results
 
-    # Get the height of the output preview part.
-    console = rich.console.Console()
-    render_map = layout.render(console, console.options)
-    output_preview_region = render_map[output_preview_layout].region
+    lines = []
+    for file_hits in shown:
+        line_number, line = file_hits.hits[0]
+        line_text = rich.text.Text(no_wrap=True, overflow="ellipsis")
+        line_text.append(f"{file_hits.label:>12}  ", style="bold")
+        location = f"{os.path.basename(file_hits.path)}:{line_number}"
+        if len(file_hits.hits) > 1:
+            location += f" (+{len(file_hits.hits) - 1})"
+        line_text.append(location, style="cyan")
+        line_text.append(f"  {line.strip()}")
+        lines.append(line_text)
+    if len(shown) < len(results):
+        lines.append(
+            rich.text.Text(f"... and {len(results) - len(shown)} more", style="dim")
+        )
 
-    filename, output_preview = output_viewer.get_output_preview(
-        cursor.get_job(jobs), n_preview_lines=output_preview_region.height
+    title = (
+        f"{rich.markup.escape(repr(log_search.text))} in "
+        f"{len(results)} of {log_search.n_files} files"
     )
+    if not log_search.done:
+        title += f", searched {log_search.n_searched}"
+    return rich.panel.Panel(
+        rich.console.Group(*lines), title=title, subtitle="Esc to close"
+    )
+
+
+@METRICS.timed("tiles render")
+def render_tiles(previews, region):
+    """
+    The outputs of several jobs side by side, as a grid of `render_output_preview()`s.
+    `previews` are (title, output) pairs.
+    """
+    if not previews:
+        return rich.panel.Panel(
+            "Mark jobs with Space to follow their output here.", title="Tiles"
+        )
 
-    job_table_layout.update(
-        generate_job_table(jobs, cursor, region=render_map[job_table_layout].region)
+    n_columns = min(len(previews), max(region.width // MIN_TILE_WIDTH, 1))
+    n_rows = math.ceil(len(previews) / n_columns)
+    n_columns = math.ceil(len(previews) / n_rows)
+    tile_region = rich.region.Region(
+        0, 0, region.width // n_columns, max(region.height // n_rows, 3)
     )
 
-    output_preview_layout.update(
-        render_output_preview(output_preview, filename, output_preview_region)
+    grid = Table.grid(expand=True)
+    for _ in range(n_columns):
+        grid.add_column(ratio=1)
+    panels = []
+    for title, output in previews:
+        panel = render_output_preview(output, title, tile_region)
+        panel.height = tile_region.height
+        panels.append(panel)
+    for i in range(0, len(panels), n_columns):
+        grid.add_row(*panels[i : i + n_columns])
+    return grid
+
+
+def tile_height(n_tiles, region):
+    """How many lines of output each tile has room for, see `render_tiles()`."""
+    n_columns = min(max(n_tiles, 1), max(region.width // MIN_TILE_WIDTH, 1))
+    n_rows = math.ceil(max(n_tiles, 1) / n_columns)
+    return max(region.height // n_rows - 2, 1)
+
+
+@METRICS.timed("pager render")
+def render_pager(pager):
+    """The lines on screen and a status line, like `less`."""
+    lines = []
+    for line in pager.lines():
+        # Progress bars redraw their line after a "\r"; show what a terminal would.
+        text = line.decode(errors="replace").rsplit("\r", 1)[-1]
+        line_text = rich.text.Text.from_ansi(text, no_wrap=True, overflow="crop")
+        if pager.pattern is not None:
+            line_text.highlight_regex(pager.pattern, style="reverse")
+        lines.append(line_text)
+    lines += [rich.text.Text("~", style="dim")] * (pager.height - len(lines))
+    return rich.console.Group(*lines, format_pager_status(pager))
+
+
+def format_pager_status(pager):
+    if pager.prompt is not None:
+        return rich.text.Text(f"{pager.prompt_kind}{pager.prompt}▏")
+
+    line_number = pager.line_number()
+    status = (
+        f"[bold]{rich.markup.escape(pager.path)}[/]  "
+        f"line {line_number or '...'}  {pager.percent()}%"
+    )
+    if pager.searching:
+        status += "  [yellow]searching...[/]"
+    if pager.follow:
+        status += "  [green]following[/]"
+    if pager.message:
+        status += f"  [red]{rich.markup.escape(pager.message)}[/]"
+    status += (
+        "  [dim]↑/↓ PgUp/PgDn g/G move  50g line 50  50% percent  / ? n N search  "
+        "F follow  Q back"
     )
+    status_text = rich.text.Text.from_markup(status, overflow="ellipsis")
+    status_text.no_wrap = True
+    return status_text
+
+
+def format_status_bar(snapshot, stale_after):
+    """Tell the user if the job list is out of date, e.g. because bjobs is hanging."""
+    age = snapshot.age()
 
-    return layout
+    if age is None:
+        return f"[red]{snapshot.error}" if snapshot.error else "Loading jobs..."
+
+    if snapshot.cached:
+        ago = humanize_timedelta(int(age.total_seconds()))
+        return f"[yellow]Jobs as of {ago} ago, waiting for bjobs..."
+
+    if snapshot.error or age > stale_after:
+        status = f"[red]data is {int(age.total_seconds())} s stale"
+        if snapshot.error:
+            status += f" ({snapshot.error})"
+        return status
+
+    return (
+        "[dim]↑/↓ move  →/← expand arrays  / filter  S search output  L view output  "
+        "O open in less  Space mark  T tile marked  D details  P performance  Q quit"
+    )
+
+
+def format_filter_bar(job_filter, editing, n_shown, n_total):
+    """What's being filtered for, and how many jobs match."""
+    text = rich.markup.escape(job_filter.text)
+    if editing:
+        bar = f"/{text}▏ {n_shown} of {n_total} jobs"
+        if job_filter.error:
+            return f"{bar}  [red]{rich.markup.escape(job_filter.error)}"
+        return f"{bar}  [dim]Enter done  Esc clear"
+    return f"[cyan]/{text}[/] {n_shown} of {n_total} jobs  [dim]Esc clear[/]  "
+
+
+def format_search_prompt(text, error=None):
+    bar = f"search output: {rich.markup.escape(text)}▏"
+    if error:
+        return f"{bar}  [red]{rich.markup.escape(error)}"
+    return f"{bar}  [dim]Enter search  Esc cancel"
+
+
+class Screen:
+    """
+    The layout of gjobs. Regions are only recomputed when they're marked as dirty,
+    and only re-rendered if what they show has actually changed.
+    """
+
+    def __init__(self, console):
+        self.console = console
+
+        self.job_table_layout = rich.layout.Layout(size=10)
+        self.output_preview_layout = rich.layout.Layout()
+        self.status_bar_layout = rich.layout.Layout(size=1)
+        content_layout = Layout()
+        content_layout.split_column(
+            self.job_table_layout, self.output_preview_layout, self.status_bar_layout
+        )
+
+        if DEBUG:
+            self.log_layout = rich.layout.Layout(size=5 + 2)
+            self.layout = Layout()
+            self.layout.split_column(content_layout, self.log_layout)
+        else:
+            self.log_layout = None
+            self.layout = content_layout
+
+        self._regions = None
+        self._regions_size = None
+        # What each layout was last computed from.
+        self._inputs = {}
+
+    def get_regions(self):
+        """Where each layout is on the screen. Only changes when the terminal does."""
+        if self._regions_size != self.console.size:
+            self._regions_size = self.console.size
+            render_map = self.layout.render(self.console, self.console.options)
+            self._regions = {layout: render_map[layout].region for layout in render_map}
+
+        return self._regions
+
+    def _set(self, layout, inputs, make_renderable):
+        """Update `layout` unless `inputs` are the same as last time."""
+        if self._inputs.get(layout) == inputs:
+            return False
+
+        layout.update(make_renderable())
+        self._inputs[layout] = inputs
+        return True
+
+    def update(
+        self,
+        job_list,
+        cursor,
+        output_viewer,
+        show_details=False,
+        dirty=ALL_REGIONS,
+        show_metrics=False,
+        job_filter=None,
+        editing_filter=False,
+        arrays=None,
+        log_search=None,
+        search_prompt=None,
+        marked=frozenset(),
+        tiled=False,
+    ):
+        """
+        Recompute the `dirty` regions. Returns whether anything changed.
+        Only the jobs that pass `job_filter` are shown, if given, and job arrays
+        are grouped into one row each by `arrays`, if given. The results of
+        `log_search` are shown instead of the output, if given, and `search_prompt`
+        instead of the status bar. The jobs `marked` by their `job_sort_key()` are
+        marked in the table, and if `tiled` is set, their outputs are shown.
+        """
+        snapshot = job_list.get_snapshot()
+        jobs = job_filter.view(snapshot) if job_filter else snapshot.jobs
+        rows = arrays.rows(jobs) if arrays else jobs
+        cursor.update(rows)
+        regions = self.get_regions()
+        changed = False
+
+        if TABLE in dirty:
+            region = regions[self.job_table_layout]
+            now = time.time()
+            # The times shown keep growing, but only redraw when the text changes.
+            ticking = tuple(
+                format_job_status(job, now, snapshot.poll_times)
+                for job in cursor.visible_jobs(rows)
+                if job.stat in TICKING_STATES
+            )
+            changed |= self._set(
+                self.job_table_layout,
+                (
+                    snapshot.version,
+                    job_filter and job_filter.version,
+                    arrays and arrays.version,
+                    cursor.get_index(),
+                    region,
+                    ticking,
+                    marked,
+                ),
+                lambda: generate_job_table(
+                    rows,
+                    cursor,
+                    region,
+                    len(job_list.sources) > 1,
+                    now,
+                    arrays,
+                    snapshot.cached,
+                    job_list.resource_history,
+                    marked,
+                    snapshot.poll_times,
+                ),
+            )
+
+        if PREVIEW in dirty and show_metrics:
+            # Updated once a second at most, see `next_wakeup()`.
+            changed |= self._set(
+                self.output_preview_layout,
+                ("metrics", int(time.time()), regions[self.output_preview_layout]),
+                lambda: render_metrics(METRICS.to_dict()),
+            )
+        elif PREVIEW in dirty and log_search is not None:
+            region = regions[self.output_preview_layout]
+            changed |= self._set(
+                self.output_preview_layout,
+                ("search", log_search.version, region),
+                lambda: render_search_results(log_search, region),
+            )
+        elif PREVIEW in dirty and tiled:
+            changed |= self._update_tiles(
+                snapshot, marked, output_viewer, regions[self.output_preview_layout]
+            )
+        elif PREVIEW in dirty:
+            changed |= self._update_preview(
+                job_list,
+                selected_job(cursor.get_job(rows)),
+                output_viewer,
+                show_details,
+                regions,
+            )
+
+        if STATUS in dirty:
+            status = format_status_bar(snapshot, stale_after=2 * job_list.poll_interval)
+            if job_filter and (editing_filter or job_filter.active):
+                filter_bar = format_filter_bar(
+                    job_filter, editing_filter, len(jobs), len(snapshot.jobs)
+                )
+                status = filter_bar if editing_filter else filter_bar + status
+            if search_prompt is not None:
+                status = search_prompt
+            changed |= self._set(self.status_bar_layout, status, lambda: status)
+
+        if self.log_layout is not None:
+            log = "\n".join(str(x) for x in list(LOG)[-5:])
+            changed |= self._set(
+                self.log_layout,
+                log,
+                lambda: rich.panel.Panel(log, title="Debug log"),
+            )
+
+        return changed
+
+    def _update_tiles(self, snapshot, marked, output_viewer, region):
+        # In the order of the table.
+        keys = sorted(marked)[:MAX_TILES]
+        n_lines = tile_height(len(keys), region)
+        previews = []
+        for key in keys:
+            job = find_job(snapshot.jobs, key)
+            if job is None:
+                continue  # not in the job list anymore
+            # The followers only read what's new, and only from files that changed.
+            filename, output = output_viewer.get_output_preview(job, n_lines)
+            title = job_label(job)
+            if filename is not None:
+                title += f" {os.path.basename(filename)}"
+            previews.append((title, output))
+        previews = tuple(previews)
+        return self._set(
+            self.output_preview_layout,
+            ("tiles", previews, region),
+            lambda: render_tiles(previews, region),
+        )
+
+    def _update_preview(
+        self, job_list, current_job, output_viewer, show_details, regions
+    ):
+        region = regions[self.output_preview_layout]
+
+        if show_details and current_job is not None:
+            details = job_list.get_job_details(current_job)
+            series = job_list.resource_history.get(current_job)
+            # The labels and the latest values take up about 40 cells.
+            width = max(min(MAX_SAMPLES, region.width - 40), 8)
+            return self._set(
+                self.output_preview_layout,
+                ("details", current_job, details is None, region),
+                lambda: render_job_details(current_job, details, series, width),
+            )
+
+        filename, output_preview = output_viewer.get_output_preview(
+            current_job, n_preview_lines=region.height
+        )
+        return self._set(
+            self.output_preview_layout,
+            ("output", filename, output_preview, region),
+            lambda: render_output_preview(output_preview, filename, region),
+        )
+
+
+def update(job_list, cursor, output_viewer, show_details=False):
+    """Build the whole screen from scratch."""
+    screen = Screen(rich.console.Console())
+    screen.update(job_list, cursor, output_viewer, show_details)
+    return screen.layout
+
+
+def next_wakeup(job_list, rows, cursor, show_metrics=False, tiled=False):
+    """
+    How long the main loop can sleep if nothing happens, in seconds (None = forever).
+    Some things can change without an event: a running job's output can grow, the
+    run and pending times on the screen grow, and the data can become stale.
+    """
+    timeouts = []
+    current_job = selected_job(cursor.get_job(rows))
+
+    if show_metrics:
+        timeouts.append(1)
+
+    if tiled:
+        # The outputs of the marked jobs, on filesystems that inotify can't see.
+        timeouts.append(OUTPUT_CHECK_INTERVAL)
+
+    if any(row.stat in TICKING_STATES for row in cursor.visible_jobs(rows)):
+        timeouts.append(1)
+
+    if current_job is not None and current_job.stat == "RUN":
+        timeouts.append(OUTPUT_CHECK_INTERVAL)
+
+    snapshot = job_list.get_snapshot()
+    age = snapshot.age()
+    stale_after = 2 * job_list.poll_interval
+    if age is not None:
+        if snapshot.error or age > stale_after:
+            timeouts.append(1)  # the staleness indicator counts seconds
+        else:
+            timeouts.append((stale_after - age).total_seconds())
+
+    return min(timeouts, default=None)
+
+
+@contextlib.contextmanager
+def cbreak():
+    """
+    Like blessed's `Terminal.cbreak()`, but usable before blessed is imported, and it
+    doesn't throw away what the user typed before, i.e. while gjobs was starting.
+    """
+    fd = sys.stdin.fileno()
+    if not os.isatty(fd):
+        yield
+        return
+
+    old_attributes = termios.tcgetattr(fd)
+    tty.setcbreak(fd, termios.TCSANOW)
+    try:
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSAFLUSH, old_attributes)
+
+
+def edit_text(text, input_key) -> Tuple[str, bool]:
+    """
+    Handle a key typed into a text field. Returns the new text and whether to keep
+    editing. Escape clears the text.
+    """
+    if input_key.name == "KEY_ENTER":
+        return text, False
+    elif input_key.name == "KEY_ESCAPE":
+        return "", False
+    elif input_key.name in ["KEY_BACKSPACE", "KEY_DELETE"]:
+        return text[:-1], True
+    elif not input_key.is_sequence and input_key.isprintable():
+        return text + input_key, True
+    return text, True
+
+
+def edit_filter(job_filter, input_key) -> bool:
+    """Handle a key typed into the filter bar. Returns whether to keep editing."""
+    text, editing = edit_text(job_filter.text, input_key)
+    if text != job_filter.text:
+        job_filter.set_text(text)
+    return editing
+
+
+def handle_pager_key(pager, input_key) -> bool:
+    """Handle a key typed in the pager, like `less`. Returns whether to keep it open."""
+    if pager.prompt is not None:
+        text, editing = edit_text(pager.prompt, input_key)
+        pager.prompt = text if editing else None
+        if not editing and text and input_key.name != "KEY_ESCAPE":
+            try:
+                pager.search(text, backwards=pager.prompt_kind == "?")
+            except re.error as e:
+                pager.message = f"bad regex: {e}"
+        return True
+
+    if pager.searching:
+        # Any key interrupts a search, and Escape only that.
+        pager.stop_search()
+        if input_key.name == "KEY_ESCAPE":
+            return True
+
+    # e.g. "50g" goes to line 50.
+    count, pager.count = pager.count, ""
+    pager.message = None
+    key = "" if input_key.is_sequence else str(input_key)
+    name = input_key.name
+
+    if key.isdigit():
+        pager.count = count + key
+    elif key in ["q", "Q"] or name == "KEY_ESCAPE":
+        return False
+    elif name in ["KEY_DOWN", "KEY_ENTER"] or key == "j":
+        pager.scroll(int(count or 1))
+    elif name == "KEY_UP" or key == "k":
+        pager.scroll(-int(count or 1))
+    elif name == "KEY_PGDOWN" or key in [" ", "f"]:
+        pager.scroll(pager.height)
+    elif name == "KEY_PGUP" or key == "b":
+        pager.scroll(-pager.height)
+    elif name == "KEY_HOME" or key == "g":
+        pager.go_to_line(int(count)) if count else pager.home()
+    elif name == "KEY_END" or key == "G":
+        pager.go_to_line(int(count)) if count else pager.end()
+    elif key == "%":
+        pager.go_to_percent(int(count or 0))
+    elif key in ["/", "?"]:
+        pager.prompt = ""
+        pager.prompt_kind = key
+    elif key in ["n", "N"]:
+        pager.search_next(backwards=key == "N")
+    elif key == "F":
+        pager.follow = True
+        pager.end()
+    return True
+
+
+def pager_wakeup(pager):
+    """Like `next_wakeup()`, for when the pager is open."""
+    if pager.indexing or pager.searching:
+        return 0  # a bit more every frame
+    if pager.follow:
+        return OUTPUT_CHECK_INTERVAL
+    return None
+
+
+def expand_or_collapse(arrays, cursor, rows, expand=None):
+    """
+    Expand or collapse (toggle if `expand` is None) the job array that the cursor
+    is on, or in, and put the cursor on it.
+    """
+    array = cursor.get_job(rows)
+    if array is not None and not isinstance(array, JobArray):
+        array = arrays.array_of(array) if is_array_element(array) else None
+    if array is None:
+        return
+
+    if expand is None or expand != arrays.is_expanded(array):
+        arrays.toggle(array)
+    cursor.move_to(arrays.row_index(array))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Job management for the LSF scheduling system."
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5,
+        help="How often to poll bjobs while jobs are changing, in seconds; polls "
+        "are less frequent while nothing happens (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fixed-interval",
+        action="store_true",
+        help="Always poll bjobs every --interval seconds",
+    )
+    parser.add_argument(
+        "--bjobs-timeout",
+        type=float,
+        default=BJOBS_TIMEOUT_SECONDS,
+        help="Kill bjobs if it takes longer than this many seconds "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Don't remember jobs across sessions",
+    )
+    parser.add_argument(
+        "-u",
+        "--user",
+        help="Show the jobs of this user (e.g. a service account) instead of yours; "
+        "passed to `bjobs -u`",
+    )
+    output = parser.add_argument_group(
+        "headless mode", "Print the jobs as JSON instead of showing them"
+    )
+    mode = output.add_mutually_exclusive_group()
+    mode.add_argument("--once", action="store_true", help="Print the jobs and exit")
+    mode.add_argument(
+        "--watch",
+        action="store_true",
+        help="Print the jobs that change after every poll, until interrupted",
+    )
+    output_format = output.add_mutually_exclusive_group()
+    output_format.add_argument(
+        "--json",
+        action="store_true",
+        help="One JSON object per snapshot (default with --once). "
+        "Implies --once unless --watch is given",
+    )
+    output_format.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="One JSON object per job (default with --watch). "
+        "Implies --once unless --watch is given",
+    )
+    output.add_argument(
+        "--fields",
+        type=parse_fields,
+        help="Comma-separated bjobs fields to print in addition to the default ones, "
+        "or 'all'",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Instead of showing the jobs, keep polling bjobs for the other gjobs "
+        "instances of this user, so that they don't each have to",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Poll bjobs ourselves even if a gjobs daemon is running",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="On exit, write timings of gjobs' internals to this file, as JSON "
+        "(press P to see them while gjobs is running)",
+    )
+    parser.add_argument(
+        "--lsbatch-dir",
+        help="Where LSF spools the output of running jobs "
+        f"(default: $GJOBS_LSBATCH_DIR or {DEFAULT_LSBATCH_DIR})",
+    )
+    args = parser.parse_args()
+    if (args.json or args.ndjson) and not args.watch:
+        args.once = True
+    return args
+
+
+def parse_fields(value):
+    if value == "all":
+        return value
+
+    fields = [field.strip().lower() for field in value.split(",") if field.strip()]
+    unknown = set(fields) - {field["name"] for field in bjobs_fields}
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return fields
+
+
+def run_headless(args, fields, sources):
+    if args.fields == "all":
+        fields = None
+    elif args.fields:
+        fields = project_fields(fields, args.fields)
+
+    job_list = JobList(
+        poll_interval=dt.timedelta(seconds=args.interval),
+        bjobs_timeout=args.bjobs_timeout,
+        fields=fields,
+        keep_history=not args.no_history,
+        sources=sources,
+        use_daemon=not args.no_daemon,
+        adaptive=not args.fixed_interval,
+    )
+    try:
+        if args.once:
+            return headless.print_once(job_list, ndjson=args.ndjson)
+        else:
+            headless.watch(job_list, ndjson=not args.json)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # e.g. piped into `head`; don't complain when Python flushes stdout at exit.
+        sys.stdout = None
+    finally:
+        job_list.close()
+
+
+def run_daemon(args, fields, sources):
+    poller = BjobsPoller(
+        dt.timedelta(seconds=args.interval),
+        args.bjobs_timeout,
+        fields,
+        sources,
+        None if args.no_history else open_histories(sources),
+        adaptive=not args.fixed_interval,
+    )
+    try:
+        PollingDaemon(poller, fields).serve_forever()
+    except (OSError, RuntimeError) as e:
+        sys.exit(f"gjobs: {e}")
+    finally:
+        print("\n".join(str(x) for x in LOG))
 
 
 def main():
+    args = parse_args()
+    fields = project_fields(
+        JOB_TABLE_FIELDS,
+        OutputViewer.REQUIRED_FIELDS,
+        poll_schedule.REQUIRED_FIELDS,
+        JobFilter.REQUIRED_FIELDS,
+        ResourceHistory.REQUIRED_FIELDS,
+    )
+    sources = load_sources(user=args.user)
+
+    if args.daemon:
+        run_daemon(args, fields, sources)
+        return
+    if args.once or args.watch:
+        sys.exit(run_headless(args, fields, sources))
+
     cursor = JobTableCursor()
-    output_viewer = OutputViewer()
-    job_list = JobList()
-
-    with term.cbreak(), term.hidden_cursor():
-        with Live(
-            update(job_list, cursor, output_viewer),
-            refresh_per_second=8,
-            screen=True,
-            auto_refresh=False,
-        ) as live:
-            input_key = None
-
-            while (input_key or "").upper() != "Q":
-                input_key = term.inkey(timeout=0.5)
-
-                if input_key.code == term.KEY_UP:
-                    cursor.move_index(-1)
-                elif input_key.code == term.KEY_DOWN:
-                    cursor.move_index(+1)
-                elif input_key.upper() == "L":
-                    # Open the output using `less`
-                    current_job = cursor.get_job(job_list.get_jobs())
-                    output_viewer.open_output_fullscreen(current_job)
-
-                live.update(update(job_list, cursor, output_viewer))
-                live.refresh()
-
-                # time.sleep(0.4)
-
-    live.console.print(LOG)
+    output_viewer = OutputViewer(args.lsbatch_dir)
+    job_list = JobList(
+        poll_interval=dt.timedelta(seconds=args.interval),
+        bjobs_timeout=args.bjobs_timeout,
+        fields=fields,
+        keep_history=not args.no_history,
+        sources=sources,
+        use_daemon=not args.no_daemon,
+        adaptive=not args.fixed_interval,
+        cache_snapshot=not args.no_history,
+    )
+    show_details = False
+    show_metrics = False
+    job_filter = JobFilter()
+    editing_filter = False
+    arrays = ArrayGrouping()
+    log_search = LogSearch()
+    show_search = False
+    # What's being typed into the search prompt, None when it's closed.
+    search_text = None
+    search_error = None
+    # The output of a job, when we're looking at it in the pager.
+    pager = None
+    # The `job_sort_key()`s of the jobs marked with Space, to show in tiles.
+    marked = frozenset()
+    tiled = False
+
+    def get_rows():
+        return arrays.rows(job_filter.view(job_list.get_snapshot()))
+
+    scheduler = RedrawScheduler()
+    job_list.add_listener(scheduler.wake)
+    log_search.listeners.append(lambda: scheduler.wake(PREVIEW))
+    scheduler.watch_resize()
+
+    with cbreak(), Live(
+        refresh_per_second=8,
+        screen=True,
+        auto_refresh=False,
+    ) as live:
+        screen = Screen(live.console)
+        live.update(screen.layout)
+        screen.update(
+            job_list, cursor, output_viewer, job_filter=job_filter, arrays=arrays
+        )
+        live.refresh()
+
+        # Only imported once the first frame is up: blessed takes longer to import
+        # than everything else. Creating a terminal queries it, so it can't happen
+        # at import time either, or the search processes would steal keypresses.
+        from blessed import Terminal
+
+        term = Terminal()
+        with term.hidden_cursor():
+            quit = False
+            # Creating the terminal reads what the user typed so far, so it's not
+            # on stdin anymore.
+            keys_pending = True
+
+            while not quit:
+                dirty = scheduler.take_dirty()
+                frame_start = time.perf_counter()
+                if dirty and pager is not None:
+                    pager.refresh()
+                    pager.search_step()
+                    pager.resize(live.console.size.height - 1)
+                    live.update(render_pager(pager), refresh=True)
+                    METRICS.record("frame", time.perf_counter() - frame_start)
+                elif dirty and screen.update(
+                    job_list,
+                    cursor,
+                    output_viewer,
+                    show_details,
+                    dirty,
+                    show_metrics,
+                    job_filter,
+                    editing_filter,
+                    arrays,
+                    log_search if show_search else None,
+                    (
+                        None
+                        if search_text is None
+                        else format_search_prompt(search_text, search_error)
+                    ),
+                    marked,
+                    tiled,
+                ):
+                    live.refresh()
+                    METRICS.record("frame", time.perf_counter() - frame_start)
+
+                watcher_fd = output_viewer.watcher.fileno()
+                ready = scheduler.wait(
+                    [sys.stdin.fileno()] + ([watcher_fd] if watcher_fd else []),
+                    (
+                        pager_wakeup(pager)
+                        if pager is not None
+                        else next_wakeup(
+                            job_list, get_rows(), cursor, show_metrics, tiled
+                        )
+                    ),
+                )
+
+                if watcher_fd in ready and output_viewer.read_changes():
+                    scheduler.mark_dirty(PREVIEW)
+
+                if sys.stdin.fileno() not in ready and not keys_pending:
+                    # Woken up by a timeout or an event; the poller and the resize
+                    # handler mark what they change as dirty themselves.
+                    scheduler.mark_dirty(TABLE, PREVIEW, STATUS)
+                    continue
+
+                keys_pending = False
+                # There might be several keys waiting, e.g. when holding down a key.
+                while input_key := term.inkey(timeout=0):
+                    if pager is not None:
+                        if not handle_pager_key(pager, input_key):
+                            output_viewer.set_pager_file(None)
+                            pager.close()
+                            pager = None
+                            live.update(screen.layout)
+                    elif search_text is not None and input_key.code not in [
+                        term.KEY_UP,
+                        term.KEY_DOWN,
+                    ]:
+                        search_text, editing = edit_text(search_text, input_key)
+                        search_error = None
+                        if input_key.code == term.KEY_ESCAPE:
+                            search_text = None
+                        elif not editing and search_text:
+                            try:
+                                log_search.start(
+                                    search_text,
+                                    output_viewer.get_output_files(
+                                        job_filter.view(job_list.get_snapshot())
+                                    ),
+                                )
+                                show_search = True
+                                search_text = None
+                            except re.error as e:
+                                search_error = f"bad regex: {e}"
+                        elif not editing:
+                            search_text = None
+                    elif editing_filter and input_key.code not in [
+                        term.KEY_UP,
+                        term.KEY_DOWN,
+                    ]:
+                        filter_version = job_filter.version
+                        editing_filter = edit_filter(job_filter, input_key)
+                        if job_filter.version != filter_version:
+                            cursor.move_to(0)
+                    elif input_key == "/":
+                        editing_filter = True
+                    elif input_key.upper() == "S":
+                        search_text = log_search.text
+                    elif input_key.code == term.KEY_ESCAPE and show_search:
+                        log_search.cancel()
+                        show_search = False
+                    elif input_key.code == term.KEY_ESCAPE:
+                        job_filter.set_text("")
+                        cursor.move_to(0)
+                    elif input_key.upper() == "Q":
+                        quit = True
+                        break
+                    elif input_key.code == term.KEY_UP:
+                        cursor.move_index(-1)
+                    elif input_key.code == term.KEY_DOWN:
+                        cursor.move_index(+1)
+                    elif input_key.code == term.KEY_PGUP:
+                        cursor.move_index(-cursor.page_size)
+                    elif input_key.code == term.KEY_PGDOWN:
+                        cursor.move_index(+cursor.page_size)
+                    elif input_key.code == term.KEY_HOME:
+                        cursor.move_to(0)
+                    elif input_key.code == term.KEY_END:
+                        cursor.move_to(cursor.n_jobs - 1)
+                    elif input_key.code == term.KEY_ENTER:
+                        expand_or_collapse(arrays, cursor, get_rows())
+                    elif input_key.code in [term.KEY_RIGHT, term.KEY_LEFT]:
+                        expand_or_collapse(
+                            arrays,
+                            cursor,
+                            get_rows(),
+                            expand=input_key.code == term.KEY_RIGHT,
+                        )
+                    elif input_key.upper() == "L":
+                        current_job = selected_job(cursor.get_job(get_rows()))
+                        output_file = current_job and output_viewer.get_output_file(
+                            current_job
+                        )
+                        if output_file:
+                            pager = Pager(output_file, follow=current_job.stat == "RUN")
+                            output_viewer.set_pager_file(output_file)
+                    elif input_key.upper() == "O":
+                        # Open the output using `less`
+                        current_job = selected_job(cursor.get_job(get_rows()))
+                        output_viewer.open_output_fullscreen(current_job)
+                        # `less` has drawn over the whole screen.
+                        screen = Screen(live.console)
+                        live.update(screen.layout)
+                    elif input_key == " ":
+                        current_job = selected_job(cursor.get_job(get_rows()))
+                        if current_job is not None:
+                            marked ^= {job_sort_key(current_job)}
+                            cursor.move_index(+1)
+                    elif input_key.upper() == "T":
+                        tiled = not tiled
+                    elif input_key.upper() == "D":
+                        show_details = not show_details
+                    elif input_key.upper() == "P":
+                        show_metrics = not show_metrics
+
+                    scheduler.mark_dirty()
+
+    job_list.close()
+    log_search.close()
+    scheduler.close()
+    output_viewer.watcher.close()
+    if args.metrics_file:
+        METRICS.dump(args.metrics_file)
+    live.console.print("\n".join(str(x) for x in LOG))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+import json
+import sys
+import threading
+
+from .daemon import snapshot_metadata
+from .job_index import diff_jobs
+from .job_list import JobList
+from .poller import JobSnapshot
+
+
+def snapshot_to_json(snapshot: JobSnapshot):
+    return {
+        **snapshot_metadata(snapshot),
+        "jobs": [job.to_dict() for job in snapshot.jobs],
+    }
+
+
+def removed_record(key):
+    (jobid, jobindex), source = key
+    return {"jobid": jobid, "jobindex": jobindex, "source": source, "removed": True}
+
+
+def print_json(data, out):
+    out.write(json.dumps(data, separators=(",", ":")) + "\n")
+    out.flush()
+
+
+def print_once(job_list: JobList, ndjson=False, out=sys.stdout):
+    """
+    Print the jobs once, as a JSON object with the time of the poll, the error if
+    it failed and the jobs, or with `ndjson`, one job per line.
+    Returns the exit code: 1 if polling failed.
+    """
+    job_list.poller.ready.wait()
+    snapshot = job_list.get_snapshot()
+
+    if ndjson:
+        for job in snapshot.jobs:
+            print_json(job.to_dict(), out)
+    else:
+        print_json(snapshot_to_json(snapshot), out)
+
+    if snapshot.error:
+        print(f"gjobs: {snapshot.error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def watch(job_list: JobList, ndjson=True, out=sys.stdout):
+    """
+    Print the jobs whenever they change until interrupted. With `ndjson`, only the
+    jobs that changed are printed, one per line; removed jobs are printed as
+    {"jobid": ..., "jobindex": ..., "source": ..., "removed": true}.
+    Otherwise, every new snapshot is printed as a JSON object on one line.
+    """
+    changed = threading.Event()
+    job_list.add_listener(changed.set)
+    last = JobSnapshot()
+
+    while True:
+        changed.wait()
+        changed.clear()
+        snapshot = job_list.get_snapshot()
+        if snapshot.version == last.version and snapshot.error == last.error:
+            continue  # e.g. only the details of a job
+
+        if ndjson:
+            new_jobs, removed = diff_jobs(last.jobs, snapshot.jobs)
+            for job in new_jobs:
+                print_json(job.to_dict(), out)
+            for key in removed:
+                print_json(removed_record(key), out)
+            if snapshot.error and snapshot.error != last.error:
+                print(f"gjobs: {snapshot.error}", file=sys.stderr)
+        else:
+            print_json(snapshot_to_json(snapshot), out)
+
+        last = snapshot
@@ -0,0 +1,77 @@
+import json
+import os
+import sqlite3
+
+from .parsing_bjobs import job_key
+from .util import LOG, cache_dir
+
+# The record of a job in these states never changes anymore.
+# See https://www.ibm.com/docs/en/spectrum-lsf/10.1.0?topic=execution-about-job-states
+FINISHED_STATES = ["DONE", "EXIT"]
+
+
+def is_finished(job):
+    return job["stat"] in FINISHED_STATES
+
+
+class JobHistory:
+    """
+    Keeps the records of finished jobs in a local SQLite database, so that we don't
+    need to fetch them from bjobs again and so that they outlive LSF's CLEAN_PERIOD.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "history.sqlite")
+        # Only used from the poller thread, but that's not the one that creates it.
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "  jobid TEXT NOT NULL,"
+                "  jobindex TEXT NOT NULL,"
+                "  record TEXT NOT NULL,"
+                "  PRIMARY KEY (jobid, jobindex)"
+                ")"
+            )
+
+    def load(self):
+        """Yields the stored records one by one, so that they're never all in memory."""
+        for (record,) in self.connection.execute("SELECT record FROM jobs"):
+            yield json.loads(record)
+
+    def add(self, records):
+        """
+        Store the records of finished jobs, as returned by bjobs.
+        Existing records of the same jobs are replaced.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO jobs (jobid, jobindex, record) VALUES (?, ?, ?)",
+                [(*job_key(record), json.dumps(record)) for record in records],
+            )
+
+    def remove(self, keys):
+        """Forget jobs, e.g. because they were requeued and are not finished anymore."""
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM jobs WHERE jobid = ? AND jobindex = ?", keys
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def open_histories(sources):
+    """
+    The histories of `sources`, by source name. Those that can't be opened are
+    left out.
+    """
+    histories = {}
+    for source in sources:
+        try:
+            histories[source.name] = JobHistory(
+                os.path.join(cache_dir(), source.history_file())
+            )
+        except (OSError, sqlite3.Error) as e:
+            LOG.append(f"Could not open the job history of {source.name}: {e}")
+    return histories
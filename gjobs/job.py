@@ -0,0 +1,90 @@
+import functools
+
+from .bjobs_fields import bjobs_fields
+from .parsing_bjobs import parse_memory, parse_minutes, parse_seconds, parse_timestamp
+
+CONVERTERS = {
+    "seconds": parse_seconds,
+    "time stamp": parse_timestamp,
+    "LSF_UNIT_FOR_LIMITS": parse_memory,
+}
+FIELD_UNITS = {field["name"]: field["unit"] for field in bjobs_fields}
+# Numeric fields that the bjobs documentation doesn't give a unit for.
+FIELD_UNITS.update({"cpu_used": "seconds", "runtimelimit": "minutes"})
+CONVERTERS["minutes"] = parse_minutes
+
+
+def attribute_name(field):
+    """Field names are not always valid identifiers, e.g. "%complete"."""
+    return field.replace("%", "percent_")
+
+
+class Job:
+    """
+    A job as returned by bjobs, with the values already converted to Python types:
+    times are in seconds, timestamps are POSIX timestamps and memory is in bytes.
+    Missing values are None.
+
+    To save memory, each set of fields gets its own subclass with `__slots__`,
+    see `job_type()`. Fields can be accessed both as `job.run_time` and
+    `job["run_time"]`.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, attribute_name(field))
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, attribute_name(field), default)
+
+    def __contains__(self, field):
+        return hasattr(self, attribute_name(field))
+
+    def values(self):
+        return tuple(self.get(field) for field in self.FIELDS)
+
+    def to_dict(self):
+        return {field: self.get(field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, d):
+        """The inverse of `to_dict()`. The values must already be converted."""
+        job = job_type(tuple(d.keys()))()
+        for field, value in d.items():
+            setattr(job, attribute_name(field), value)
+        return job
+
+    def __repr__(self):
+        return f"Job({self.to_dict()})"
+
+
+@functools.lru_cache(maxsize=None)
+def job_type(fields):
+    return type(
+        "Job",
+        (Job,),
+        {"__slots__": tuple(attribute_name(f) for f in fields), "FIELDS": fields},
+    )
+
+
+def convert_value(field, value):
+    converter = CONVERTERS.get(FIELD_UNITS.get(field))
+
+    if converter is not None:
+        return converter(value)
+    elif value == "":
+        return None
+    else:
+        return value
+
+
+def job_from_record(record):
+    """Convert a record from bjobs, with lowercase keys, into a `Job`."""
+    return Job.from_dict(
+        {field: convert_value(field, value) for field, value in record.items()}
+    )
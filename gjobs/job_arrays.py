@@ -0,0 +1,199 @@
+import bisect
+import collections
+import re
+from typing import Optional, Tuple, Union
+
+from .job import Job
+from .job_index import diff_by_identity, job_sort_key, update_sorted
+
+# The elements of an array are named e.g. "sweep[12]".
+ARRAY_INDEX_REGEX = re.compile(r"\[[^\]]*\]$")
+
+
+def is_array_element(job):
+    return (getattr(job, "jobindex", None) or "0") != "0"
+
+
+class JobArray:
+    """
+    The elements of a job array, shown as a single row. The counts by status and
+    the run times are kept up to date as elements change, so that an array with
+    thousands of elements costs about as much as a single job.
+    """
+
+    # Arrays don't have one status; see `counts`.
+    stat = None
+
+    def __init__(self, jobid, source, job_name, submit_time):
+        self.jobid = jobid
+        self.source = source
+        self.job_name = job_name
+        self.submit_time = submit_time
+        self.elements = {}  # sort key -> job
+        self.counts = collections.Counter()  # status -> number of elements
+        self.run_times = []  # ascending
+        self._representative = None
+
+    @property
+    def row_key(self):
+        """Sorts right before the first element."""
+        return -int(self.jobid), -1, self.source
+
+    def __len__(self):
+        return len(self.elements)
+
+    def add(self, key, job):
+        self.elements[key] = job
+        self.counts[job.stat] += 1
+        run_time = getattr(job, "run_time", None)
+        if run_time is not None:
+            bisect.insort(self.run_times, run_time)
+        self._representative = None
+
+    def remove(self, key):
+        job = self.elements.pop(key)
+        self.counts[job.stat] -= 1
+        if not self.counts[job.stat]:
+            del self.counts[job.stat]
+        run_time = getattr(job, "run_time", None)
+        if run_time is not None:
+            del self.run_times[bisect.bisect_left(self.run_times, run_time)]
+        self._representative = None
+
+    def run_time_stats(self) -> Optional[Tuple[float, float, float]]:
+        """The minimum, median and maximum run time of the elements, if known."""
+        if not self.run_times:
+            return None
+        return (
+            self.run_times[0],
+            self.run_times[len(self.run_times) // 2],
+            self.run_times[-1],
+        )
+
+    def representative(self) -> Job:
+        """The element to show the output of: the first running one, if any."""
+        if self._representative is None:
+            elements = [self.elements[key] for key in sorted(self.elements)]
+            self._representative = next(
+                (job for job in elements if job.stat == "RUN"), elements[0]
+            )
+        return self._representative
+
+
+class ArrayGrouping:
+    """
+    Turns a sequence of jobs into the rows of the job table: each job array is one
+    row, followed by its elements if it's expanded. Updated with the jobs that
+    changed, like `job_index.FilterIndex`.
+    """
+
+    def __init__(self):
+        self.arrays = {}  # (jobid, source) -> JobArray
+        self.expanded = set()  # (jobid, source)
+        # Incremented whenever the rows change.
+        self.version = 0
+        self._jobs = None
+        self._jobs_by_id = {}
+        self._row_keys = []  # ascending
+        self._rows = {}  # row key -> Job or JobArray
+        self._sorted_rows = ()
+
+    def rows(self, jobs) -> Tuple[Union[Job, JobArray], ...]:
+        """The rows for `jobs`, a snapshot or a view of one."""
+        if jobs is not self._jobs:
+            self._update(jobs)
+            self._jobs = jobs
+        if self._sorted_rows is None:
+            self._sorted_rows = tuple(self._rows[key] for key in self._row_keys)
+        return self._sorted_rows
+
+    def _update(self, jobs):
+        self._jobs_by_id, removed, added = diff_by_identity(self._jobs_by_id, jobs)
+        if not removed and not added:
+            return
+
+        removed_rows = []
+        added_rows = []
+        for job in removed:
+            removed_rows += self._remove(job)
+        for job in added:
+            added_rows += self._add(job)
+
+        # A job that changed is removed and added again under the same key.
+        self._row_keys = update_sorted(self._row_keys, removed_rows, added_rows)
+        self._changed()
+
+    def _add(self, job):
+        """Returns the keys of the rows that were added."""
+        key = job_sort_key(job)
+        if not is_array_element(job):
+            self._rows[key] = job
+            return [key]
+
+        array_key = (job.jobid, getattr(job, "source", None) or "")
+        array = self.arrays.get(array_key)
+        added = []
+        if array is None:
+            array = self.arrays[array_key] = JobArray(
+                job.jobid,
+                array_key[1],
+                ARRAY_INDEX_REGEX.sub("", job.get("job_name") or ""),
+                job.get("submit_time"),
+            )
+            self._rows[array.row_key] = array
+            added.append(array.row_key)
+
+        array.add(key, job)
+        if array_key in self.expanded:
+            self._rows[key] = job
+            added.append(key)
+        return added
+
+    def _remove(self, job):
+        """Returns the keys of the rows that were removed."""
+        key = job_sort_key(job)
+        if not is_array_element(job):
+            del self._rows[key]
+            return [key]
+
+        array_key = (job.jobid, getattr(job, "source", None) or "")
+        array = self.arrays[array_key]
+        array.remove(key)
+        removed = []
+        if array_key in self.expanded:
+            del self._rows[key]
+            removed.append(key)
+        if not array:
+            del self.arrays[array_key]
+            del self._rows[array.row_key]
+            removed.append(array.row_key)
+        return removed
+
+    def toggle(self, array: JobArray):
+        """Expand or collapse `array`."""
+        array_key = (array.jobid, array.source)
+        keys = list(array.elements)
+        if array_key in self.expanded:
+            self.expanded.remove(array_key)
+            for key in keys:
+                del self._rows[key]
+            self._row_keys = update_sorted(self._row_keys, keys, [])
+        else:
+            self.expanded.add(array_key)
+            self._rows.update(array.elements)
+            self._row_keys = update_sorted(self._row_keys, [], sorted(keys))
+        self._changed()
+
+    def is_expanded(self, array: JobArray):
+        return (array.jobid, array.source) in self.expanded
+
+    def array_of(self, job) -> Optional[JobArray]:
+        return self.arrays.get((job.jobid, job.get("source") or ""))
+
+    def row_index(self, array: JobArray):
+        """Where `array` is in `rows()`."""
+        return bisect.bisect_left(self._row_keys, array.row_key)
+
+    def _changed(self):
+        self._sorted_rows = None
+        self.version += 1
@@ -0,0 +1,164 @@
+import datetime
+import re
+import time
+from typing import Callable, List, Set, Tuple
+
+from .job import Job
+from .job_index import FilterIndex
+from .poller import JobSnapshot
+
+# Words are separated by spaces, except within double quotes: name:"my job".
+WORD_REGEX = re.compile(r'(?:[^\s"]|"[^"]*")+')
+# e.g. "since:3h" means submitted in the last three hours.
+RELATIVE_TIME_REGEX = re.compile(r"(\d+(?:\.\d+)?)([smhdw])$")
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 24 * 3600, "w": 7 * 24 * 3600}
+
+# If fewer than 1/SORT_FRACTION of the jobs match, sorting them is faster than
+# picking them out of the sorted snapshot.
+SORT_FRACTION = 16
+
+FILTER_HELP = (
+    "stat:RUN,PEND  queue:gpu  name:train or /regex/  host:eu-g1  "
+    "since:3h  until:2024-03-01"
+)
+
+
+class FilterError(ValueError):
+    pass
+
+
+# A term of a filter: gives the matching jobs from the index.
+Term = Callable[[FilterIndex], Set[Job]]
+
+
+def parse_time(value) -> Callable[[], float]:
+    """
+    Parse the value of `since:` or `until:`: a date and time such as 2024-03-01 or
+    2024-03-01T09:30, "today", or a time relative to now such as 3h or 2d.
+    Returns a function, so that relative times move on with the clock.
+    """
+    match = RELATIVE_TIME_REGEX.match(value)
+    if match:
+        seconds = float(match.group(1)) * TIME_UNITS[match.group(2)]
+        return lambda: time.time() - seconds
+
+    if value == "today":
+        return lambda: datetime.datetime.combine(
+            datetime.date.today(), datetime.time()
+        ).timestamp()
+
+    try:
+        timestamp = datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise FilterError(f"can't parse the time {value!r}") from None
+    return lambda: timestamp
+
+
+def parse_regex(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise FilterError(f"bad regex {pattern!r}: {e}") from None
+
+
+def parse_name(value) -> Term:
+    if len(value) >= 2 and value.startswith("/") and value.endswith("/"):
+        regex = parse_regex(value[1:-1])
+        return lambda index: index.name.matching(regex)
+    return lambda index: index.name.containing(value)
+
+
+def parse_term(word) -> Term:
+    field, sep, value = word.partition(":")
+    if not sep:
+        return parse_name(word)
+    if not value:
+        raise FilterError(f"{field}: needs a value")
+
+    if field == "stat":
+        stats = [stat.upper() for stat in value.split(",")]
+        return lambda index: index.stat.jobs_with(stats)
+    elif field == "queue":
+        return lambda index: index.queue.containing(value)
+    elif field == "name":
+        return parse_name(value)
+    elif field == "host":
+        return lambda index: index.host.containing(value)
+    elif field == "since":
+        start = parse_time(value)
+        return lambda index: index.submitted_between(start=start())
+    elif field == "until":
+        end = parse_time(value)
+        return lambda index: index.submitted_between(end=end())
+
+    raise FilterError(f"unknown field {field!r}, try {FILTER_HELP}")
+
+
+def parse_filter(text) -> List[Term]:
+    """
+    Parse a filter such as "stat:RUN queue:gpu train": all the terms must match.
+    Words without a field are matched against the job name.
+    """
+    if text.count('"') % 2:
+        raise FilterError("unclosed quote")
+    # Not `shlex.split()`, which would eat the backslashes of regexes.
+    words = [word.replace('"', "") for word in WORD_REGEX.findall(text)]
+    return [parse_term(word) for word in words]
+
+
+class JobFilter:
+    """
+    Narrows down the job list to the jobs matching a filter that the user types in.
+    The jobs are indexed by the fields that can be filtered by, so neither typing
+    nor a new snapshot means going through all jobs.
+    """
+
+    # The job fields that filters look at.
+    REQUIRED_FIELDS = ["stat", "queue", "job_name", "exec_host", "submit_time"]
+
+    def __init__(self):
+        self.text = ""
+        # Incremented whenever the filter in effect changes.
+        self.version = 0
+        # Why `text` can't be parsed. The last valid filter stays in effect.
+        self.error = None
+        self._terms = []
+        self._index = FilterIndex()
+        self._indexed_version = None
+        # The view for (snapshot version, filter version).
+        self._view_key = None
+        self._view = ()
+
+    @property
+    def active(self):
+        return bool(self._terms)
+
+    def set_text(self, text):
+        self.text = text
+        try:
+            self._terms = parse_filter(text)
+            self.error = None
+            self.version += 1
+        except FilterError as e:
+            self.error = str(e)
+
+    def view(self, snapshot: JobSnapshot) -> Tuple[Job, ...]:
+        """The jobs of `snapshot` that match the filter, in the same order."""
+        if not self._terms:
+            return snapshot.jobs
+
+        key = (snapshot.version, self.version)
+        if self._view_key != key:
+            if self._indexed_version != snapshot.version:
+                self._index.update(snapshot.jobs)
+                self._indexed_version = snapshot.version
+
+            matches = sorted((term(self._index) for term in self._terms), key=len)
+            matches = matches[0].intersection(*matches[1:])
+            if len(matches) < len(snapshot.jobs) // SORT_FRACTION:
+                self._view = tuple(self._index.in_order(matches))
+            else:
+                self._view = tuple(job for job in snapshot.jobs if job in matches)
+            self._view_key = key
+
+        return self._view
@@ -0,0 +1,286 @@
+import bisect
+import collections
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from .job import Job
+from .parsing_bjobs import job_key
+
+
+def sort_key(key, source=""):
+    """
+    Newest jobs first, and the elements of job arrays in order. Job IDs are only
+    unique within a source, so it's part of the key too.
+    """
+    jobid, jobindex = key
+    return -int(jobid), int(jobindex), source
+
+
+def source_job_key(job):
+    """Identifies a job across sources: (job key, source)."""
+    return job_key(job), job.get("source") or ""
+
+
+def job_sort_key(job):
+    """`sort_key()` of a job. Faster than going through `source_job_key()`."""
+    return (
+        -int(job.jobid),
+        int(getattr(job, "jobindex", None) or 0),
+        getattr(job, "source", None) or "",
+    )
+
+
+def find_job(jobs, key) -> Optional[Job]:
+    """The job whose `job_sort_key()` is `key` in `jobs`, sorted by it, if any."""
+    low, high = 0, len(jobs)
+    while low < high:
+        middle = (low + high) // 2
+        if job_sort_key(jobs[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(jobs) and job_sort_key(jobs[low]) == key:
+        return jobs[low]
+    return None
+
+
+def diff_jobs(old_jobs, new_jobs):
+    """
+    What changed between two sequences of jobs from a `SortedJobIndex`: returns the
+    new or changed jobs and the `source_job_key()`s of the removed ones. The index
+    keeps the same object for a job that didn't change, so this is cheap.
+    """
+    old = {source_job_key(job): job for job in old_jobs}
+    changed = []
+    for job in new_jobs:
+        if old.pop(source_job_key(job), None) is not job:
+            changed.append(job)
+    return changed, list(old.keys())
+
+
+class SortedJobIndex:
+    """
+    Keeps the jobs sorted from the newest to the oldest as they are added, updated
+    and removed, so that we never need to re-sort the whole list. Most polls only
+    change a handful of jobs.
+    """
+
+    def __init__(self):
+        self._sort_keys = []  # ascending
+        self._jobs = {}  # sort key -> job
+        self._sorted_jobs = ()
+        # Incremented whenever the jobs change.
+        self.version = 0
+
+    def __len__(self):
+        return len(self._sort_keys)
+
+    def set(self, job: Job):
+        """Add or update a job. Nothing changes if the job is the same as before."""
+        key = sort_key(*source_job_key(job))
+        old_job = self._jobs.get(key)
+
+        if old_job is None:
+            bisect.insort(self._sort_keys, key)
+        elif old_job.FIELDS == job.FIELDS and old_job.values() == job.values():
+            # Keep the old object, so that caches keyed by it stay valid.
+            return
+
+        self._jobs[key] = job
+        self._changed()
+
+    def remove(self, job_key, source=""):
+        key = sort_key(job_key, source)
+        if self._jobs.pop(key, None) is not None:
+            del self._sort_keys[bisect.bisect_left(self._sort_keys, key)]
+            self._changed()
+
+    def _changed(self):
+        self._sorted_jobs = None
+        self.version += 1
+
+    def jobs(self) -> Tuple[Job, ...]:
+        if self._sorted_jobs is None:
+            self._sorted_jobs = tuple(self._jobs[key] for key in self._sort_keys)
+        return self._sorted_jobs
+
+
+# How many searches `ValueIndex` keeps up to date, e.g. one per keystroke.
+MAX_CACHED_SEARCHES = 64
+
+
+def exec_hosts(job):
+    """The hosts a job runs on. `exec_host` looks like "4*eu-g1-001:2*eu-g1-002"."""
+    exec_host = getattr(job, "exec_host", None)
+    if not exec_host:
+        return []
+    return [host.rpartition("*")[2] for host in exec_host.split(":")]
+
+
+def diff_by_identity(old_jobs_by_id, jobs):
+    """
+    Like `diff_jobs()`, for indexes that keep `id(job) -> job` of the jobs they
+    contain. Returns that dict for `jobs`, and the removed and the added jobs.
+    """
+    # The jobs of a snapshot are only replaced by new objects when they change,
+    # so comparing the objects' ids is enough, and fast.
+    jobs_by_id = dict(zip(map(id, jobs), jobs))
+    removed = [old_jobs_by_id[i] for i in old_jobs_by_id.keys() - jobs_by_id.keys()]
+    added = [jobs_by_id[i] for i in jobs_by_id.keys() - old_jobs_by_id.keys()]
+    return jobs_by_id, removed, added
+
+
+def update_sorted(items: list, removed, added) -> list:
+    """
+    Remove and add items to a sorted list. Returns the new list, which is `items`
+    updated in place unless many items change.
+    """
+    if len(removed) + len(added) > len(items) // 8:
+        # Cheaper than inserting and deleting one by one, e.g. the first time.
+        removed = set(removed)
+        return sorted([item for item in items if item not in removed] + list(added))
+
+    for item in removed:
+        del items[bisect.bisect_left(items, item)]
+    for item in added:
+        bisect.insort(items, item)
+    return items
+
+
+class ValueIndex:
+    """
+    Which jobs have each value of a field, e.g. each queue. There are far fewer
+    distinct values than jobs, so searches look at the values rather than the jobs,
+    and the results of recent searches are kept up to date as jobs come and go.
+    """
+
+    def __init__(self):
+        self._jobs = {}  # value -> set of jobs
+        # search key -> (predicate, the values it's true for), most recent last.
+        self._searches = collections.OrderedDict()
+
+    def add(self, value, job):
+        jobs = self._jobs.get(value)
+        if jobs is None:
+            jobs = self._jobs[value] = set()
+            for predicate, values in self._searches.values():
+                if predicate(value):
+                    values.add(value)
+        jobs.add(job)
+
+    def remove(self, value, job):
+        jobs = self._jobs[value]
+        jobs.discard(job)
+        if not jobs:
+            del self._jobs[value]
+            for _, values in self._searches.values():
+                values.discard(value)
+
+    def jobs_with(self, values: Iterable) -> Set:
+        return set().union(*(self._jobs.get(value, ()) for value in values))
+
+    def _search(self, key, predicate: Callable[[str], bool], candidates=None):
+        """The values for which `predicate` is true, among `candidates` if given."""
+        values = self._searches.get(key)
+        if values is None:
+            if candidates is None:
+                candidates = self._jobs
+            values = {value for value in candidates if predicate(value)}
+            self._searches[key] = (predicate, values)
+            if len(self._searches) > MAX_CACHED_SEARCHES:
+                self._searches.popitem(last=False)
+        else:
+            self._searches.move_to_end(key)
+            _, values = values
+        return values
+
+    def containing(self, needle) -> Set:
+        """The jobs whose value contains `needle`, ignoring case."""
+        needle = needle.lower()
+        # While typing, each search narrows down an earlier one.
+        candidates = None
+        for (kind, earlier), (_, values) in self._searches.items():
+            if kind == "in" and earlier in needle:
+                if candidates is None or len(values) < len(candidates):
+                    candidates = values
+        values = self._search(
+            ("in", needle), lambda value: needle in value.lower(), candidates
+        )
+        return self.jobs_with(values)
+
+    def matching(self, regex) -> Set:
+        """The jobs whose value matches the compiled `regex`."""
+        values = self._search(
+            ("re", regex),
+            lambda value: regex.search(value) is not None,
+        )
+        return self.jobs_with(values)
+
+
+class FilterIndex:
+    """
+    Indexes of the jobs of a snapshot by the fields they can be filtered by, see
+    `job_filter.JobFilter`. When a new snapshot comes, only the jobs that changed
+    are re-indexed.
+    """
+
+    def __init__(self):
+        self.stat = ValueIndex()
+        self.queue = ValueIndex()
+        self.name = ValueIndex()
+        self.host = ValueIndex()
+        self._submit_times = []  # (submit_time, sort key), ascending
+        self._sort_keys = {}  # job -> sort key
+        self._jobs_by_id = {}
+
+    def update(self, jobs: Iterable[Job]):
+        """Make the index contain exactly `jobs`, e.g. those of a new snapshot."""
+        self._jobs_by_id, removed, added = diff_by_identity(self._jobs_by_id, jobs)
+        removed_times = [self._remove(job) for job in removed]
+        added_times = [self._add(job) for job in added]
+        self._submit_times = update_sorted(
+            self._submit_times,
+            [entry for entry in removed_times if entry is not None],
+            [entry for entry in added_times if entry is not None],
+        )
+
+    def _indexed_values(self, job):
+        """(index, value) for each index `job` is in."""
+        # Jobs don't always have all fields, see `poller.SourceState._to_job()`.
+        entries = [(self.stat, job.stat)]
+        for index, field in [(self.queue, "queue"), (self.name, "job_name")]:
+            value = getattr(job, field, None)
+            if value:
+                entries.append((index, value))
+        entries += [(self.host, host) for host in set(exec_hosts(job))]
+        return entries
+
+    def _add(self, job):
+        """Returns the job's entry in `_submit_times`, if it should have one."""
+        key = job_sort_key(job)
+        self._sort_keys[job] = key
+        for index, value in self._indexed_values(job):
+            index.add(value, job)
+        submit_time = getattr(job, "submit_time", None)
+        return None if submit_time is None else (submit_time, key, job)
+
+    def _remove(self, job):
+        """Returns the job's entry in `_submit_times`, if it has one."""
+        key = self._sort_keys.pop(job)
+        for index, value in self._indexed_values(job):
+            index.remove(value, job)
+        submit_time = getattr(job, "submit_time", None)
+        return None if submit_time is None else (submit_time, key, job)
+
+    def submitted_between(self, start=None, end=None) -> Set:
+        """The jobs submitted in [start, end), as POSIX timestamps."""
+        lo = 0 if start is None else bisect.bisect_left(self._submit_times, (start,))
+        hi = (
+            len(self._submit_times)
+            if end is None
+            else bisect.bisect_left(self._submit_times, (end,))
+        )
+        return {job for _, _, job in self._submit_times[lo:hi]}
+
+    def in_order(self, jobs: Iterable[Job]) -> List[Job]:
+        """Sorts indexed jobs like `SortedJobIndex` does."""
+        return sorted(jobs, key=self._sort_keys.__getitem__)
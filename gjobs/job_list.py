@@ -1,34 +1,181 @@
+import collections
 import os
 import random
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from . import parsing_bjobs, parsing_logs
-from .util import PeriodicTimer, LOG
+from .daemon import DaemonClient
+from .history import open_histories
+from .job import job_from_record
+from .poller import BjobsPoller, JobSnapshot
+from .resource_history import ResourceHistory
+from .snapshot_cache import load_snapshot, save_snapshot
+from .sources import Source
+from .util import LOG
+
+# A hung `bjobs` is killed after this long, and the previous data is kept.
+BJOBS_TIMEOUT_SECONDS = 30
+# How many full job records to remember.
+MAX_CACHED_DETAILS = 256
+# If fetching the full record of a job fails, try again after this long.
+DETAILS_RETRY_SECONDS = 10
 
 
 def job_fixtures():
     with open(
         os.path.join(os.path.dirname(__file__), "../data/bjobs_example_output.json")
     ) as f:
-        res = parsing_bjobs.parse_bjobs_output(f.read())
-        res[0]["jobid"] = str(int(res[0]["jobid"]) + random.randint(0, 100))
+        res = [job_from_record(r) for r in parsing_bjobs.parse_bjobs_output(f.read())]
+        res[0].jobid = str(int(res[0].jobid) + random.randint(0, 100))
         return res
 
 
 class JobList:
-    def __init__(self):
-        self.bjobs_timer = PeriodicTimer(datetime.timedelta(seconds=5))
-        self.running_jobs = []
+    def __init__(
+        self,
+        poll_interval=datetime.timedelta(seconds=5),
+        bjobs_timeout=BJOBS_TIMEOUT_SECONDS,
+        fields=None,
+        keep_history=True,
+        sources=(Source(),),
+        use_daemon=True,
+        adaptive=True,
+        cache_snapshot=False,
+    ):
+        """
+        `fields` are the job fields to poll for, see `parsing_bjobs.project_fields()`.
+        The rest can be fetched for individual jobs using `get_job_details()`.
+        If `keep_history` is set, finished jobs are remembered across sessions.
+        The jobs of all `sources` are shown together, see `sources.load_sources()`.
+        If `use_daemon` is set and a `daemon.PollingDaemon` is running, the jobs
+        are taken from it instead of running bjobs ourselves.
+        If `adaptive` is set, `poll_interval` is only the interval while jobs are
+        changing; see `poll_schedule.PollSchedule`.
+        If `cache_snapshot` is set, the jobs are saved at exit and shown at the next
+        start until the first poll is done, see `snapshot_cache`.
+        """
+        self.bjobs_timeout = bjobs_timeout
+        self.sources = {source.name: source for source in sources}
+        self.cache_snapshot = cache_snapshot
+        self.cached_snapshot = (
+            load_snapshot(sources, fields) if cache_snapshot else None
+        )
 
-    def get_jobs(self):
-        if self.bjobs_timer.should_do_now():
-            self.running_jobs = parsing_bjobs.parse_bjobs()
+        def make_poller():
+            return BjobsPoller(
+                poll_interval,
+                bjobs_timeout,
+                fields,
+                sources,
+                open_histories(sources) if keep_history else None,
+                adaptive,
+            )
+
+        self.poller = None
+        if use_daemon:
+            self.poller = DaemonClient.connect(sources, fields, fallback=make_poller)
+        if self.poller is None:
+            self.poller = make_poller()
+        self.poller.start()
+
+        # Full records of individual jobs, fetched on demand, as futures; the least
+        # recently used first. A future's result is None if bjobs failed.
+        self.details_executor = ThreadPoolExecutor(max_workers=1)
+        self.details = collections.OrderedDict()
+        # When to fetch those that failed again.
+        self._details_retry = {}
+        self.listeners = []
+        # Memory, CPU etc. of running jobs over time, sampled from the snapshots.
+        self.resource_history = ResourceHistory()
+
+    @property
+    def poll_interval(self) -> datetime.timedelta:
+        """The current interval between polls. The daemon decides it if we use one."""
+        return self.poller.poll_interval
+
+    def add_listener(self, callback):
+        """
+        `callback` is called, from another thread, whenever new data is available:
+        a new snapshot or the details of a job.
+        """
+        self.listeners.append(callback)
+        self.poller.listeners.append(callback)
+
+    def get_snapshot(self) -> JobSnapshot:
+        snapshot = self.poller.snapshot
+        if self.cached_snapshot is not None:
+            # Until every source has been polled (successfully or not).
+            if snapshot.time is None and snapshot.error is None:
+                return self.cached_snapshot
+            self.cached_snapshot = None
+        self.resource_history.update(snapshot)
+        return snapshot
 
+    def get_jobs(self):
         # if running_jobs:
         # running_jobs += [running_jobs[0], running_jobs[0]]
 
-        jobs = self.running_jobs
+        jobs = self.get_snapshot().jobs
         # jobs += job_fixtures()
 
-        jobs.sort(key=lambda x: -int(x["jobid"]))
         return jobs
+
+    def get_job_details(self, job) -> Optional[dict]:
+        """
+        Return the record of `job` with all fields, or None if it's still being fetched.
+        """
+        # The record changes as the job runs, but is final once it's finished.
+        # Re-fetch whenever the status changes so that we see the final state.
+        key = (job.get("source"), parsing_bjobs.job_spec(job), job.stat)
+
+        future = self.details.get(key)
+        if future is not None and future.done() and future.result() is None:
+            # bjobs failed, e.g. timed out; don't keep the partial record forever.
+            retry_at = self._details_retry.setdefault(
+                key, time.monotonic() + DETAILS_RETRY_SECONDS
+            )
+            if time.monotonic() >= retry_at:
+                future = None
+        if future is None:
+            self._details_retry.pop(key, None)
+            future = self.details[key] = self.details_executor.submit(
+                self._fetch_job_details, job
+            )
+            for listener in self.listeners:
+                future.add_done_callback(lambda _, f=listener: f())
+            if len(self.details) > MAX_CACHED_DETAILS:
+                old_key, _ = self.details.popitem(last=False)
+                self._details_retry.pop(old_key, None)
+        self.details.move_to_end(key)
+
+        if not future.done():
+            return None
+        # Until we can fetch it, show what we have.
+        return future.result() or job.to_dict()
+
+    def _fetch_job_details(self, job):
+        """The full record of `job`, or None if bjobs failed."""
+        try:
+            records = parsing_bjobs.parse_bjobs(
+                timeout=self.bjobs_timeout,
+                job_specs=[parsing_bjobs.job_spec(job)],
+                source=self.sources.get(job.get("source"), Source()),
+            )
+        except Exception as e:
+            LOG.append(f"Could not fetch details of job {job.jobid}: {e}")
+            return None
+
+        # If the job is not known anymore, fall back to what we have.
+        return records[0] if records else job.to_dict()
+
+    def close(self):
+        self.poller.stop()
+        snapshot = self.poller.snapshot
+        if self.cache_snapshot and snapshot.time is not None:
+            save_snapshot(snapshot, list(self.sources.values()))
+        self.details_executor.shutdown(wait=False, cancel_futures=True)
+        # Otherwise, exiting would wait for them to finish.
+        parsing_bjobs.kill_running_commands()
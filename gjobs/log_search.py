@@ -0,0 +1,218 @@
+import collections
+import concurrent.futures
+import functools
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Tuple
+
+from .metrics import METRICS
+from .util import LOG
+
+# Stop searching a file after this many matching lines.
+MAX_HITS_PER_FILE = 20
+# Longer lines are cut off.
+MAX_LINE_LENGTH = 300
+# How many (file, pattern) results to remember.
+MAX_CACHED_RESULTS = 4096
+SEARCH_PROCESSES = min(8, os.cpu_count() or 1)
+# mmaps can't count, so the lines before a hit are counted in copies of this many
+# bytes, so that a hit at the end of a big file doesn't copy all of it.
+COUNT_WINDOW = 1024 * 1024
+
+# A line number and the line.
+Hit = Tuple[int, str]
+
+
+class FileHits(NamedTuple):
+    path: str
+    label: str  # the job the file belongs to, if we know
+    hits: List[Hit]
+
+
+def compile_pattern(text) -> "re.Pattern[bytes]":
+    """
+    Compile what the user typed into a regex on bytes. Like "smart case" in editors,
+    the search is case-insensitive unless there are capitals. Raises `re.error`.
+    """
+    flags = re.MULTILINE
+    if text == text.lower():
+        flags |= re.IGNORECASE
+    return re.compile(text.encode(), flags)
+
+
+def count_newlines(data, start, end) -> int:
+    """
+    The number of newlines in `data[start:end]`, without copying all of it.
+
+    >>> count_newlines(b"a\\nb\\nc\\n", 1, 5)
+    2
+    """
+    return sum(
+        data[i : min(i + COUNT_WINDOW, end)].count(b"\n")
+        for i in range(start, end, COUNT_WINDOW)
+    )
+
+
+def find_hits(data, regex) -> List[Hit]:
+    """The lines of `data` (bytes or an mmap) that `regex` matches."""
+    hits = []
+    line_number = 1
+    counted_to = 0
+    line_end = -1
+    for match in regex.finditer(data):
+        if match.start() <= line_end:
+            # Another match in a line we already have.
+            continue
+        line_start = data.rfind(b"\n", 0, match.start()) + 1
+        line_end = data.find(b"\n", match.start())
+        if line_end == -1:
+            line_end = len(data)
+
+        # Each part of the file is counted only once.
+        line_number += count_newlines(data, counted_to, line_start)
+        counted_to = line_start
+        line = data[line_start : min(line_end, line_start + 4 * MAX_LINE_LENGTH)]
+        hits.append((line_number, line.decode(errors="replace")[:MAX_LINE_LENGTH]))
+        if len(hits) >= MAX_HITS_PER_FILE:
+            break
+    return hits
+
+
+def search_file(path, pattern: bytes, flags: int) -> List[Hit]:
+    """Runs in a worker process. The file is mapped rather than read into memory."""
+    regex = re.compile(pattern, flags)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Can't map an empty file.
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return find_hits(data, regex)
+
+
+class LogSearch:
+    """
+    Searches many output files for a regex at once, in a pool of processes. Results
+    come in one file at a time, as they are found; `listeners` are called (from
+    another thread) whenever there are new ones. Results are cached until a file
+    changes size or mtime, so searching again, or for the same thing in more files,
+    only searches what's new.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        self.text = ""
+        self.results = []  # FileHits with at least one hit, in the order found
+        self.n_files = 0
+        self.n_searched = 0
+        # Incremented whenever the above change.
+        self.version = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._futures = []
+        self._executor = None
+        # (path, size, mtime, pattern, flags) -> hits, the least recently used first.
+        self._cache = collections.OrderedDict()
+
+    @property
+    def done(self):
+        return self.n_searched >= self.n_files
+
+    def start(self, text, files: Dict[str, str]):
+        """
+        Search `files`, given as path -> label, for the regex `text`, replacing the
+        previous search. Raises `re.error` if `text` isn't a valid regex.
+        """
+        regex = compile_pattern(text)
+        self.cancel()
+        with self._lock:
+            generation = self._generation
+            self.text = text
+            self.results = []
+            self.n_files = len(files)
+            self.n_searched = 0
+            self.version += 1
+        METRICS.count("log searches")
+
+        # Looking up thousands of files on a network filesystem takes a while.
+        threading.Thread(
+            target=self._submit, args=(generation, regex, files), daemon=True
+        ).start()
+
+    def _submit(self, generation, regex, files):
+        for path, label in files.items():
+            if generation != self._generation:
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._add(generation, path, label, [])
+                continue
+
+            key = (path, stat.st_size, stat.st_mtime_ns, regex.pattern, regex.flags)
+            with self._lock:
+                hits = self._cache.get(key)
+                if hits is not None:
+                    self._cache.move_to_end(key)
+            if hits is not None:
+                METRICS.count("log search cache hits")
+                self._add(generation, path, label, hits)
+                continue
+
+            with self._lock:
+                if generation != self._generation:
+                    return
+                if self._executor is None:
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        SEARCH_PROCESSES,
+                        # Forking a process with threads running can deadlock.
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                future = self._executor.submit(
+                    search_file, path, regex.pattern, regex.flags
+                )
+                self._futures.append(future)
+            future.add_done_callback(
+                functools.partial(self._searched, generation, path, label, key)
+            )
+
+    def _searched(self, generation, path, label, key, future):
+        if future.cancelled():
+            return
+        try:
+            hits = future.result()
+        except Exception as e:
+            LOG.append(f"Can't search {path}: {e}")
+            hits = []
+        else:
+            with self._lock:
+                self._cache[key] = hits
+                if len(self._cache) > MAX_CACHED_RESULTS:
+                    self._cache.popitem(last=False)
+        self._add(generation, path, label, hits)
+
+    def _add(self, generation, path, label, hits):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.n_searched += 1
+            if hits:
+                self.results.append(FileHits(path, label, hits))
+            self.version += 1
+        for listener in self.listeners:
+            listener()
+
+    def cancel(self):
+        """Stop the current search. The results so far are kept."""
+        with self._lock:
+            self._generation += 1
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.cancel()
+
+    def close(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,119 @@
+import contextlib
+import functools
+import json
+import threading
+import time
+
+# Histogram buckets are powers of two, in microseconds: bucket i holds the durations
+# in [2^(i-1), 2^i) µs. The last one catches everything from ~1 minute on.
+N_BUCKETS = 28
+
+
+class Histogram:
+    """
+    A histogram of durations that takes the same amount of memory however many
+    durations are recorded. Percentiles are approximate: they are the upper bound
+    of the bucket they fall into.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        microseconds = int(seconds * 1e6)
+        self.buckets[min(microseconds.bit_length(), N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def percentile(self, p):
+        """In seconds. `p` is between 0 and 100."""
+        if self.count == 0:
+            return 0.0
+
+        threshold = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= threshold:
+                return min(2**i / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "max_ms": self.max * 1000,
+            "last_ms": self.last * 1000,
+        }
+
+
+class Metrics:
+    """
+    Timings of the hot paths and counts of expensive operations, so that we can put
+    real numbers on "gjobs is slow". Can be used from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.start_time = time.time()
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator that records how long each call of a function takes."""
+
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "uptime_s": time.time() - self.start_time,
+                "timings": {
+                    name: histogram.to_dict()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+
+METRICS = Metrics()
@@ -0,0 +1,258 @@
+import collections
+import ctypes
+import ctypes.util
+import os
+import struct
+import time
+from typing import Optional
+
+from .metrics import METRICS
+from .util import LOG
+
+# See `man inotify`.
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+
+class FileWatcher:
+    """
+    Tells us which of the watched files have changed, using inotify where it's
+    available. Inotify doesn't see writes made by other machines on network
+    filesystems, so the followers still need to be polled once in a while.
+    """
+
+    def __init__(self):
+        self.fd = None
+        self.path_to_wd = {}
+        self.wd_to_path = {}
+
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            LOG.append(f"inotify is not available: {e}")
+            return
+
+        if fd < 0:
+            LOG.append(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        else:
+            self.fd = fd
+
+    def fileno(self) -> Optional[int]:
+        """For `select()`. None if inotify is not available."""
+        return self.fd
+
+    def watch(self, path):
+        if self.fd is None:
+            return
+
+        wd = self._libc.inotify_add_watch(
+            self.fd,
+            os.fsencode(path),
+            IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF,
+        )
+        if wd < 0:
+            # e.g. the file doesn't exist yet; we'll fall back to polling.
+            return
+
+        # Watching the same inode again returns the same watch descriptor.
+        self.path_to_wd[path] = wd
+        self.wd_to_path[wd] = path
+
+    def unwatch(self, path):
+        wd = self.path_to_wd.pop(path, None)
+        if wd is not None and self.fd is not None:
+            self.wd_to_path.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_changes(self):
+        """Returns the set of watched paths that have changed since the last call."""
+        changed = set()
+        if self.fd is None:
+            return changed
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            METRICS.count("inotify reads")
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size + name_len
+
+                path = self.wd_to_path.get(wd)
+                if path is not None:
+                    changed.add(path)
+                if mask & IN_IGNORED:
+                    # The watch was removed, e.g. because the file was deleted.
+                    self.wd_to_path.pop(wd, None)
+                    self.path_to_wd.pop(path, None)
+
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class OutputFollower:
+    """
+    Follows a file that is being appended to, like `tail -f`. Remembers how far
+    we've read, so each `poll()` only reads the newly appended bytes, and keeps the
+    last `max_lines` lines in a ring buffer.
+    Handles the file being truncated or replaced by a new one.
+    """
+
+    def __init__(self, path, max_lines, watcher: Optional[FileWatcher] = None):
+        self.path = path
+        self.watcher = watcher
+        self.lines = collections.deque(maxlen=max_lines)
+        # The last line, if it's not terminated by a newline yet.
+        self.partial_line = b""
+        self.ended_with_cr = False
+        self.offset = 0
+        self.inode = None
+        self.exists = False
+        # How much to read at once when reading backwards from the end. Adapts to
+        # how long the lines in this file are.
+        self.block_size = MIN_BLOCK_SIZE
+        # When `poll()` last looked at the file, see `time.monotonic()`.
+        self.last_poll = -float("inf")
+
+    @property
+    def max_lines(self):
+        return self.lines.maxlen
+
+    def resize(self, max_lines):
+        if max_lines > self.max_lines:
+            # We don't have enough lines, so we need to read the end again.
+            self.lines = collections.deque(maxlen=max_lines)
+            self.inode = None
+
+    def poll(self) -> bool:
+        """Read what's new in the file. Returns whether anything has changed."""
+        METRICS.count("output stats")
+        self.last_poll = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            changed = self.exists
+            self._reset()
+            return changed
+
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # A new file, or it's been replaced or truncated. Start over.
+            self._reset()
+            self.exists = True
+            self.inode = stat.st_ino
+            if self.watcher is not None:
+                self.watcher.watch(self.path)
+            self._read_tail(stat.st_size)
+            return True
+
+        if stat.st_size == self.offset:
+            return False
+
+        if stat.st_size - self.offset > self.block_size * self.max_lines:
+            # So much has been appended that only the end is interesting.
+            self.lines.clear()
+            self.partial_line = b""
+            self.ended_with_cr = False
+            self._read_tail(stat.st_size)
+        else:
+            self._read_appended(stat.st_size)
+
+        return True
+
+    def _reset(self):
+        self.lines.clear()
+        self.partial_line = b""
+        self.ended_with_cr = False
+        self.offset = 0
+        self.inode = None
+        self.exists = False
+
+    def _read_tail(self, size):
+        METRICS.count("output tail reads")
+        with open(self.path, "rb") as f:
+            data = tail_bytes(f, self.max_lines + 1, self.block_size, end=size)
+
+        if data:
+            n_lines = max(data.count(b"\n"), 1)
+            average_line_length = len(data) / n_lines
+            self.block_size = int(
+                min(
+                    max(average_line_length * self.max_lines, MIN_BLOCK_SIZE),
+                    MAX_BLOCK_SIZE,
+                )
+            )
+
+        self._add_data(data)
+        self.offset = size
+
+    def _read_appended(self, size):
+        METRICS.count("output appended reads")
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+
+        self._add_data(data)
+        self.offset += len(data)
+
+    def _add_data(self, data):
+        if self.ended_with_cr and data.startswith(b"\n"):
+            # The rest of a "\r\n" that was split between two reads.
+            data = data[1:]
+
+        data = self.partial_line + data
+        lines = data.splitlines(keepends=True)
+
+        if lines and not lines[-1].endswith((b"\n", b"\r")):
+            self.partial_line = lines.pop()
+        else:
+            self.partial_line = b""
+        self.ended_with_cr = not self.partial_line and data.endswith(b"\r")
+
+        self.lines.extend(line.rstrip(b"\r\n") for line in lines)
+
+    def get_text(self, n_lines) -> str:
+        lines = list(self.lines)
+        if self.partial_line:
+            lines.append(self.partial_line)
+        return b"\n".join(lines[-n_lines:]).decode("utf-8", errors="replace")
+
+
+def tail_bytes(f, lines, block_size=MIN_BLOCK_SIZE, end=None):
+    """
+    Read backwards from `end` (the end of the file by default) in blocks until we
+    have at least `lines` lines. Returns the raw bytes.
+    """
+    if end is None:
+        f.seek(0, 2)  # seek to the end
+        end = f.tell()
+
+    blocks = []
+    lines_found = 0
+    block_end_byte = end
+
+    while lines_found < lines and block_end_byte > 0:
+        block_start_byte = max(block_end_byte - block_size, 0)
+        f.seek(block_start_byte)
+        blocks.append(f.read(block_end_byte - block_start_byte))
+        lines_found += blocks[-1].count(b"\n")
+        block_end_byte = block_start_byte
+
+    return b"".join(reversed(blocks))
@@ -1,52 +1,101 @@
-import glob
+import collections
 import os
 import signal
 import subprocess
-from typing import Tuple, Optional
+import time
+from typing import Dict, Tuple, Optional
 
+from . import parsing_logs
+from .metrics import METRICS
+from .output_follower import FileWatcher, OutputFollower
+from .spool_index import SpoolIndex
 from .util import LOG
-from .parsing_bjobs import parse_run_time
 
 # TODO: load and display job output while running
 #   open the files and keep loading the data while available
 #   or ideally run `less` in a subwindow?
 
 N_PREVIEW_LINES = 15
+# How many output files to keep following at once.
+MAX_FOLLOWERS = 8
+# Inotify doesn't see what other machines write to network filesystems, so files
+# it says haven't changed are still checked this often, in seconds.
+RECHECK_INTERVAL = 1
 
 
-class OutputViewer:
-    LSBATCH_DIR = "/cluster/shadow/.lsbatch"
-
-    def __init__(self):
-        self.id_to_file = {}
+def job_label(job):
+    """e.g. "1234" or "1234[5]" for an element of a job array."""
+    jobindex = job.get("jobindex") or "0"
+    return job.jobid if jobindex == "0" else f"{job.jobid}[{jobindex}]"
 
-    @staticmethod
-    def _find_running_output_file(job_id):
-        """Does not try to use cached results."""
-        # LOG.append(f"Globbing for {job_id}")
-        candidates = glob.glob(f"/cluster/shadow/.lsbatch/*{job_id}.out")
-        if len(candidates) > 1:
-            LOG.append(f"Warning: more than one output file found? {candidates}")
 
-        if candidates:
-            return candidates[0]
-        else:
-            return None
-
-    def get_running_output_file(self, job_id):
-        if job_id in self.id_to_file:
-            # This can also be None, if we've tried to find this before and didn't succeed
-            return self.id_to_file[job_id]
+class OutputViewer:
+    # The job fields that `get_output_file()` looks at.
+    REQUIRED_FIELDS = ["jobid", "stat", "run_time", "exec_cwd", "output_file"]
+
+    def __init__(self, lsbatch_dir=None):
+        self.spool_index = SpoolIndex(lsbatch_dir)
+        self.watcher = FileWatcher()
+        # Output files we're following, the least recently used first.
+        self.followers = collections.OrderedDict()
+        # Followed files that the watcher saw change since they were last read.
+        self._changed = set()
+        # The file open in the pager, if any. Watched for as long as it's open.
+        self.pager_file = None
+
+    def get_follower(self, output_file, n_lines) -> OutputFollower:
+        follower = self.followers.get(output_file)
+
+        if follower is None:
+            follower = OutputFollower(output_file, n_lines, self.watcher)
+            self.followers[output_file] = follower
+
+            if len(self.followers) > MAX_FOLLOWERS:
+                old_file, _ = self.followers.popitem(last=False)
+                if old_file != self.pager_file:
+                    self.watcher.unwatch(old_file)
+                self._changed.discard(old_file)
         else:
-            res = self._find_running_output_file(job_id)
-            # again - possibly None!
-            self.id_to_file[job_id] = res
-
-            return res
+            self.followers.move_to_end(output_file)
+            follower.resize(n_lines)
+
+        return follower
+
+    def set_pager_file(self, output_file):
+        """Watch `output_file` while it's open in the pager. None once it's closed."""
+        old_file, self.pager_file = self.pager_file, output_file
+        if old_file is not None and old_file not in self.followers:
+            self.watcher.unwatch(old_file)
+        if output_file is not None:
+            self.watcher.watch(output_file)
+
+    def read_changes(self) -> bool:
+        """
+        Find out from the watcher which files changed, the followed ones or the one
+        in the pager. Returns whether any did.
+        """
+        changed = self.watcher.read_changes()
+        self._changed |= changed & self.followers.keys()
+        return bool(changed & (self.followers.keys() | {self.pager_file}))
+
+    def _poll(self, output_file, follower):
+        """
+        Read what's new in `output_file`, unless the watcher can tell that nothing
+        is. That way, showing the output of many jobs only costs reading the files
+        that change, not a `stat()` of every file on every frame.
+        """
+        if (
+            output_file in self._changed
+            or output_file not in self.watcher.path_to_wd
+            or follower.inode is None
+            or time.monotonic() - follower.last_poll >= RECHECK_INTERVAL
+        ):
+            self._changed.discard(output_file)
+            follower.poll()
 
     def get_finished_output_file(self, job):
-        if job.get("exec_cwd") and job.get("output_file"):
-            return os.path.join(job["exec_cwd"], job["output_file"])
+        if job.exec_cwd and job.output_file:
+            return os.path.join(job.exec_cwd, job.output_file)
         else:
             return None
 
@@ -54,23 +103,37 @@ class OutputViewer:
         # See https://www.ibm.com/docs/en/spectrum-lsf/10.1.0?topic=execution-about-job-states
         # for info about job states
 
-        if job["stat"] in ["RUN", "USUSP", "SSUSP"]:
-            run_time = parse_run_time(job["run_time"])
-
-            if run_time and run_time >= 10:
-                return self.get_running_output_file(job["jobid"])
+        if job.stat in ["RUN", "USUSP", "SSUSP"]:
+            if job.run_time and job.run_time >= 10:
+                return self.spool_index.find(job.jobid)
             else:
                 # For the first few seconds of a job's runtime,
                 # the file might not exist yet.
                 return None
-        elif job["stat"] in ["PEND", "PSUSP"]:
+        elif job.stat in ["PEND", "PSUSP"]:
             return None
-        elif job["stat"] in ["DONE", "EXIT"]:
+        elif job.stat in ["DONE", "EXIT"]:
             return self.get_finished_output_file(job)
         else:
-            LOG.append(f'Unknown job status {job["stat"]}')
+            LOG.append(f"Unknown job status {job.stat}")
             return None
 
+    def get_output_files(self, jobs) -> Dict[str, str]:
+        """
+        All the output files we know of: those of `jobs`, those in the spool and
+        stray "lsf.o*" files, as path -> the job they belong to.
+        """
+        files = {}
+        for job in jobs:
+            output_file = self.get_output_file(job)
+            if output_file:
+                files.setdefault(os.path.abspath(output_file), job_label(job))
+        for job_id, output_file in self.spool_index.all().items():
+            files.setdefault(os.path.abspath(output_file), job_id)
+        for output_file in parsing_logs.find_log_files():
+            files.setdefault(os.path.abspath(output_file), "")
+        return files
+
     def get_output_preview(
         self, job, n_preview_lines=N_PREVIEW_LINES
     ) -> Tuple[Optional[str], str]:
@@ -80,14 +143,16 @@ class OutputViewer:
 
         output_file = self.get_output_file(job)
         if output_file is None:
-            return None, f"(no output file available for job {job['jobid']})"
+            return None, f"(no output file available for job {job.jobid})"
 
-        try:
-            with open(output_file, "rb") as f:
-                output_preview = tail(f, lines=n_preview_lines)
+        # Only reads what has been appended since the last time.
+        follower = self.get_follower(output_file, n_preview_lines)
+        with METRICS.timer("preview tail"):
+            self._poll(output_file, follower)
 
-            return output_file, output_preview
-        except FileNotFoundError:
+        if follower.exists:
+            return output_file, follower.get_text(n_preview_lines)
+        else:
             return output_file, f"Couldn't find {output_file}"
 
     def open_output_fullscreen(self, job):
@@ -97,7 +162,7 @@ class OutputViewer:
 
             command = ["less", "-r"]
 
-            if job["stat"] == "RUN":
+            if job.stat == "RUN":
                 # Tail the file (wait for incoming data) if the job is still running
                 command.append("+F")
             else:
@@ -106,31 +171,3 @@ class OutputViewer:
 
             subprocess.run(command + [output_file])
             signal.signal(signal.SIGINT, old_action)
-
-
-def tail(f, lines=20):
-    # https://stackoverflow.com/questions/136168/get-last-n-lines-of-a-file-similar-to-tail
-    total_lines_wanted = lines
-
-    BLOCK_SIZE = 1024
-    f.seek(0, 2)  # seek to the end
-    block_end_byte = f.tell()
-    lines_to_go = total_lines_wanted
-    block_number = -1
-    blocks = []
-    while lines_to_go > 0 and block_end_byte > 0:
-        if block_end_byte - BLOCK_SIZE > 0:
-            f.seek(block_number * BLOCK_SIZE, 2)
-            blocks.append(f.read(BLOCK_SIZE))
-        else:
-            # Can read the entirety of the file
-            f.seek(0, 0)
-            blocks.append(f.read(block_end_byte))
-        lines_found = blocks[-1].count(b"\n")
-        lines_to_go -= lines_found
-        block_end_byte -= BLOCK_SIZE
-        block_number -= 1
-    all_read_text = b"".join(reversed(blocks))
-
-    res_bytes = b"\n".join(all_read_text.splitlines()[-total_lines_wanted:])
-    return res_bytes.decode("utf-8", errors="replace")
@@ -0,0 +1,303 @@
+import array
+import bisect
+import mmap
+import os
+import re
+from typing import List, Optional
+
+from .log_search import compile_pattern
+from .metrics import METRICS
+
+# The line index stores how many lines there are before each block of this many
+# bytes, so it takes 8 bytes per 64 KiB of output.
+INDEX_BLOCK_SIZE = 64 * 1024
+# How much to index per frame when the line number of the top line isn't known yet.
+INDEX_STEP = 256 * INDEX_BLOCK_SIZE
+# Searches go through this much of the file per frame, so that the UI stays
+# responsive while searching a big file.
+SEARCH_WINDOW = 4 * 1024 * 1024
+# Longer lines are cut off when shown.
+MAX_LINE_BYTES = 4096
+
+
+class LineIndex:
+    """
+    A sparse index of the lines of a file: the number of lines before the start of
+    each block of INDEX_BLOCK_SIZE bytes. It's built lazily, as far as needed, and
+    the file is only looked at one block at a time. When the file grows, the blocks
+    indexed so far stay valid.
+    """
+
+    def __init__(self):
+        # line_counts[i] is the number of newlines before byte i * INDEX_BLOCK_SIZE.
+        self.line_counts = array.array("q", [0])
+
+    @property
+    def indexed_to(self):
+        return (len(self.line_counts) - 1) * INDEX_BLOCK_SIZE
+
+    def extend(self, data, offset, max_bytes=None):
+        """Index the blocks before `offset`, or at most `max_bytes` of them."""
+        end = min(offset, len(data))
+        if max_bytes is not None:
+            end = min(end, self.indexed_to + max_bytes)
+        if end < self.indexed_to + INDEX_BLOCK_SIZE:
+            return
+
+        with METRICS.timer("pager indexing"):
+            while self.indexed_to + INDEX_BLOCK_SIZE <= end:
+                start = self.indexed_to
+                block = data[start : start + INDEX_BLOCK_SIZE]
+                self.line_counts.append(self.line_counts[-1] + block.count(b"\n"))
+
+    def line_at(self, data, offset) -> int:
+        """The number (from 0) of the line that byte `offset` is in."""
+        self.extend(data, offset)
+        block = offset // INDEX_BLOCK_SIZE
+        start = block * INDEX_BLOCK_SIZE
+        return self.line_counts[block] + data[start:offset].count(b"\n")
+
+    def line_start(self, data, line) -> int:
+        """Where line number `line` (from 0) starts, or the end if there's no such line."""
+        while self.line_counts[-1] < line and self.indexed_to + INDEX_BLOCK_SIZE <= len(
+            data
+        ):
+            self.extend(data, self.indexed_to + INDEX_BLOCK_SIZE)
+
+        # The last block that starts before the line does.
+        block = max(bisect.bisect_left(self.line_counts, line) - 1, 0)
+        offset = block * INDEX_BLOCK_SIZE
+        for _ in range(line - self.line_counts[block]):
+            offset = data.find(b"\n", offset) + 1
+            if offset == 0:
+                return len(data)
+        return offset
+
+
+class Pager:
+    """
+    Shows a file that can be much bigger than memory, like `less`. The file is
+    memory-mapped and only the lines on screen are read; `LineIndex` finds lines by
+    number. In follow mode, we stay at the end as the file grows.
+
+    Positions are byte offsets: scrolling and jumping to a percentage don't need to
+    know line numbers, so they're fast anywhere in the file.
+    """
+
+    def __init__(self, path, follow=False):
+        self.path = path
+        self.follow = follow
+        # How many lines fit on the screen. Set by the UI.
+        self.height = 1
+        # Where the first line shown starts.
+        self.top = 0
+        self.regex = None  # what we're searching for, on bytes
+        self.pattern = None  # the same, on str, for highlighting
+        # Something to tell the user, e.g. that the search found nothing.
+        self.message = None
+        # A number typed before a command, as in `less`: "50g" goes to line 50.
+        self.count = ""
+        # What's being typed after "/" or "?", None if nothing.
+        self.prompt = None
+        self.prompt_kind = None
+        # The search in progress: whether backwards, and where to go on from.
+        self._search = None
+
+        self._data = b""
+        self._inode = None
+        self._index = LineIndex()
+        self.refresh()
+
+    @property
+    def size(self):
+        return len(self._data)
+
+    def refresh(self) -> bool:
+        """Map the file again if it has changed. Returns whether it has."""
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            self.message = f"Can't open {self.path}: {e.strerror}"
+            return False
+
+        if stat.st_ino == self._inode and stat.st_size == self.size:
+            return False
+
+        if stat.st_ino != self._inode or stat.st_size < self.size:
+            # A new file, or it's been truncated.
+            self._index = LineIndex()
+            self.top = 0
+            self._search = None
+        self._inode = stat.st_ino
+        self._map()
+
+        if self.follow:
+            self.end()
+        else:
+            self.top = min(self.top, self._last_page_top())
+        return True
+
+    def _map(self):
+        METRICS.count("pager maps")
+        old_data = self._data
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self._data = b""  # can't map an empty file
+                else:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            self.message = f"Can't open {self.path}: {e}"
+            return
+        if isinstance(old_data, mmap.mmap):
+            old_data.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = b""
+
+    def _next_line(self, offset):
+        newline = self._data.find(b"\n", offset)
+        return self.size if newline == -1 else newline + 1
+
+    def _line_start(self, offset):
+        """Where the line that byte `offset` is in starts."""
+        return self._data.rfind(b"\n", 0, offset) + 1
+
+    def _last_page_top(self):
+        # A final newline doesn't start another line.
+        end = self.size - 1 if self._data[-1:] == b"\n" else self.size
+        top = self._line_start(end)
+        for _ in range(self.height - 1):
+            if top == 0:
+                break
+            top = self._line_start(top - 1)
+        return top
+
+    def resize(self, height):
+        self.height = max(height, 1)
+        if self.follow:
+            self.end()
+        else:
+            self.top = min(self.top, self._last_page_top())
+
+    def lines(self) -> List[bytes]:
+        """The lines on screen, without the newlines. Long lines are cut off."""
+        lines = []
+        offset = self.top
+        while len(lines) < self.height and offset < self.size:
+            end = self._next_line(offset)
+            lines.append(self._data[offset : min(end, offset + MAX_LINE_BYTES)])
+            offset = end
+        return [line.rstrip(b"\r\n") for line in lines]
+
+    def scroll(self, n_lines):
+        """Scroll down by `n_lines`, up if negative. Scrolling up stops following."""
+        last_page_top = self._last_page_top()
+        for _ in range(abs(n_lines)):
+            if n_lines > 0 and self.top < last_page_top:
+                self.top = self._next_line(self.top)
+            elif n_lines < 0 and self.top > 0:
+                self.top = self._line_start(self.top - 1)
+                self.follow = False
+        self.top = min(self.top, last_page_top)
+
+    def home(self):
+        self.top = 0
+        self.follow = False
+
+    def end(self):
+        self.top = self._last_page_top()
+
+    def go_to_line(self, line):
+        """Show line number `line` (from 1) at the top, if we're not at the end."""
+        with METRICS.timer("pager go to line"):
+            self.top = self._index.line_start(self._data, max(line - 1, 0))
+        self.top = min(self.top, self._last_page_top())
+        self.follow = False
+
+    def go_to_percent(self, percent):
+        offset = int(self.size * min(max(percent, 0), 100) / 100)
+        self.top = min(self._line_start(offset), self._last_page_top())
+        self.follow = False
+
+    def line_number(self) -> Optional[int]:
+        """
+        The number of the top line, from 1, or None if we haven't indexed that far
+        yet: each call indexes some more, see `indexing`.
+        """
+        self._index.extend(self._data, self.top, max_bytes=INDEX_STEP)
+        if self._index.indexed_to + INDEX_BLOCK_SIZE <= self.top:
+            return None
+        return self._index.line_at(self._data, self.top) + 1
+
+    @property
+    def indexing(self):
+        """Whether `line_number()` needs to be called again to find the line number."""
+        return self._index.indexed_to + INDEX_BLOCK_SIZE <= self.top
+
+    def percent(self):
+        """How far into the file the bottom of the screen is."""
+        if not self.size:
+            return 100
+        bottom = self.top + sum(len(line) + 1 for line in self.lines())
+        return min(100 * bottom // self.size, 100)
+
+    def search(self, text, backwards=False):
+        """Go to the next line that matches the regex `text`. Raises `re.error`."""
+        self.regex = compile_pattern(text)
+        self.pattern = re.compile(text, self.regex.flags)
+        self.search_next(backwards)
+
+    def search_next(self, backwards=False):
+        """Start looking for the next match of the last search, or the previous one."""
+        if self.regex is None:
+            return
+        start = self.top if backwards else self._next_line(self.top)
+        self._search = (backwards, start)
+        self.message = None
+        self.search_step()
+
+    @property
+    def searching(self):
+        """Whether `search_step()` needs to be called again to finish the search."""
+        return self._search is not None
+
+    def stop_search(self):
+        self._search = None
+
+    def search_step(self):
+        """
+        Search the next SEARCH_WINDOW bytes for the search in progress, and go to
+        the match if there is one. Regexes can only search forwards, so searching
+        backwards goes through windows from the end.
+        """
+        if self._search is None:
+            return
+        backwards, position = self._search
+        with METRICS.timer("pager search"):
+            if backwards:
+                start = self._line_start(max(position - SEARCH_WINDOW, 0))
+                if start == position > 0:
+                    # A single line longer than the window.
+                    start = position - SEARCH_WINDOW
+                match = None
+                for match in self.regex.finditer(self._data, start, position):
+                    pass
+                next_position, done = start, start == 0
+            else:
+                # Whole lines, so that "$" only matches at the end of one.
+                end = self._next_line(min(position + SEARCH_WINDOW, self.size))
+                match = self.regex.search(self._data, position, end)
+                next_position, done = end, end >= self.size
+
+        if match is not None:
+            self._search = None
+            self.top = min(self._line_start(match.start()), self._last_page_top())
+            self.follow = False
+        elif done:
+            self._search = None
+            self.message = "Pattern not found"
+        else:
+            self._search = (backwards, next_position)
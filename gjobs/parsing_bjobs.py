@@ -1,11 +1,22 @@
+import codecs
+import datetime
 import subprocess
 import re
-import sys
 import json
+import os
+import signal
+import tempfile
+import threading
+import time
 
 from .bjobs_fields import bjobs_fields
+from .capabilities import UnsupportedFieldCache, cluster_key
+from .metrics import METRICS
+from .sources import Source
+from .util import LOG, environment
 
-# These don't work on Euler for whatever reason
+# These don't work on Euler for whatever reason. Other unsupported fields are found
+# on the fly and remembered per cluster in UNSUPPORTED_FIELDS.
 EXCLUDED_FIELDS = [
     "suspend_reason",
     "resume_reason",
@@ -16,13 +27,64 @@ EXCLUDED_FIELDS = [
 ]
 DEFAULT_WIDTH = 50
 
+UNSUPPORTED_FIELDS = UnsupportedFieldCache()
 
-def filter_fields(excluded):
-    return [f for f in bjobs_fields if f["name"] not in excluded]
+# How much of the bjobs output to read at once when parsing it.
+READ_CHUNK_SIZE = 64 * 1024
+RECORDS_START_REGEX = re.compile(r'"RECORDS"\s*:\s*\[')
+# The bjobs processes that are running right now.
+RUNNING_PROCESSES = set()
 
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+# e.g. "Mar  9 17:40", "Mar  9 21:40 L", "Mar  9 17:40:12 2021"
+TIMESTAMP_REGEX = re.compile(
+    r"\s*([A-Z][a-z]{2})\s+([0-9]{1,2})\s+([0-9]{1,2}):([0-9]{2})(?::([0-9]{2}))?"
+    r"(?:\s+([0-9]{4}))?"
+)
+MAX_ESTIMATE_AHEAD = datetime.timedelta(days=31)
+MEMORY_UNITS = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40, "P": 2**50}
 
-def make_command(excluded_fields):
-    fields = filter_fields(excluded_fields)
+# Needed to identify and sort jobs, so they are always requested.
+KEY_FIELDS = ["jobid", "jobindex", "stat"]
+
+
+def project_fields(*field_lists):
+    """
+    Merge the lists of fields that the different parts of gjobs display into the
+    set of fields to ask bjobs for, in the order bjobs documents them.
+    >>> project_fields(["job_name", "stat"], ["run_time"])
+    ['jobid', 'jobindex', 'stat', 'job_name', 'run_time']
+    """
+    wanted = set(KEY_FIELDS).union(*field_lists)
+    return [f["name"] for f in bjobs_fields if f["name"] in wanted]
+
+
+def filter_fields(excluded, fields=None):
+    """If `fields` is None, all known fields are used."""
+    return [
+        f
+        for f in bjobs_fields
+        if f["name"] not in excluded and (fields is None or f["name"] in fields)
+    ]
+
+
+def job_spec(job):
+    """How to refer to a job (or an element of a job array) on the bjobs command line."""
+    if job.get("jobindex") in ["0", "", None]:
+        return job["jobid"]
+    else:
+        return f"{job['jobid']}[{job['jobindex']}]"
+
+
+def job_key(job):
+    """Identifies a job, or an element of a job array."""
+    return job["jobid"], job.get("jobindex") or "0"
+
+
+def make_command(
+    excluded_fields, fields=None, job_specs=(), include_finished=True, user=None
+):
+    fields = filter_fields(excluded_fields, fields)
 
     format = []
     for field in fields:
@@ -35,31 +97,188 @@ def make_command(excluded_fields):
         #     format.append(f"{field['name']}")
 
     format = " ".join(format)
-    return ["bjobs", "-a", "-o", format, "-json"]
+    # Without -a, bjobs only shows unfinished jobs.
+    all_flag = ["-a"] if include_finished else []
+    user_flag = ["-u", user] if user else []
+    return ["bjobs", *all_flag, *user_flag, "-o", format, "-json", *job_specs]
 
 
-def run_bjobs():
-    for i in range(50):
-        cmd = make_command(EXCLUDED_FIELDS)
+class UnsupportedFieldError(Exception):
+    def __init__(self, field):
+        super().__init__(f"bjobs doesn't support the field {field}")
+        self.field = field
+
 
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stderr = res.stderr.decode("utf-8")
+def iter_records(stream, chunk_size=READ_CHUNK_SIZE):
+    """
+    Parse the output of `bjobs -json` from a binary stream and yield its records one
+    by one, so that we never hold all of the output in memory at once.
+    """
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    pos = 0
+    eof = False
+    # Only the time spent decoding JSON, not waiting for bjobs.
+    parse_time = 0.0
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        # Drop what we've already parsed.
+        buffer = buffer[pos:] + utf8_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    # Skip the header, e.g. {"COMMAND":"bjobs","JOBS":2,"RECORDS":[
+    while True:
+        match = RECORDS_START_REGEX.search(buffer)
+        if match:
+            pos = match.end()
+            break
+        if eof:
+            if not buffer.strip():
+                raise ValueError("bjobs printed nothing")
+            # There is no RECORDS array when there are no jobs.
+            if json.loads(buffer)["JOBS"] != 0:
+                raise ValueError("No RECORDS in the bjobs output")
+            return
+        read_more()
+
+    while True:
+        # Skip the separators between records.
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("The bjobs output ended unexpectedly")
+            read_more()
+            continue
+
+        if buffer[pos] == "]":
+            METRICS.record("JSON parse", parse_time)
+            return
+
+        start = time.perf_counter()
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Most likely, we only have a part of the record so far.
+            if eof:
+                raise
+            read_more()
+            continue
+        finally:
+            parse_time += time.perf_counter() - start
+
+        pos = end
+        yield record
+
+
+def kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def kill_running_commands():
+    """Kill all bjobs processes that are still running, e.g. because we're exiting."""
+    for process in list(RUNNING_PROCESSES):
+        kill_process_group(process)
+
+
+def _stream_command(cmd, timeout=None, env=None):
+    """Run bjobs and yield the records it outputs as soon as they are parsed."""
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        kill_process_group(process)
+
+    with tempfile.TemporaryFile() as stderr_file:
+        # In its own process group, so that we can kill bjobs including any children
+        # that might be keeping the pipe open.
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            start_new_session=True,
+            env=env,
+        )
+        RUNNING_PROCESSES.add(process)
+        start = time.perf_counter()
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
 
-        if "not a valid field name" in stderr:
-            match = re.search(r"<(.*)>", stderr)
-            assert match is not None, f"unexpected error: {stderr}"
+        try:
+            try:
+                for record in iter_records(process.stdout):
+                    yield record
+            except ValueError:
+                # If bjobs failed, its error message explains more than ours.
+                process.wait()
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode("utf-8", errors="replace")
+
+                if timed_out.is_set():
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                if "not a valid field name" in stderr:
+                    match = re.search(r"<(.*)>", stderr)
+                    assert match is not None, f"unexpected error: {stderr}"
+                    raise UnsupportedFieldError(match.groups()[0])
+                if stderr.strip():
+                    raise RuntimeError(stderr.strip())
+                raise
+
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(cmd, timeout)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if process.poll() is None:
+                # The consumer stopped early, or something went wrong.
+                kill_process_group(process)
+            process.stdout.close()
+            process.wait()
+            RUNNING_PROCESSES.discard(process)
+            METRICS.record("bjobs", time.perf_counter() - start)
+
+
+def iter_bjobs(
+    timeout=None, fields=None, job_specs=(), include_finished=True, source=Source()
+):
+    """
+    Run bjobs and yield the jobs it returns one by one.
+    If `timeout` (in seconds) is given and `bjobs` takes longer than that, it is killed
+    and `subprocess.TimeoutExpired` is raised.
+    Only the given `fields` are requested (all of them if None), and only for the jobs
+    in `job_specs` (all jobs if empty). If `include_finished` is False, finished jobs
+    are left out. `source` says which cluster to ask, and about whose jobs.
+    """
+    key = cluster_key(source.env)
+    env = environment(source.env)
 
-            bad_field = match.groups()[0]
-            EXCLUDED_FIELDS.append(bad_field)
+    for i in range(50):
+        excluded_fields = set(EXCLUDED_FIELDS) | UNSUPPORTED_FIELDS.get(key)
+        cmd = make_command(
+            excluded_fields, fields, job_specs, include_finished, source.user
+        )
 
-            # We can find excluded fields on the fly, but it's a bit wasteful.
-            print(
-                f"Excluding field {bad_field}, please update EXCLUDED_FIELDS",
-                file=sys.stderr,
-            )
-        else:
-            output = res.stdout.decode("utf-8")
-            return output
+        try:
+            for record in _stream_command(cmd, timeout, env):
+                # When asking for specific jobs, the ones bjobs doesn't know about
+                # anymore are returned as records with just the JOBID and an ERROR.
+                if "ERROR" not in record:
+                    yield dict_keys_to_lowercase(record)
+            return
+        except UnsupportedFieldError as e:
+            # bjobs checks the fields before printing anything, so no jobs have been
+            # yielded yet. Remember the field so that next time, we don't need to ask.
+            UNSUPPORTED_FIELDS.add(key, e.field)
+            LOG.append(f"Excluding field {e.field} on {key}")
 
     assert False, "Too many invalid fields or stuck in a loop"
 
@@ -84,32 +303,126 @@ def parse_bjobs_output(raw_output):
     if data["JOBS"] == 0:
         return []
 
-    jobs = [dict_keys_to_lowercase(job) for job in data["RECORDS"]]
+    # When asking for specific jobs, the ones bjobs doesn't know about anymore
+    # are returned as records with just the JOBID and an ERROR.
+    jobs = [
+        dict_keys_to_lowercase(job) for job in data["RECORDS"] if "ERROR" not in job
+    ]
 
     return jobs
 
 
-def parse_bjobs():
-    raw_output = run_bjobs()
-    # print(raw_output)
-    return parse_bjobs_output(raw_output)
+def parse_bjobs(
+    timeout=None, fields=None, job_specs=(), include_finished=True, source=Source()
+):
+    return list(
+        iter_bjobs(
+            timeout=timeout,
+            fields=fields,
+            job_specs=job_specs,
+            include_finished=include_finished,
+            source=source,
+        )
+    )
+
 
+def _number(s):
+    value = float(s)
+    return int(value) if value.is_integer() else value
 
-def parse_run_time(run_time_string):
+
+def parse_seconds(value):
     """
-    The field is job["run_time"].
-    e.g.
-    >>> parse_run_time("25 second(s)")
+    Parse a field with the unit "seconds". Returns None if there is no value.
+    >>> parse_seconds("25 second(s)")
     25
+    >>> parse_seconds("0.2 second(s)")
+    0.2
+    >>> parse_seconds("3694")
+    3694
+    >>> parse_seconds("3:51 L")  # hours:minutes
+    13860
+    >>> parse_seconds("") is None
+    True
     """
+    match = re.match(r"\s*([0-9.]+)(?: second\(s\))?\s*$", value)
+    if match:
+        return _number(match.groups()[0])
 
-    match = re.match(r"([0-9]*) second\(s\)", run_time_string)
+    match = re.match(r"\s*([0-9]+):([0-9]{2})\b", value)
     if match:
-        t = match.groups()[0]
-        return int(t)
-    else:
+        hours, minutes = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60
+
+    return None
+
+
+def parse_minutes(value):
+    """
+    >>> parse_minutes("240.0")
+    14400
+    """
+    match = re.match(r"\s*([0-9.]+)\s*$", value)
+    return _number(float(match.groups()[0]) * 60) if match else None
+
+
+def parse_timestamp(value, now=None):
+    """
+    Parse a field with the unit "time stamp" into a POSIX timestamp.
+    bjobs usually doesn't show the year, so we pick the most recent one that doesn't
+    put the time too far into the future (estimates such as "Mar 12 21:40 L" can be).
+    >>> now = datetime.datetime(2021, 3, 10, 12, 0)
+    >>> datetime.datetime.fromtimestamp(parse_timestamp("Mar 12 21:40 L", now))
+    datetime.datetime(2021, 3, 12, 21, 40)
+    >>> datetime.datetime.fromtimestamp(parse_timestamp("Dec 31 23:59", now))
+    datetime.datetime(2020, 12, 31, 23, 59)
+    >>> datetime.datetime.fromtimestamp(parse_timestamp("Jun  1 10:00", now))
+    datetime.datetime(2020, 6, 1, 10, 0)
+    >>> parse_timestamp("-") is None
+    True
+    """
+    match = TIMESTAMP_REGEX.match(value)
+    if not match:
         return None
 
+    month, day, hour, minute, second, year = match.groups()
+    now = now or datetime.datetime.now()
+
+    def make(year):
+        return datetime.datetime(
+            year, MONTHS.index(month) + 1, int(day), int(hour), int(minute)
+        ) + datetime.timedelta(seconds=int(second or 0))
+
+    try:
+        if year:
+            parsed = make(int(year))
+        else:
+            candidates = [make(y) for y in [now.year + 1, now.year, now.year - 1]]
+            parsed = next(t for t in candidates if t <= now + MAX_ESTIMATE_AHEAD)
+    except ValueError:  # e.g. Feb 29 in a year that doesn't have it
+        return None
+
+    return int(parsed.timestamp())
+
+
+def parse_memory(value):
+    """
+    Parse a field with the unit LSF_UNIT_FOR_LIMITS into bytes.
+    Numbers without a unit are in kilobytes, the LSF default.
+    >>> parse_memory("2.6 Gbytes")
+    2791728742
+    >>> parse_memory("3 G")
+    3221225472
+    >>> parse_memory("") is None
+    True
+    """
+    match = re.match(r"\s*([0-9.]+)\s*([KMGTP]?)", value)
+    if not match:
+        return None
+
+    number, unit = match.groups()
+    return int(float(number) * MEMORY_UNITS[unit or "K"])
+
 
 if __name__ == "__main__":
     jobs = parse_bjobs()
@@ -1,19 +1,27 @@
 import os
 import re
 
+from .util import LOG
+
 SEARCH_PATHS = [os.path.expanduser("~")]
+# What LSF calls output files by default, e.g. "lsf.o1234".
+LOG_FILE_REGEX = re.compile(r"lsf\.o[0-9]+$")
 
 
 def find_log_files(additional_search_paths=None):
-    search_paths = SEARCH_PATHS
-    if additional_search_paths:
-        search_paths += additional_search_paths
+    """The LSF output files in `SEARCH_PATHS` and `additional_search_paths`."""
+    search_paths = SEARCH_PATHS + list(additional_search_paths or [])
 
     all_files = []
 
     for path in search_paths:
-        files = [os.path.join(path, f) for f in os.listdir(path)]
-        files = [f for f in files if re.match(r"lsf.o[0-9]*", f)]
-        all_files += files
+        try:
+            names = os.listdir(path)
+        except OSError as e:
+            LOG.append(f"Can't look for output files in {path}: {e}")
+            continue
+        all_files += [
+            os.path.join(path, name) for name in names if LOG_FILE_REGEX.match(name)
+        ]
 
     return all_files
@@ -0,0 +1,91 @@
+import time
+from typing import Iterable, Optional
+
+from .job import Job
+
+# The job fields that `PollSchedule` looks at.
+REQUIRED_FIELDS = ["stat", "estimated_start_time", "time_left", "runtimelimit"]
+
+# Never poll more often than this (unless asked to poll more often in general).
+MIN_INTERVAL_SECONDS = 2
+# How far to back off when nothing happens. Kept short even without running jobs,
+# since a job submitted from elsewhere (another shell, a pipeline) only shows up at
+# the next poll.
+MAX_INTERVAL_SECONDS = 60
+# bjobs should be running at most 1/LATENCY_FACTOR of the time.
+LATENCY_FACTOR = 10
+# How much weight the latest bjobs duration gets in the running average.
+LATENCY_SMOOTHING = 0.3
+# Poll this long after a job is expected to start or finish, to give LSF time to
+# notice. If it hasn't happened this long after, stop expecting it.
+EVENT_SLACK_SECONDS = 2
+EVENT_GRACE_SECONDS = 60
+
+
+def expected_event_time(job: Job, now) -> Optional[float]:
+    """When `job` is expected to start or finish, as a POSIX timestamp, if we know."""
+    # `time_left` and `run_time` are as of the poll, which has just finished.
+
+    if job.stat == "PEND":
+        return job.get("estimated_start_time")
+
+    if job.stat == "RUN":
+        if job.get("time_left") is not None:
+            return now + job.time_left
+        if job.get("runtimelimit") and job.get("run_time") is not None:
+            return now + job.runtimelimit - job.run_time
+
+    return None
+
+
+class PollSchedule:
+    """
+    Decides how long to wait before the next poll of bjobs: briefly after jobs are
+    submitted and around the time jobs are expected to start or finish, and
+    longer and longer while nothing happens. If bjobs gets slow, i.e. the scheduler
+    is busy, we poll less often too.
+    """
+
+    def __init__(self, base_interval: float):
+        """`base_interval` (in seconds) is used while jobs are changing."""
+        self.base_interval = base_interval
+        self.min_interval = min(MIN_INTERVAL_SECONDS, base_interval)
+        self.idle_interval = base_interval
+        self.latency = None  # running average of how long a poll takes
+
+    def next_interval(
+        self,
+        active_jobs: Iterable[Job],
+        changed: bool,
+        submitted: bool,
+        poll_duration: float,
+        now=None,
+    ) -> float:
+        """
+        Call after every poll. `changed` says whether the poll changed any jobs, and
+        `submitted` whether there are new jobs. Returns the interval in seconds.
+        """
+        now = now or time.time()
+
+        if self.latency is None:
+            self.latency = poll_duration
+        else:
+            self.latency += LATENCY_SMOOTHING * (poll_duration - self.latency)
+
+        active_jobs = list(active_jobs)
+        max_interval = max(MAX_INTERVAL_SECONDS, self.base_interval)
+
+        if changed:
+            self.idle_interval = self.base_interval
+        else:
+            self.idle_interval = min(self.idle_interval * 2, max_interval)
+
+        interval = self.min_interval if submitted else self.idle_interval
+
+        for job in active_jobs:
+            event_time = expected_event_time(job, now)
+            if event_time is not None and event_time > now - EVENT_GRACE_SECONDS:
+                until_event = event_time - now + EVENT_SLACK_SECONDS
+                interval = min(interval, max(until_event, self.min_interval))
+
+        return max(interval, LATENCY_FACTOR * self.latency)
@@ -0,0 +1,343 @@
+import datetime
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from . import parsing_bjobs
+from .history import JobHistory, is_finished
+from .job import Job, job_from_record
+from .job_index import SortedJobIndex, source_job_key
+from .poll_schedule import PollSchedule
+from .sources import Source
+from .util import LOG
+
+# Jobs that start and finish between two polls never show up as unfinished,
+# so once in a while, we ask bjobs about all jobs again.
+FULL_POLL_INTERVAL = datetime.timedelta(minutes=10)
+# Newly finished jobs are written to the history this many at a time, as they come
+# in, rather than keeping all of their records until bjobs is done.
+HISTORY_BATCH_SIZE = 1000
+
+
+class JobSnapshot(NamedTuple):
+    """An immutable view of the job list, as of one poll of `bjobs`."""
+
+    # Sorted from the newest job to the oldest.
+    jobs: Tuple[Job, ...] = ()
+    # When the jobs were fetched. None if no poll has succeeded yet.
+    time: Optional[datetime.datetime] = None
+    # Why the most recent poll failed, if it did.
+    error: Optional[str] = None
+    # Changes whenever `jobs` changes.
+    version: int = 0
+    # Whether the jobs are from the end of the previous session, see `snapshot_cache`.
+    cached: bool = False
+    # When the jobs of each source were fetched, as POSIX timestamps by source name.
+    # The run and pending times of unfinished jobs are as of then.
+    poll_times: Optional[Dict[str, float]] = None
+
+    def age(self) -> Optional[datetime.timedelta]:
+        if self.time is None:
+            return None
+        return datetime.datetime.now() - self.time
+
+
+class SourceState:
+    """
+    What we know about the jobs of one source, see `sources.Source`.
+
+    The records of finished jobs never change, so after the first poll, we only ask
+    bjobs about unfinished jobs. Finished jobs are kept in `history`, if given.
+    """
+
+    def __init__(
+        self,
+        source: Source,
+        bjobs_timeout: float,
+        fields=None,
+        history: Optional[JobHistory] = None,
+    ):
+        self.source = source
+        self.bjobs_timeout = bjobs_timeout
+        # Which fields to ask bjobs for. All of them if None.
+        self.fields = fields
+        self.history = history
+
+        self.finished_jobs = {}  # job key -> job
+        self.active_jobs = {}  # job key -> job
+        self.last_full_poll = None
+        # When the last successful poll finished, and why the last one failed.
+        self.last_success = None
+        self.error = None
+
+    def _bjobs(self, **kwargs):
+        return parsing_bjobs.iter_bjobs(
+            timeout=self.bjobs_timeout,
+            fields=self.fields,
+            source=self.source,
+            **kwargs,
+        )
+
+    def _needs_full_poll(self):
+        return (
+            self.last_full_poll is None
+            or datetime.datetime.now() - self.last_full_poll > FULL_POLL_INTERVAL
+        )
+
+    def _fetch_jobs(self):
+        """
+        Ask bjobs for all jobs whose records might have changed since last time.
+        The jobs are yielded as soon as they're parsed.
+        """
+        if self._needs_full_poll():
+            yield from self._bjobs()
+            self.last_full_poll = datetime.datetime.now()
+            return
+
+        still_active = set()
+        for job in self._bjobs(include_finished=False):
+            still_active.add(parsing_bjobs.job_key(job))
+            yield job
+
+        # The jobs that were running last time but aren't anymore have finished
+        # (or were killed), so we need to fetch their final state once.
+        gone = [job for key, job in self.active_jobs.items() if key not in still_active]
+        if gone:
+            yield from self._bjobs(
+                job_specs=[parsing_bjobs.job_spec(job) for job in gone]
+            )
+
+    def _to_job(self, record):
+        extra = {"source": self.source.name}
+        if self.fields:
+            # Fields can be missing if the cluster doesn't support them,
+            # or if the record is from a version of gjobs that used fewer fields.
+            record = {**{field: "" for field in self.fields}, **record}
+        return job_from_record({**record, **extra})
+
+    def _ingest(self, records, index, lock):
+        """
+        Consume the records from bjobs one by one, converting them to `Job`s and
+        adding them to `index`, which is shared with other sources (hence `lock`).
+        If `records` raises, the finished jobs seen so far are kept,
+        but the set of active jobs stays as it was.
+        """
+        newly_finished = []  # raw records not yet written to the history
+        requeued = []
+        active_jobs = {}
+
+        try:
+            for record in records:
+                job = self._to_job(record)
+                key = parsing_bjobs.job_key(job)
+
+                if is_finished(job):
+                    if key not in self.finished_jobs:
+                        newly_finished.append(record)
+                        if len(newly_finished) >= HISTORY_BATCH_SIZE:
+                            self._add_to_history(newly_finished)
+                            newly_finished = []
+                    self.finished_jobs[key] = job
+                else:
+                    active_jobs[key] = job
+                    if self.finished_jobs.pop(key, None) is not None:
+                        requeued.append(key)
+
+                with lock:
+                    index.set(job)
+
+            # Jobs that bjobs doesn't know about anymore, without a final state.
+            with lock:
+                for key in self.active_jobs.keys() - active_jobs.keys():
+                    if key not in self.finished_jobs:
+                        index.remove(key, self.source.name)
+
+            self.active_jobs = active_jobs
+        finally:
+            self._add_to_history(newly_finished)
+            if self.history is not None and requeued:
+                self.history.remove(requeued)
+
+    def _add_to_history(self, records):
+        if self.history is not None and records:
+            self.history.add(records)
+
+    def load_history(self, index, lock):
+        if self.history is None:
+            return
+
+        for record in self.history.load():
+            job = self._to_job(record)
+            self.finished_jobs[parsing_bjobs.job_key(job)] = job
+            with lock:
+                index.set(job)
+
+    def poll(self, index, lock):
+        try:
+            self._ingest(self._fetch_jobs(), index, lock)
+        except subprocess.TimeoutExpired:
+            self.error = f"bjobs timed out after {self.bjobs_timeout:g} s"
+        except Exception as e:
+            self.error = f"bjobs failed: {e}"
+        else:
+            self.error = None
+            self.last_success = datetime.datetime.now()
+
+        if self.error is not None:
+            LOG.append(f"{self.source.name}: {self.error}")
+
+    def close(self):
+        if self.history is not None:
+            self.history.close()
+
+
+class BjobsPoller:
+    """
+    Runs `bjobs` in a background thread so that the UI never waits for the scheduler.
+    The render loop only ever reads `snapshot`, which is replaced atomically.
+
+    Each source (cluster or user) is polled in its own worker thread, so a poll
+    takes as long as the slowest source rather than the sum of all of them.
+    A new snapshot is published whenever one of them is done.
+    """
+
+    def __init__(
+        self,
+        poll_interval: datetime.timedelta,
+        bjobs_timeout: float,
+        fields=None,
+        sources: Sequence[Source] = (Source(),),
+        histories: Optional[Dict[str, JobHistory]] = None,
+        adaptive=True,
+    ):
+        """
+        `histories` are the job histories of the sources, by source name.
+        If `adaptive` is set, `poll_interval` is only the interval while jobs are
+        changing, see `PollSchedule`. Otherwise, we always poll that often.
+        """
+        # The current interval between polls.
+        self.poll_interval = poll_interval
+        self.schedule = (
+            PollSchedule(poll_interval.total_seconds()) if adaptive else None
+        )
+        self.bjobs_timeout = bjobs_timeout
+        self.sources = list(sources)
+        histories = histories or {}
+        self.states = [
+            SourceState(source, bjobs_timeout, fields, histories.get(source.name))
+            for source in self.sources
+        ]
+        self.snapshot = JobSnapshot()
+        # Called from the poller thread whenever `snapshot` is replaced.
+        self.listeners = []
+        # Set once all sources have been polled (successfully or not).
+        self.ready = threading.Event()
+
+        # The jobs of all sources, sorted.
+        self.index = SortedJobIndex()
+        self._index_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="bjobs-poller", daemon=True
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.states), thread_name_prefix="bjobs-source"
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        """Free the worker threads and the histories, once we're done polling."""
+        self._executor.shutdown()
+        for state in self.states:
+            state.close()
+
+    def _make_snapshot(self):
+        errors = [state for state in self.states if state.error is not None]
+        if len(self.states) == 1:
+            error = errors[0].error if errors else None
+        else:
+            error = "; ".join(f"{s.source.name}: {s.error}" for s in errors) or None
+
+        # The data is only as fresh as that of the least recently polled source.
+        times = [state.last_success for state in self.states]
+        poll_times = {
+            state.source.name: state.last_success.timestamp()
+            for state in self.states
+            if state.last_success is not None
+        }
+        with self._index_lock:
+            return JobSnapshot(
+                self.index.jobs(),
+                None if None in times else min(times),
+                error,
+                self.index.version,
+                poll_times=poll_times,
+            )
+
+    def _publish(self, snapshot):
+        self.snapshot = snapshot
+        for listener in self.listeners:
+            listener()
+
+    def poll_once(self):
+        futures = [
+            self._executor.submit(state.poll, self.index, self._index_lock)
+            for state in self.states
+        ]
+        for future in as_completed(futures):
+            future.result()
+            self._publish(self._make_snapshot())
+
+    def _job_states(self):
+        """
+        The status of every unfinished job. The records of running jobs change at
+        every poll (their run time grows), so this is what tells us if anything
+        happened.
+        """
+        return {
+            (state.source.name, key): job.stat
+            for state in self.states
+            for key, job in state.active_jobs.items()
+        }
+
+    def _newest_job_key(self):
+        """Job IDs only go up, so this changes when jobs are submitted."""
+        jobs = self.index.jobs()
+        return source_job_key(jobs[0]) if jobs else None
+
+    def _run(self):
+        for state in self.states:
+            state.load_history(self.index, self._index_lock)
+        self._publish(self._make_snapshot())
+
+        while not self._stop.is_set():
+            job_states = self._job_states()
+            newest = self._newest_job_key()
+            start = time.perf_counter()
+            self.poll_once()
+            self.ready.set()
+
+            if self.schedule is not None:
+                interval = self.schedule.next_interval(
+                    [
+                        job
+                        for state in self.states
+                        for job in state.active_jobs.values()
+                    ],
+                    changed=self._job_states() != job_states,
+                    submitted=newest != self._newest_job_key(),
+                    poll_duration=time.perf_counter() - start,
+                )
+                self.poll_interval = datetime.timedelta(seconds=interval)
+
+            self._stop.wait(self.poll_interval.total_seconds())
+
+        self.close()
@@ -0,0 +1,89 @@
+import os
+import select
+import signal
+import threading
+
+# The parts of the screen that can be recomputed independently.
+TABLE = "table"
+PREVIEW = "preview"
+STATUS = "status"
+ALL_REGIONS = frozenset([TABLE, PREVIEW, STATUS])
+
+
+class RedrawScheduler:
+    """
+    Lets the main loop sleep until something happens that might change the screen:
+    a keypress, a new snapshot from the poller, a terminal resize, or a timeout
+    for things we need to check periodically. It also keeps track of which regions
+    of the screen are dirty, i.e. need to be recomputed.
+
+    `wake()` can be called from any thread, but not from signal handlers: it takes a
+    lock that the main thread might be holding. The resize handler only sets a flag
+    and writes to the wake pipe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set(ALL_REGIONS)
+        # Writing to this pipe wakes up `wait()`.
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._old_sigwinch = None
+        # Set by the SIGWINCH handler, which runs on the main thread.
+        self._resized = False
+
+    def mark_dirty(self, *regions):
+        with self._lock:
+            self._dirty.update(regions or ALL_REGIONS)
+
+    def wake(self, *regions):
+        """Mark `regions` (all of them if none are given) dirty and wake up `wait()`."""
+        self.mark_dirty(*regions)
+        self._write_wake()
+
+    def _write_wake(self):
+        try:
+            os.write(self._wake_write, b"x")
+        except BlockingIOError:
+            pass  # The pipe is full, so `wait()` will wake up anyway.
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def wait(self, fds, timeout=None):
+        """
+        Sleep until one of `fds` is readable, `wake()` is called or `timeout` seconds
+        pass (forever if None). Returns the readable fds among `fds`.
+        """
+        readable, _, _ = select.select([*fds, self._wake_read], [], [], timeout)
+
+        if self._wake_read in readable:
+            try:
+                while os.read(self._wake_read, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+        if self._resized:
+            self._resized = False
+            self.mark_dirty()
+
+        return [fd for fd in readable if fd != self._wake_read]
+
+    def watch_resize(self):
+        """Redraw everything when the terminal is resized."""
+        self._old_sigwinch = signal.signal(signal.SIGWINCH, self._on_resize)
+
+    def _on_resize(self, *_):
+        # No locks here: the main thread could be interrupted while holding one.
+        self._resized = True
+        self._write_wake()
+
+    def close(self):
+        if self._old_sigwinch is not None:
+            signal.signal(signal.SIGWINCH, self._old_sigwinch)
+        os.close(self._wake_read)
+        os.close(self._wake_write)
@@ -0,0 +1,167 @@
+import array
+import collections
+import math
+from typing import Dict, Optional
+
+from .job_index import diff_by_identity, source_job_key
+from .metrics import METRICS
+
+# What is sampled from each poll of a running job. The run time says when.
+SAMPLED_FIELDS = (
+    "run_time",
+    "mem",
+    "max_mem",
+    "avg_mem",
+    "swap",
+    "cpu_used",
+    "nthreads",
+)
+# How many samples to keep per job. Once a job has run for longer, pairs of samples
+# are merged, so that the samples always cover the whole run.
+MAX_SAMPLES = 64
+# Jobs that haven't been sampled for the longest are forgotten after this many.
+MAX_TRACKED_JOBS = 10000
+
+
+def merge_values(a, b):
+    """The larger of two samples, so that peaks aren't averaged away. NaN is missing."""
+    if math.isnan(a) or b > a:
+        return b
+    return a
+
+
+class ResourceSeries:
+    """
+    The resource usage of one job over time. The samples are stored as 32-bit floats
+    in a single array of fixed size, one row of SAMPLED_FIELDS per sample. When it
+    is full, pairs of rows are merged and each row covers twice as many polls.
+    """
+
+    __slots__ = ("_rows", "length", "polls_per_sample", "_polls_in_last")
+
+    def __init__(self):
+        self._rows = array.array("f", [math.nan]) * (MAX_SAMPLES * len(SAMPLED_FIELDS))
+        self.length = 0
+        self.polls_per_sample = 1
+        self._polls_in_last = 0
+
+    def add(self, values):
+        """Add the values of SAMPLED_FIELDS from one poll."""
+        n_fields = len(SAMPLED_FIELDS)
+        if self.length and self._polls_in_last < self.polls_per_sample:
+            # Part of the same sample as the previous poll.
+            start = (self.length - 1) * n_fields
+            self._polls_in_last += 1
+        else:
+            if self.length == MAX_SAMPLES:
+                self._halve()
+            start = self.length * n_fields
+            self.length += 1
+            self._polls_in_last = 1
+            self._rows[start : start + n_fields] = array.array("f", values)
+            return
+
+        for i, value in enumerate(values):
+            self._rows[start + i] = merge_values(self._rows[start + i], value)
+
+    def _halve(self):
+        n_fields = len(SAMPLED_FIELDS)
+        rows = self._rows
+        for i in range(MAX_SAMPLES // 2):
+            for j in range(n_fields):
+                rows[i * n_fields + j] = merge_values(
+                    rows[2 * i * n_fields + j], rows[(2 * i + 1) * n_fields + j]
+                )
+        rows[MAX_SAMPLES // 2 * n_fields :] = array.array("f", [math.nan]) * (
+            MAX_SAMPLES // 2 * n_fields
+        )
+        self.length = MAX_SAMPLES // 2
+        self.polls_per_sample *= 2
+        self._polls_in_last = self.polls_per_sample
+
+    def values(self, field) -> array.array:
+        """The samples of `field`, the oldest first. NaN where bjobs gave no value."""
+        n_fields = len(SAMPLED_FIELDS)
+        start = SAMPLED_FIELDS.index(field)
+        return self._rows[start : self.length * n_fields : n_fields]
+
+    def cpu_cores(self) -> array.array:
+        """How many cores the job kept busy between each sample and the previous one."""
+        cpu_used = self.values("cpu_used")
+        run_time = self.values("run_time")
+        return array.array(
+            "f",
+            [
+                (
+                    (cpu_used[i] - cpu_used[i - 1]) / (run_time[i] - run_time[i - 1])
+                    if run_time[i] > run_time[i - 1]
+                    else math.nan
+                )
+                for i in range(1, self.length)
+            ],
+        )
+
+    def last(self, field) -> Optional[float]:
+        if not self.length:
+            return None
+        value = self.values(field)[-1]
+        return None if math.isnan(value) else value
+
+
+def sample_values(job):
+    values = []
+    for field in SAMPLED_FIELDS:
+        try:
+            # nthreads comes as a string, bjobs gives no unit for it.
+            values.append(float(job.get(field)))
+        except (TypeError, ValueError):
+            values.append(math.nan)
+    return values
+
+
+class ResourceHistory:
+    """
+    Samples the resource usage of running jobs from every snapshot, so that e.g. a
+    job whose memory keeps growing can be spotted before it hits its limit. Only the
+    jobs that changed since the previous snapshot are looked at; a running job
+    changes at every poll, since its run time grows.
+    """
+
+    REQUIRED_FIELDS = ["stat", "memlimit", *SAMPLED_FIELDS]
+
+    def __init__(self):
+        # source_job_key -> ResourceSeries, the least recently sampled first.
+        self.series: Dict[tuple, ResourceSeries] = collections.OrderedDict()
+        self._jobs_by_id = {}
+        self._version = None
+
+    def update(self, snapshot):
+        """Sample the running jobs of `snapshot`, if it's one we haven't seen."""
+        if snapshot.cached or snapshot.version == self._version:
+            return  # the values of a cached one are from the previous session
+        self._version = snapshot.version
+        self._jobs_by_id, removed, added = diff_by_identity(
+            self._jobs_by_id, snapshot.jobs
+        )
+        if not removed and not added:
+            return
+
+        with METRICS.timer("resource sampling"):
+            for job in added:
+                if job.get("stat") != "RUN":
+                    continue
+                key = source_job_key(job)
+                series = self.series.get(key)
+                if series is None:
+                    series = self.series[key] = ResourceSeries()
+                    if len(self.series) > MAX_TRACKED_JOBS:
+                        self.series.popitem(last=False)
+                else:
+                    if series.last("run_time") == job.get("run_time"):
+                        # The same poll, published again, e.g. with several sources.
+                        continue
+                    self.series.move_to_end(key)
+                series.add(sample_values(job))
+
+    def get(self, job) -> Optional[ResourceSeries]:
+        return self.series.get(source_job_key(job))
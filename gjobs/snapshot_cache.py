@@ -0,0 +1,70 @@
+import datetime
+import json
+import os
+import re
+from typing import Optional, Sequence
+
+from .job import Job
+from .poller import JobSnapshot
+from .sources import Source
+from .util import LOG, cache_dir, write_atomically
+
+# Jobs from longer ago than this are more misleading than helpful.
+MAX_SNAPSHOT_AGE = datetime.timedelta(days=7)
+# Live snapshots start at version 0, so views of them are never mistaken for this.
+CACHED_VERSION = -1
+
+
+def snapshot_path(sources: Sequence[Source]):
+    """One file per set of sources, since a snapshot contains the jobs of all of them."""
+    if list(sources) == [Source()]:
+        return os.path.join(cache_dir(), "snapshot.json")
+    names = "+".join(source.name for source in sources)
+    return os.path.join(
+        cache_dir(), f"snapshot-{re.sub(r'[^A-Za-z0-9_.+-]', '_', names)}.json"
+    )
+
+
+def save_snapshot(snapshot: JobSnapshot, sources: Sequence[Source], path=None):
+    """Save the jobs we're exiting with, to show them right away next time."""
+    path = path or snapshot_path(sources)
+    data = {
+        "time": snapshot.time.timestamp(),
+        "jobs": [job.to_dict() for job in snapshot.jobs],
+    }
+    try:
+        write_atomically(path, json.dumps(data, separators=(",", ":")))
+    except (OSError, TypeError, ValueError) as e:
+        LOG.append(f"Could not save the job list to {path}: {e}")
+
+
+def load_snapshot(
+    sources: Sequence[Source], fields=None, path=None
+) -> Optional[JobSnapshot]:
+    """
+    The jobs saved by `save_snapshot()`, marked as `cached`. None if there are none,
+    they're too old or they lack some of `fields` (e.g. after an upgrade).
+    """
+    path = path or snapshot_path(sources)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        LOG.append(f"Could not load the job list from {path}: {e}")
+        return None
+
+    try:
+        time = datetime.datetime.fromtimestamp(data["time"])
+        jobs = tuple(Job.from_dict(job) for job in data["jobs"])
+    except (KeyError, TypeError, AttributeError, ValueError, OverflowError) as e:
+        # Written by something else, or by a version of gjobs that saved it differently.
+        LOG.append(f"Ignoring the malformed job list in {path}: {e!r}")
+        return None
+
+    if datetime.datetime.now() - time > MAX_SNAPSHOT_AGE:
+        return None
+    if fields and jobs and not set(fields) <= set(jobs[0].FIELDS):
+        return None
+    return JobSnapshot(jobs, time, version=CACHED_VERSION, cached=True)
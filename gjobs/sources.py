@@ -0,0 +1,85 @@
+import json
+import os
+import re
+from typing import NamedTuple, Optional, Tuple
+
+from .util import LOG
+
+LOCAL_SOURCE_NAME = "local"
+
+
+class Source(NamedTuple):
+    """
+    Where to get jobs from: a cluster, given by the LSF environment variables
+    (usually just LSF_ENVDIR), and optionally the user whose jobs we want.
+    """
+
+    name: str = LOCAL_SOURCE_NAME
+    # Environment variables to set when running bjobs, as (name, value) pairs.
+    env: Tuple[Tuple[str, str], ...] = ()
+    # Passed to `bjobs -u`. Our own jobs if None.
+    user: Optional[str] = None
+
+    def history_file(self):
+        if self == Source():
+            # The name from before gjobs supported several sources.
+            return "history.sqlite"
+        return f"history-{re.sub(r'[^A-Za-z0-9_.-]', '_', self.name)}.sqlite"
+
+
+def config_path():
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(base, "gjobs", "config.json")
+
+
+def source_from_config(entry):
+    """
+    e.g. {"name": "euler", "env": {"LSF_ENVDIR": "/cluster/apps/lsf/conf"}, "user": "me"}
+    """
+    return Source(
+        name=str(entry["name"]),
+        env=tuple(sorted((str(k), str(v)) for k, v in entry.get("env", {}).items())),
+        user=entry.get("user"),
+    )
+
+
+def source_to_config(source):
+    """The inverse of `source_from_config()`."""
+    return {"name": source.name, "env": dict(source.env), "user": source.user}
+
+
+def load_sources(path=None, user=None):
+    """
+    The sources listed in the config file, or the local cluster if there is none.
+    If `user` is given, it's used for the sources that don't specify one.
+    """
+    path = path or config_path()
+    sources = [Source()]
+
+    try:
+        with open(path) as f:
+            config = json.load(f)
+        configured = [source_from_config(entry) for entry in config["sources"]]
+    except FileNotFoundError:
+        configured = []
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        LOG.append(f"Ignoring invalid config file {path}: {e!r}")
+        configured = []
+
+    if configured:
+        names = [source.name for source in configured]
+        if len(set(names)) != len(names):
+            LOG.append(f"Ignoring {path}: source names must be unique")
+        else:
+            sources = configured
+
+    if user is not None:
+        sources = [
+            source._replace(user=user) if source.user is None else source
+            for source in sources
+        ]
+        if sources == [Source(user=user)]:
+            # Keep the history separate from that of our own jobs.
+            sources = [Source(name=user, user=user)]
+
+    return sources
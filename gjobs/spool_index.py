@@ -0,0 +1,117 @@
+import collections
+import os
+import re
+import time
+from typing import Dict, Optional
+
+from .metrics import METRICS
+from .util import LOG
+
+# Where LSF keeps the output of running jobs. Can be overridden with the
+# GJOBS_LSBATCH_DIR environment variable.
+DEFAULT_LSBATCH_DIR = "/cluster/shadow/.lsbatch"
+# The spooled output of job 1234 is called e.g. "1699999999.1234.out".
+OUTPUT_FILE_REGEX = re.compile(r"(?:^|\.)(\d+)\.out$")
+
+# How long to remember that a job has no output file yet, in seconds.
+NEGATIVE_TTL = 10
+# How many lookups to remember.
+MAX_CACHED_LOOKUPS = 1024
+# Some filesystems only store the modification time with a precision of a second
+# or so, so a file created right after a scan might not change the mtime we saw.
+MTIME_GRANULARITY = 2
+
+
+def lsbatch_dir():
+    return os.environ.get("GJOBS_LSBATCH_DIR") or DEFAULT_LSBATCH_DIR
+
+
+class SpoolIndex:
+    """
+    Finds the output files of running jobs in the lsbatch spool directory. The
+    directory can contain tens of thousands of files, so instead of scanning it for
+    every job, we scan it once into a job ID -> path index and only scan again when
+    the directory's mtime changes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or lsbatch_dir()
+        self._index = {}
+        self._mtime = None
+        # job ID -> (path or None, when we looked), the least recently used first.
+        self._lookups = collections.OrderedDict()
+        # The last error, so that it's only logged once rather than at every lookup.
+        self._error = None
+
+    def _log_error(self, error):
+        if error != self._error:
+            LOG.append(error)
+            self._error = error
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            self._log_error(f"Can't access {self.path}: {e}")
+            self._index = {}
+            self._mtime = None
+            return
+
+        if mtime == self._mtime:
+            return
+
+        scan_time = time.time_ns()
+        METRICS.count("spool directory scans")
+        index = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    match = OUTPUT_FILE_REGEX.search(entry.name)
+                    if match is None:
+                        continue
+                    job_id = match.group(1)
+                    if job_id in index:
+                        LOG.append(
+                            f"Warning: more than one output file found for {job_id}: "
+                            f"{index[job_id]}, {entry.path}"
+                        )
+                    else:
+                        index[job_id] = entry.path
+        except OSError as e:
+            self._log_error(f"Can't scan {self.path}: {e}")
+            return
+
+        self._error = None
+        self._index = index
+        if scan_time - mtime > MTIME_GRANULARITY * 10**9:
+            self._mtime = mtime
+        else:
+            # Files created after the scan might not change the mtime; scan again.
+            self._mtime = None
+
+    def find(self, job_id) -> Optional[str]:
+        """The path of the output file of running job `job_id`, or None."""
+        job_id = str(job_id)
+        now = time.monotonic()
+        cached = self._lookups.get(job_id)
+
+        if cached is not None:
+            path, looked_at = cached
+            if path is not None or now - looked_at < NEGATIVE_TTL:
+                self._lookups.move_to_end(job_id)
+                return path
+
+        self._refresh()
+        path = self._index.get(job_id)
+
+        self._lookups[job_id] = (path, now)
+        self._lookups.move_to_end(job_id)
+        if len(self._lookups) > MAX_CACHED_LOOKUPS:
+            self._lookups.popitem(last=False)
+
+        return path
+
+    def all(self) -> Dict[str, str]:
+        """The output files of all running jobs, as job ID -> path."""
+        self._refresh()
+        return dict(self._index)
@@ -1,7 +1,11 @@
+import collections
 import datetime
+import os
+import tempfile
 
-# A simple way to log stuff when in fullscreen mode
-LOG = []
+# A simple way to log stuff when in fullscreen mode. Only the most recent messages
+# are kept, so that it doesn't grow without limit in long sessions.
+LOG = collections.deque(maxlen=1000)
 
 
 class PeriodicTimer:
@@ -17,3 +21,33 @@ class PeriodicTimer:
             return True
         else:
             return False
+
+
+def cache_dir():
+    """Where gjobs keeps data between sessions. Created if it doesn't exist."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    path = os.path.join(base, "gjobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def environment(overrides):
+    """
+    The environment for a subprocess, with `overrides` ((name, value) pairs) applied.
+    None, i.e. our own environment, if there are no overrides.
+    """
+    if not overrides:
+        return None
+    return {**os.environ, **dict(overrides)}
+
+
+def write_atomically(path, data: str):
+    """Other gjobs sessions never see a half-written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
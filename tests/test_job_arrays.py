@@ -0,0 +1,115 @@
+import collections
+import random
+
+import pytest
+
+from gjobs.job import Job
+from gjobs.job_arrays import ArrayGrouping, JobArray, is_array_element
+from gjobs.job_index import SortedJobIndex, job_sort_key
+
+STATS = ["RUN", "PEND", "DONE", "EXIT"]
+
+
+def make_job(rng, jobid, jobindex, source):
+    run_time = rng.randint(0, 100) if rng.random() < 0.8 else None
+    return Job.from_dict(
+        {
+            "jobid": str(jobid),
+            "jobindex": str(jobindex),
+            "stat": rng.choice(STATS),
+            "job_name": f"job_{jobid}[{jobindex}]" if jobindex else f"job_{jobid}",
+            "run_time": run_time,
+            "submit_time": 1700000000.0 + jobid,
+            "source": source,
+        }
+    )
+
+
+def change_jobs(rng, index):
+    """Add, change and remove a few random jobs and array elements."""
+    for _ in range(rng.randint(0, 20)):
+        jobid = rng.randint(1, 30)
+        # Some job IDs are arrays, the others single jobs.
+        jobindex = rng.randint(1, 6) if jobid % 3 else 0
+        source = rng.choice(["a", "b"])
+        if rng.random() < 0.3:
+            index.remove((str(jobid), str(jobindex)), source)
+        else:
+            index.set(make_job(rng, jobid, jobindex, source))
+
+
+def describe(row):
+    """What a row shows, to compare rows made in different ways."""
+    if isinstance(row, JobArray):
+        stats = row.run_time_stats()
+        return (
+            "array",
+            row.jobid,
+            row.source,
+            row.job_name,
+            dict(row.counts),
+            stats,
+            job_sort_key(row.representative()),
+        )
+    return "job", id(row)
+
+
+def expected_rows(jobs, expanded):
+    """The rows from scratch: every array grouped, then everything sorted."""
+    rows = []
+    elements = collections.defaultdict(list)
+    for job in jobs:
+        if is_array_element(job):
+            elements[(job.jobid, job.source)].append(job)
+        else:
+            rows.append((job_sort_key(job), describe(job)))
+
+    for (jobid, source), array_jobs in elements.items():
+        array_jobs.sort(key=job_sort_key)
+        run_times = sorted(
+            job.run_time for job in array_jobs if job.run_time is not None
+        )
+        running = [job for job in array_jobs if job.stat == "RUN"]
+        rows.append(
+            (
+                (-int(jobid), -1, source),
+                (
+                    "array",
+                    jobid,
+                    source,
+                    f"job_{jobid}",
+                    dict(collections.Counter(job.stat for job in array_jobs)),
+                    (
+                        (run_times[0], run_times[len(run_times) // 2], run_times[-1])
+                        if run_times
+                        else None
+                    ),
+                    job_sort_key((running or array_jobs)[0]),
+                ),
+            )
+        )
+        if (jobid, source) in expanded:
+            rows += [(job_sort_key(job), describe(job)) for job in array_jobs]
+
+    return [row for _, row in sorted(rows)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_grouping_matches_brute_force(seed):
+    rng = random.Random(seed)
+    index = SortedJobIndex()
+    grouping = ArrayGrouping()
+
+    for _ in range(100):
+        change_jobs(rng, index)
+        jobs = index.jobs()
+        # Expand and collapse the arrays of this snapshot.
+        grouping.rows(jobs)
+        for _ in range(rng.randint(0, 2)):
+            if grouping.arrays:
+                grouping.toggle(rng.choice(list(grouping.arrays.values())))
+        rows = grouping.rows(jobs)
+
+        assert [describe(row) for row in rows] == expected_rows(jobs, grouping.expanded)
+        for array in grouping.arrays.values():
+            assert rows[grouping.row_index(array)] is array
@@ -0,0 +1,123 @@
+import datetime
+import random
+import re
+
+import pytest
+
+from gjobs.job import Job
+from gjobs.job_filter import JobFilter
+from gjobs.job_index import SortedJobIndex, exec_hosts, update_sorted
+from gjobs.poller import JobSnapshot
+
+STATS = ["RUN", "PEND", "DONE", "EXIT"]
+QUEUES = ["normal.4h", "gpu.24h", "bigmem.120h", ""]
+NAMES = ["train", "train_big", "eval", "sweep_3", "prep", ""]
+HOSTS = ["", "eu-g1-001", "4*eu-g1-002:2*eu-a2-003", "eu-a2-003"]
+START = datetime.datetime(2024, 3, 1).timestamp()
+
+# Typing one of these in parts exercises the searches that narrow down earlier ones.
+FILTER_WORDS = [
+    "stat:RUN",
+    "stat:run,pend",
+    "queue:gpu",
+    "queue:GPU",
+    "q",
+    "t",
+    "tr",
+    "trai",
+    "train",
+    "name:train_",
+    "name:/^(eval|prep)$/",
+    "name:/_\\d/",
+    "host:g1",
+    "host:a2-003",
+    "since:2024-03-01T06:00",
+    "until:2024-03-01T18:00",
+]
+
+
+def make_job(rng, jobid, source):
+    submit_time = START + rng.randint(0, 24 * 3600) if rng.random() < 0.9 else None
+    return Job.from_dict(
+        {
+            "jobid": str(jobid),
+            "jobindex": "0",
+            "stat": rng.choice(STATS),
+            "queue": rng.choice(QUEUES),
+            "job_name": rng.choice(NAMES),
+            "exec_host": rng.choice(HOSTS),
+            "submit_time": submit_time,
+            "source": source,
+        }
+    )
+
+
+def change_jobs(rng, index):
+    """Add, change and remove a few random jobs, as a poll would."""
+    for _ in range(rng.randint(0, 20)):
+        jobid = rng.randint(1, 200)
+        source = rng.choice(["a", "b"])
+        if rng.random() < 0.3:
+            index.remove((str(jobid), "0"), source)
+        else:
+            index.set(make_job(rng, jobid, source))
+
+
+def matches_word(job, word):
+    """What a word of a filter means, looking at the job itself."""
+    field, _, value = word.partition(":")
+    if field == "stat":
+        return job.stat in value.upper().split(",")
+    if field == "queue":
+        return bool(job.queue) and value.lower() in job.queue.lower()
+    if field == "host":
+        return any(value.lower() in host.lower() for host in exec_hosts(job))
+    if field in ["since", "until"]:
+        if job.submit_time is None:
+            return False
+        timestamp = datetime.datetime.fromisoformat(value).timestamp()
+        if field == "since":
+            return job.submit_time >= timestamp
+        return job.submit_time < timestamp
+
+    name = value if field == "name" else word
+    if not job.job_name:
+        return False
+    if name.startswith("/") and name.endswith("/"):
+        return re.search(name[1:-1], job.job_name) is not None
+    return name.lower() in job.job_name.lower()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_filter_matches_brute_force(seed):
+    rng = random.Random(seed)
+    index = SortedJobIndex()
+    job_filter = JobFilter()
+
+    for _ in range(100):
+        change_jobs(rng, index)
+        snapshot = JobSnapshot(index.jobs(), version=index.version)
+        if rng.random() < 0.5:
+            job_filter.set_text(" ".join(rng.sample(FILTER_WORDS, rng.randint(0, 3))))
+
+        words = job_filter.text.split()
+        expected = tuple(
+            job
+            for job in snapshot.jobs
+            if all(matches_word(job, word) for word in words)
+        )
+        assert job_filter.view(snapshot) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_update_sorted(seed):
+    rng = random.Random(seed)
+    items = []
+    for _ in range(100):
+        # The items are unique keys. A changed one is removed and added again.
+        removed = rng.sample(items, rng.randint(0, min(len(items), 5)))
+        kept = set(items) - set(removed)
+        added = {rng.randint(0, 1000) for _ in range(rng.randint(0, 5))} - kept
+        added |= set(rng.sample(removed, rng.randint(0, len(removed))))
+        items = update_sorted(items, removed, list(added))
+        assert items == sorted(kept | added)
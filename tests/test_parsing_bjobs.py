@@ -0,0 +1,42 @@
+import io
+import json
+
+import pytest
+
+from gjobs.parsing_bjobs import iter_records
+
+RECORDS = [
+    {"JOBID": "1", "JOB_NAME": "plain", "STAT": "RUN"},
+    # Multi-byte characters get split between chunks.
+    {"JOBID": "2", "JOB_NAME": "café → 日本語 🚀", "STAT": "PEND"},
+    {"JOBID": "3", "JOB_NAME": 'quotes " and ] and , inside', "STAT": "DONE"},
+    {"JOBID": "4", "JOB_NAME": "ü" * 100, "STAT": "EXIT"},
+]
+
+
+def bjobs_output(records, separator=","):
+    return (
+        f'{{"COMMAND":"bjobs","JOBS":{len(records)},"RECORDS":[\n'
+        + separator.join(json.dumps(record, ensure_ascii=False) for record in records)
+        + "\n]}\n"
+    ).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1024 * 1024])
+@pytest.mark.parametrize("separator", [",", ",\n  "])
+def test_records_split_across_chunks(chunk_size, separator):
+    stream = io.BytesIO(bjobs_output(RECORDS, separator))
+    assert list(iter_records(stream, chunk_size=chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1024])
+def test_no_jobs(chunk_size):
+    stream = io.BytesIO(b'{"COMMAND":"bjobs","JOBS":0}\n')
+    assert list(iter_records(stream, chunk_size=chunk_size)) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1024])
+def test_truncated_output(chunk_size):
+    stream = io.BytesIO(bjobs_output(RECORDS)[:-20])
+    with pytest.raises(ValueError):
+        list(iter_records(stream, chunk_size=chunk_size))
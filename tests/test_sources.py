@@ -0,0 +1,85 @@
+import datetime
+import os
+import sys
+import time
+
+import pytest
+
+from gjobs.poller import BjobsPoller
+from gjobs.sources import Source
+
+FAKE_BJOBS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fake_bjobs.py"
+)
+N_JOBS = 20
+# Far enough apart that a busy machine can't blur the difference between polling
+# the sources in parallel and one after the other.
+FAST_LATENCY = 1.0
+SLOW_LATENCY = 4.0
+# Between the two, with plenty of room for starting Python.
+TIMEOUT = 2.5
+
+
+@pytest.fixture
+def make_source(tmp_path, monkeypatch):
+    """Sources whose bjobs is the fake one, answering after the given latency."""
+    # Keep the cache of unsupported fields out of the way.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    bjobs = tmp_path / "bjobs"
+    bjobs.write_text(f'#!/bin/sh\nexec {sys.executable} {FAKE_BJOBS} "$@"\n')
+    bjobs.chmod(0o755)
+
+    def make_source(name, latency, seed):
+        env = {
+            "PATH": f"{tmp_path}{os.pathsep}{os.environ.get('PATH', '')}",
+            "FAKE_BJOBS_JOBS": str(N_JOBS),
+            "FAKE_BJOBS_LATENCY": str(latency),
+            "FAKE_BJOBS_SEED": str(seed),
+        }
+        return Source(name=name, env=tuple(sorted(env.items())))
+
+    return make_source
+
+
+def poll_once(sources, bjobs_timeout):
+    poller = BjobsPoller(
+        datetime.timedelta(seconds=10), bjobs_timeout, sources=sources, adaptive=False
+    )
+    start = time.perf_counter()
+    poller.poll_once()
+    duration = time.perf_counter() - start
+    poller.close()
+    return poller, duration
+
+
+def test_sources_are_merged_and_polled_in_parallel(make_source):
+    fast = make_source("fast", FAST_LATENCY, seed=1)
+    slow = make_source("slow", SLOW_LATENCY, seed=2)
+    poller, duration = poll_once([fast, slow], bjobs_timeout=30)
+
+    snapshot = poller.snapshot
+    assert snapshot.error is None
+    assert len(snapshot.jobs) == 2 * N_JOBS
+    assert (
+        sorted(job.source for job in snapshot.jobs)
+        == ["fast"] * N_JOBS + ["slow"] * N_JOBS
+    )
+    assert set(snapshot.poll_times) == {"fast", "slow"}
+    # As long as the slowest source, not both of them one after the other.
+    assert SLOW_LATENCY <= duration < FAST_LATENCY + SLOW_LATENCY
+
+
+def test_timeout_only_fails_the_slow_source(make_source):
+    fast = make_source("fast", FAST_LATENCY, seed=1)
+    slow = make_source("slow", SLOW_LATENCY, seed=2)
+    poller, duration = poll_once([fast, slow], bjobs_timeout=TIMEOUT)
+
+    fast_state, slow_state = poller.states
+    assert fast_state.error is None
+    assert slow_state.error == f"bjobs timed out after {TIMEOUT:g} s"
+    assert poller.snapshot.error == f"slow: {slow_state.error}"
+    assert {job.source for job in poller.snapshot.jobs} == {"fast"}
+    assert len(poller.snapshot.jobs) == N_JOBS
+    assert set(poller.snapshot.poll_times) == {"fast"}
+    # The slow bjobs was killed rather than waited for.
+    assert duration < SLOW_LATENCY